@@ -1,8 +1,8 @@
 import re
+from types import MappingProxyType
 
 # Define patterns for tokens
 patterns = [
-    [r"print","print"],
     [r"\d*\.\d+|\d+\.\d*|\d+", "number"],
     [r"[a-zA-Z_][a-zA-Z0-9_]*", "identifier"],  # identifiers
     [r"\+", "+"],
@@ -27,6 +27,11 @@ patterns = [
     [r".","error"]
 ]
 
+# Keywords are matched by the identifier pattern and then looked up here
+keywords = MappingProxyType({
+    "print": "print",
+})
+
 for pattern in patterns:
     pattern[0] = re.compile(pattern[0]) 
 
@@ -42,6 +47,8 @@ def tokenize(characters):
         # (process errors)
         if tag == "error":
             raise Exception("Syntax error")
+        if tag == "identifier":
+            tag = keywords.get(match.group(0), tag)
         token = {
             "tag":tag,
             "position":position,
@@ -122,6 +129,16 @@ def test_identifier_tokens():
 
 
 
+def test_keyword_prefixes():
+    print("test keyword prefixes")
+    for s in ["printer", "iffy", "elsewhere", "whiles", "functional", "returned", "order", "android", "notable", "print_"]:
+        t = tokenize(s)
+        assert len(t) == 2
+        assert t[0]["tag"] == "identifier", f"expected identifier, got {t[0]}"
+        assert t[0]["value"] == s
+    t = tokenize("print printer")
+    assert [token["tag"] for token in t] == ["print", "identifier", None]
+
 def test_error():
     print("test error")
     try:
@@ -137,4 +154,5 @@ if __name__ == "__main__":
     test_whitespace()
     test_keywords()
     test_identifier_tokens()
+    test_keyword_prefixes()
     test_error()
\ No newline at end of file
@@ -1,18 +1,8 @@
 import re
+from types import MappingProxyType
 
 # Define patterns for tokens
 patterns = [
-    [r"print","print"],
-    [r"if","if"],
-    [r"else","else"],
-    [r"while","while"],
-    [r"continue","continue"],
-    [r"break","break"],
-    [r"return","return"],
-    [r"assert","assert"],
-    [r"and","&&"],
-    [r"or","||"],
-    [r"not","!"],
     [r"\d*\.\d+|\d+\.\d*|\d+", "number"],
     [r"[a-zA-Z_][a-zA-Z0-9_]*", "identifier"],  # identifiers
     [r"\+", "+"],
@@ -42,6 +32,21 @@ patterns = [
     [r".","error"]
 ]
 
+# Keywords are matched by the identifier pattern and then looked up here
+keywords = MappingProxyType({
+    "print": "print",
+    "if": "if",
+    "else": "else",
+    "while": "while",
+    "continue": "continue",
+    "break": "break",
+    "return": "return",
+    "assert": "assert",
+    "and": "&&",
+    "or": "||",
+    "not": "!",
+})
+
 for pattern in patterns:
     pattern[0] = re.compile(pattern[0]) 
 
@@ -57,6 +62,8 @@ def tokenize(characters):
         # (process errors)
         if tag == "error":
             raise Exception("Syntax error")
+        if tag == "identifier":
+            tag = keywords.get(match.group(0), tag)
         token = {
             "tag":tag,
             "position":position,
@@ -137,6 +144,16 @@ def test_identifier_tokens():
 
 
 
+def test_keyword_prefixes():
+    print("test keyword prefixes")
+    for s in ["printer", "iffy", "elsewhere", "whiles", "functional", "returned", "order", "android", "notable", "print_"]:
+        t = tokenize(s)
+        assert len(t) == 2
+        assert t[0]["tag"] == "identifier", f"expected identifier, got {t[0]}"
+        assert t[0]["value"] == s
+    t = tokenize("print printer")
+    assert [token["tag"] for token in t] == ["print", "identifier", None]
+
 def test_error():
     print("test error")
     try:
@@ -152,4 +169,5 @@ if __name__ == "__main__":
     test_whitespace()
     test_keywords()
     test_identifier_tokens()
+    test_keyword_prefixes()
     test_error()
\ No newline at end of file
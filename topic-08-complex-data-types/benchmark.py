@@ -0,0 +1,171 @@
+"""
+benchmark.py
+
+Times the tokenize, parse and evaluate phases of the programs in benchmarks/
+for each evaluation backend, and saves the results as JSON so runs from
+different revisions can be compared.
+
+usage: python benchmark.py                 run the tests
+       python benchmark.py benchmark [--repeat N] [--output results.json]
+                                     [--backend NAME ...] [program ...]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import tokenizer
+import parser
+import evaluator
+import nodes
+import flat
+
+benchmark_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+phases = ["tokenize", "parse", "evaluate"]
+
+# Each backend turns the parser's dict AST into the tree evaluate() runs on.
+# The conversion is timed as part of the parse phase.
+backends = {
+    "dict": lambda ast: ast,
+    "nodes": nodes.from_dict,
+    "flat": lambda ast: flat.from_dict(ast).node(),
+}
+
+def generated_source(count):
+    """
+    Returns a runnable program of `count` generated statements.
+    """
+    statements = ["x0 = 1"]
+    for i in range(1, count):
+        if i % 3 == 0:
+            statements.append(f"if (x{i-1} > 1000) {{ x{i} = x{i-1} - 1000 }} else {{ x{i} = x{i-1} + {i} }}")
+        elif i % 3 == 1:
+            statements.append(f"x{i} = x{i-1} * 2 - {i} / 4")
+        else:
+            statements.append(f"x{i} = [x{i-1}, {i}][1] + {{v: x{i-1}}}.v")
+    statements.append(f"print(x{count-1})")
+    return ";\n".join(statements)
+
+def load_programs(names=None):
+    """
+    Returns {name: source} for the benchmark programs, optionally only those named.
+    """
+    programs = {}
+    for filename in sorted(os.listdir(benchmark_directory)):
+        if filename.endswith(".t"):
+            with open(os.path.join(benchmark_directory, filename), "r") as f:
+                programs[filename[:-2]] = f.read()
+    programs["generated"] = generated_source(500)
+    if names:
+        missing = [name for name in names if name not in programs]
+        if missing:
+            raise Exception(f"Unknown benchmark programs: {missing}")
+        programs = {name: programs[name] for name in names}
+    return programs
+
+def summarize(times):
+    mean = statistics.mean(times)
+    return {
+        "times": times,
+        "mean": mean,
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "ops_per_sec": 1 / mean if mean > 0 else float("inf"),
+    }
+
+def measure(source, backend, repeat):
+    """
+    Runs one program `repeat` times on one backend and summarizes each phase.
+    """
+    times = {phase: [] for phase in phases}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = tokenizer.tokenize(source)
+        tokenized = time.perf_counter()
+        ast = backends[backend](parser.parse(tokens))
+        parsed = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluator.evaluate(ast, {})
+        evaluated = time.perf_counter()
+        times["tokenize"].append(tokenized - start)
+        times["parse"].append(parsed - tokenized)
+        times["evaluate"].append(evaluated - parsed)
+    return {phase: summarize(times[phase]) for phase in phases}
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(programs, backend_names=None, repeat=5, report=print):
+    results = {}
+    for name, source in programs.items():
+        results[name] = {}
+        for backend in backend_names or list(backends):
+            results[name][backend] = measure(source, backend, repeat)
+            for phase in phases:
+                summary = results[name][backend][phase]
+                report(f"{name:<20} {backend:<6} {phase:<9} "
+                       f"{summary['mean'] * 1000:>10.3f} ms +- {summary['stdev'] * 1000:>8.3f}"
+                       f" {summary['ops_per_sec']:>12.1f} ops/s")
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+def main(arguments):
+    argument_parser = argparse.ArgumentParser(description="Time tokenize, parse and evaluate on the benchmark programs.")
+    argument_parser.add_argument("programs", nargs="*", help="benchmark names (default: all)")
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    argument_parser.add_argument("--backend", action="append", choices=list(backends))
+    argument_parser.add_argument("--output", help="write the results to this JSON file")
+    options = argument_parser.parse_args(arguments)
+    data = run_benchmarks(load_programs(options.programs), options.backend, options.repeat)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(data, f, indent=1)
+    return 0
+
+def test_programs_parse():
+    print("testing benchmark programs parse")
+    for name, source in load_programs().items():
+        parser.parse(tokenizer.tokenize(source))
+
+def test_run_benchmarks():
+    print("testing run_benchmarks")
+    data = run_benchmarks({"tiny": "x = 1; print(x + 1)"}, ["dict", "flat"], repeat=2, report=lambda line: None)
+    assert set(data) == {"revision", "python", "repeat", "results"}
+    assert set(data["results"]["tiny"]) == {"dict", "flat"}
+    summary = data["results"]["tiny"]["flat"]["evaluate"]
+    assert len(summary["times"]) == 2
+    assert summary["ops_per_sec"] > 0
+    json.dumps(data)
+
+def test_generated_source():
+    print("testing generated_source")
+    environment = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        evaluator.evaluate(parser.parse(tokenizer.tokenize(generated_source(20))), environment)
+    assert "x19" in environment
+
+if __name__ == "__main__":
+    if "benchmark" in sys.argv:
+        sys.exit(main([argument for argument in sys.argv[1:] if argument != "benchmark"]))
+    test_programs_parse()
+    test_run_benchmarks()
+    test_generated_source()
+    print("done.")
@@ -0,0 +1,7 @@
+i = 0;
+total = 0;
+while (i < 20000) {
+    total = total + i * 3 - i / 2;
+    i = i + 1
+};
+print(total)
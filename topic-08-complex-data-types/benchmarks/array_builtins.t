@@ -0,0 +1,6 @@
+a = range(20000);
+b = fill(20000, 3);
+c = add(a, b);
+d = mul(c, 2);
+e = map(function(x) { return x - 1 }, range(2000));
+print(sum(d), dot(a, b), sum(e))
@@ -0,0 +1,22 @@
+n = 300;
+a = fill(n, 0);
+x = 1;
+i = 0;
+while (i < n) {
+    x = x * 13 + 7;
+    while (x >= 1009) { x = x - 1009 };
+    a[i] = x;
+    i = i + 1
+};
+i = 1;
+while (i < n) {
+    key = a[i];
+    j = i - 1;
+    while (j >= 0 && a[j] > key) {
+        a[j + 1] = a[j];
+        j = j - 1
+    };
+    a[j + 1] = key;
+    i = i + 1
+};
+print(a[0], a[150], a[n - 1])
@@ -0,0 +1,18 @@
+i = 0;
+a = 0;
+b = 0;
+c = 0;
+d = 0;
+while (i < 5000) {
+    if (i < 2500) {
+        if (i < 1250) { a = a + 1 } else { b = b + 1 }
+    } else {
+        if (i < 3750) {
+            c = c + 1
+        } else {
+            if (i == 4999) { d = d + 100 } else { d = d + 1 }
+        }
+    };
+    i = i + 1
+};
+print(a, b, c, d)
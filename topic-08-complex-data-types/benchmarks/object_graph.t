@@ -0,0 +1,22 @@
+function make(depth) {
+    if (depth == 0) { return {value: 1, left: 0, right: 0} };
+    return {value: depth, left: make(depth - 1), right: make(depth - 1)}
+};
+function total(node) {
+    if (node.left == 0) { return node.value };
+    return node.value + total(node.left) + total(node.right)
+};
+tree = make(9);
+chain = 0;
+i = 0;
+while (i < 2000) {
+    chain = {value: i, next: chain};
+    i = i + 1
+};
+length = 0;
+node = chain;
+while (node != 0) {
+    length = length + 1;
+    node = node.next
+};
+print(total(tree), length)
@@ -0,0 +1,10 @@
+s = "";
+line = "";
+i = 0;
+while (i < 5000) {
+    line = "item";
+    if (i < 2500) { line = line + " low" } else { line = line + " high" };
+    s = s + line + "\n";
+    i = i + 1
+};
+print(len(s), s[0], s == s + "")
@@ -0,0 +1,182 @@
+"""
+compare.py
+
+Compares two benchmark result files written by benchmark.py and reports,
+per program, backend and phase, whether the new run is slower.
+
+A phase counts as a regression when its mean time grew by more than the
+threshold (10% by default) and Welch's t-test says the difference is
+unlikely to be noise (one-sided, 95%).  With a single run per side there is
+no variance to test, so only the threshold applies.
+
+usage: python compare.py                       run the tests
+       python compare.py baseline.json current.json [--threshold 0.1]
+       python compare.py current.json        (against benchmarks/baseline.json)
+       python compare.py --run [program ...] (benchmark now, then compare)
+
+The exit status is 1 if any phase regressed, so the check can gate a merge.
+To store a baseline: python benchmark.py benchmark --output benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+
+import benchmark
+
+baseline_path = os.path.join(benchmark.benchmark_directory, "baseline.json")
+
+# one-sided 95% critical values of Student's t, by degrees of freedom
+t_critical = [
+    (1, 6.314), (2, 2.920), (3, 2.353), (4, 2.132), (5, 2.015), (6, 1.943),
+    (7, 1.895), (8, 1.860), (9, 1.833), (10, 1.812), (12, 1.782), (15, 1.753),
+    (20, 1.725), (30, 1.697), (60, 1.671), (120, 1.658),
+]
+
+def critical_value(degrees_of_freedom):
+    # use the entry for the largest tabulated df not above ours (conservative)
+    value = t_critical[0][1]
+    for df, critical in t_critical:
+        if df <= degrees_of_freedom:
+            value = critical
+    return value
+
+def welch_t(old_times, new_times):
+    """
+    Returns (t, degrees of freedom) for new_times being slower than old_times,
+    or None when either side has fewer than two runs.
+    """
+    if len(old_times) < 2 or len(new_times) < 2:
+        return None
+    old_variance = statistics.variance(old_times) / len(old_times)
+    new_variance = statistics.variance(new_times) / len(new_times)
+    difference = statistics.mean(new_times) - statistics.mean(old_times)
+    if old_variance + new_variance == 0:
+        return (math.inf if difference > 0 else -math.inf if difference < 0 else 0.0), math.inf
+    t = difference / math.sqrt(old_variance + new_variance)
+    degrees_of_freedom = (old_variance + new_variance) ** 2 / (
+        old_variance ** 2 / (len(old_times) - 1) + new_variance ** 2 / (len(new_times) - 1)
+    )
+    return t, degrees_of_freedom
+
+def classify(old, new, threshold):
+    """
+    Returns (status, change, t) for one phase summary pair.
+    status is one of "regression", "improvement", "noise" or "ok".
+    """
+    change = (new["mean"] - old["mean"]) / old["mean"] if old["mean"] > 0 else 0.0
+    test = welch_t(old["times"], new["times"])
+    t = None if test is None else test[0]
+    if abs(change) <= threshold:
+        return "ok", change, t
+    if test is not None and abs(test[0]) < critical_value(test[1]):
+        return "noise", change, t
+    return ("regression" if change > 0 else "improvement"), change, t
+
+def compare(old_data, new_data, threshold=0.1):
+    """
+    Returns rows (program, backend, phase, old mean, new mean, change, t, status)
+    for every phase present in both result sets.
+    """
+    rows = []
+    for program, old_backends in old_data["results"].items():
+        for backend, old_phases in old_backends.items():
+            new_phases = new_data["results"].get(program, {}).get(backend)
+            if new_phases is None:
+                continue
+            for phase in benchmark.phases:
+                if phase in old_phases and phase in new_phases:
+                    status, change, t = classify(old_phases[phase], new_phases[phase], threshold)
+                    rows.append((program, backend, phase, old_phases[phase]["mean"],
+                                 new_phases[phase]["mean"], change, t, status))
+    return rows
+
+def print_table(rows, old_data, new_data):
+    print(f"baseline {old_data.get('revision')}  vs  current {new_data.get('revision')}")
+    print(f"{'program':<20} {'backend':<7} {'phase':<9} {'baseline ms':>12} {'current ms':>11} {'change':>8} {'t':>7}  status")
+    for program, backend, phase, old_mean, new_mean, change, t, status in rows:
+        t_text = "-" if t is None else f"{t:.2f}" if math.isfinite(t) else ("inf" if t > 0 else "-inf")
+        print(f"{program:<20} {backend:<7} {phase:<9} {old_mean * 1000:>12.3f} {new_mean * 1000:>11.3f}"
+              f" {change * 100:>7.1f}% {t_text:>7}  {status}")
+    regressions = [row for row in rows if row[-1] == "regression"]
+    print(f"{len(regressions)} regression(s) in {len(rows)} comparison(s).")
+
+def main(arguments):
+    argument_parser = argparse.ArgumentParser(description="Compare benchmark results and report regressions.")
+    argument_parser.add_argument("files", nargs="*", help="[baseline.json] current.json, or program names with --run")
+    argument_parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown to flag (default 0.1)")
+    argument_parser.add_argument("--baseline", default=baseline_path)
+    argument_parser.add_argument("--run", action="store_true", help="benchmark the working tree instead of reading current.json")
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    options = argument_parser.parse_args(arguments)
+    if options.run:
+        old_path = options.baseline
+        with open(old_path, "r") as f:
+            old_data = json.load(f)
+        new_data = benchmark.run_benchmarks(benchmark.load_programs(options.files), repeat=options.repeat, report=lambda line: None)
+    else:
+        if len(options.files) == 1:
+            old_path, new_path = options.baseline, options.files[0]
+        elif len(options.files) == 2:
+            old_path, new_path = options.files
+        else:
+            argument_parser.error("expected [baseline.json] current.json")
+        with open(old_path, "r") as f:
+            old_data = json.load(f)
+        with open(new_path, "r") as f:
+            new_data = json.load(f)
+    rows = compare(old_data, new_data, options.threshold)
+    print_table(rows, old_data, new_data)
+    return 1 if any(row[-1] == "regression" for row in rows) else 0
+
+def results(times_by_phase):
+    return {"revision": None, "results": {"p": {"dict": {
+        phase: benchmark.summarize(times) for phase, times in times_by_phase.items()
+    }}}}
+
+def test_welch_t():
+    print("testing welch_t")
+    assert welch_t([1.0], [2.0]) is None
+    t, df = welch_t([1.0, 1.1, 0.9], [2.0, 2.1, 1.9])
+    assert t > 10 and 3 < df < 5
+    t, df = welch_t([1.0, 1.0], [1.0, 1.0])
+    assert t == 0.0
+
+def test_compare():
+    print("testing compare")
+    old = results({"tokenize": [1.0, 1.01, 0.99], "parse": [1.0, 1.01, 0.99], "evaluate": [1.0, 1.5, 0.5]})
+    new = results({"tokenize": [1.5, 1.51, 1.49], "parse": [0.5, 0.51, 0.49], "evaluate": [1.2, 1.9, 0.5]})
+    statuses = {row[2]: row[-1] for row in compare(old, new)}
+    assert statuses == {"tokenize": "regression", "parse": "improvement", "evaluate": "noise"}
+    statuses = {row[2]: row[-1] for row in compare(old, new, threshold=0.6)}
+    assert statuses == {"tokenize": "ok", "parse": "ok", "evaluate": "ok"}
+    # single runs fall back to the threshold alone
+    statuses = {row[2]: row[-1] for row in compare(results({"parse": [1.0]}), results({"parse": [1.2]}))}
+    assert statuses == {"parse": "regression"}
+
+def test_main():
+    print("testing main")
+    import contextlib, io, tempfile
+    directory = tempfile.mkdtemp()
+    old_path = os.path.join(directory, "old.json")
+    new_path = os.path.join(directory, "new.json")
+    with open(old_path, "w") as f:
+        json.dump(results({"parse": [1.0, 1.01, 0.99]}), f)
+    with open(new_path, "w") as f:
+        json.dump(results({"parse": [2.0, 2.01, 1.99]}), f)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        assert main([old_path, new_path]) == 1
+        assert main([new_path, old_path]) == 0
+        assert main(["--baseline", old_path, old_path]) == 0
+    assert "1 regression(s)" in output.getvalue()
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        sys.exit(main(sys.argv[1:]))
+    test_welch_t()
+    test_compare()
+    test_main()
+    print("done.")
@@ -0,0 +1,283 @@
+"""
+cover.py
+
+Statement and branch coverage, and hot loops, for a .t program.
+
+The parser's AST has no positions, so the program is parsed with
+parser.parse_with_positions(), which records the position of the first token
+of every node, keyed by node identity, and the positions of the statements
+and blocks are kept.  The program is then run with a tracing listener (see
+tracing.py) that counts how often each of those nodes is entered and how many
+passes each while loop makes.
+
+The listing shows, in front of each line, how many times the first statement
+that starts on it ran ("#####" if some statement on the line never ran, "-"
+if no statement starts there), followed by branch counts for if statements
+and a table of the loops that made the most passes.  A program that stops
+with an error still gets its listing: the statement it failed in is marked
+with the error, and the counts are those up to the failure.
+
+usage: python cover.py                      run the tests
+       python cover.py program.t [--top N]
+"""
+
+import argparse
+import bisect
+import contextlib
+import io
+import sys
+
+import evaluator
+import parser
+import tracing
+from parser import walk
+from tokenizer import tokenize
+
+def parse_with_positions(source):
+    """
+    Returns (ast, positions) where positions maps id(node) to the source
+    offset of every statement and block node.
+    """
+    ast, positions = parser.parse_with_positions(tokenize(source))
+    kept = {}
+    for node in walk(ast):
+        children = node["body"] if node["tag"] == "function" else node.get("statements", [])
+        children = children + [node[field] for field in ["then", "else", "do"] if node.get(field)]
+        for child in children:
+            kept[id(child)] = positions[id(child)]
+    return ast, kept
+
+class Coverage(tracing.Listener):
+    """
+    Counts entries of the nodes in `positions`, and passes of while loops.
+    """
+    def __init__(self, positions):
+        self.positions = positions
+        self.hits = {}
+        self.loops = {}
+        # the counted nodes being run, innermost last; an error leaves them in place
+        self.running = []
+        self.error = None
+
+    def enter(self, node, environment):
+        key = id(node)
+        if key in self.positions:
+            self.hits[key] = self.hits.get(key, 0) + 1
+            self.running.append(node)
+
+    def exit(self, node, environment, value):
+        if id(node) in self.positions:
+            self.running.pop()
+
+    def iteration(self, node, environment):
+        key = id(node)
+        self.loops[key] = self.loops.get(key, 0) + 1
+
+    def count(self, node):
+        return self.hits.get(id(node), 0)
+
+    def failed(self):
+        """
+        Returns the innermost statement that was running when the error was raised, or None.
+        """
+        if self.error is None:
+            return None
+        statements = [node for node in self.running if node["tag"] != "block"]
+        return statements[-1] if statements else None
+
+def measure(source, output=None):
+    """
+    Runs a program under coverage and returns (ast, positions, coverage).
+    The program's printed output goes to `output` (discarded by default).  An
+    error the program raises is kept in coverage.error.
+    """
+    ast, positions = parse_with_positions(source)
+    coverage = Coverage(positions)
+    with tracing.listening(coverage), contextlib.redirect_stdout(output or io.StringIO()):
+        try:
+            evaluator.evaluate(ast, {})
+        except Exception as e:
+            coverage.error = e
+    return ast, positions, coverage
+
+def annotate(source, ast, positions, coverage):
+    """
+    Returns the annotated listing as a list of lines.
+    """
+    line_starts = [0] + [i + 1 for i, c in enumerate(source) if c == "\n"]
+
+    def line_of(node):
+        return bisect.bisect_right(line_starts, positions[id(node)]) - 1
+
+    first_counts = {}
+    missed = set()
+    branches = {}
+    failed = coverage.failed()
+    errors = {line_of(failed): describe_error(coverage.error)} if failed is not None else {}
+    for node in walk(ast):
+        # blocks are counted for branches but not listed themselves
+        if id(node) not in positions or node["tag"] == "block":
+            continue
+        line = line_of(node)
+        count = coverage.count(node)
+        first_counts.setdefault(line, count)
+        if count == 0:
+            missed.add(line)
+        if node["tag"] == "if":
+            taken = coverage.count(node["then"])
+            other = coverage.count(node["else"]) if node["else"] else count - taken
+            branches.setdefault(line, []).append((taken, other, node["else"] is not None))
+    listing = []
+    for number, text in enumerate(source.split("\n")):
+        if number in missed:
+            prefix = "#####"
+        elif number in first_counts:
+            prefix = str(first_counts[number])
+        else:
+            prefix = "-"
+        listing.append(f"{prefix:>9}: {number + 1:>4}: {text}")
+        for taken, other, has_else in branches.get(number, []):
+            listing.append(f"{'':>9}  {'':>4}  branch: then {taken}, {'else' if has_else else 'skipped'} {other}")
+        if number in errors:
+            listing.append(f"{'':>9}  {'':>4}  error: {errors[number]}")
+    return listing
+
+def describe_error(error):
+    return f"{type(error).__name__}: {error}"
+
+def hot_loops(source, positions, coverage, top=5):
+    """
+    Returns [(passes, line number, line text)] for the loops that made the most passes.
+    """
+    lines = source.split("\n")
+    line_starts = [0] + [i + 1 for i, c in enumerate(source) if c == "\n"]
+    loops = []
+    for key, passes in coverage.loops.items():
+        number = bisect.bisect_right(line_starts, positions[key]) - 1
+        loops.append((passes, number + 1, lines[number].strip()))
+    loops.sort(key=lambda loop: (-loop[0], loop[1]))
+    return loops[:top]
+
+def report(source, top=5, output=None):
+    ast, positions, coverage = measure(source, output)
+    listing = annotate(source, ast, positions, coverage)
+    statements = [node for node in walk(ast) if id(node) in positions and node["tag"] != "block"]
+    executed = sum(1 for node in statements if coverage.count(node))
+    listing.append("")
+    listing.append(f"{executed} of {len(statements)} statement(s) executed.")
+    if coverage.error is not None:
+        listing.append(f"the program stopped with {describe_error(coverage.error)}")
+    loops = hot_loops(source, positions, coverage, top)
+    if loops:
+        listing.append("hot loops:")
+        for passes, number, text in loops:
+            listing.append(f"{passes:>9} passes  line {number:>4}: {text}")
+    return listing
+
+def main(arguments):
+    argument_parser = argparse.ArgumentParser(description="Run a program and print an annotated coverage listing.")
+    argument_parser.add_argument("program")
+    argument_parser.add_argument("--top", type=int, default=5, help="number of hot loops to list")
+    options = argument_parser.parse_args(arguments)
+    with open(options.program, "r") as f:
+        source = f.read()
+    for line in report(source, options.top):
+        print(line)
+    return 0
+
+example = """i = 0;
+total = 0;
+while (i < 10) {
+    if (i < 3) { total = total + 1 } else { total = total + 2 };
+    i = i + 1
+};
+if (total > 100) {
+    print("big")
+};
+function f(x) {
+    return x
+}"""
+
+def test_positions():
+    print("testing parse_with_positions")
+    ast, positions = parse_with_positions("x = 1; if (x) { y = 2 }")
+    first, second = ast["statements"]
+    assert positions[id(first)] == 0
+    assert positions[id(second)] == 7
+    assert positions[id(second["then"])] == 14
+    assert positions[id(second["then"]["statements"][0])] == 16
+    # expressions are not statements
+    assert id(first["value"]) not in positions and id(second["condition"]) not in positions
+    assert len(positions) == 4
+
+def test_counts():
+    print("testing counts")
+    ast, positions, coverage = measure(example)
+    statements = ast["statements"]
+    loop = statements[2]
+    branch = loop["do"]["statements"][0]
+    assert coverage.count(loop) == 1
+    assert coverage.count(branch) == 10
+    assert coverage.count(branch["then"]) == 3 and coverage.count(branch["else"]) == 7
+    assert coverage.count(statements[3]["then"]) == 0
+    assert coverage.loops == {id(loop): 10}
+
+def test_annotate():
+    print("testing annotate")
+    listing = report(example)
+    assert listing[:14] == [
+        "        1:    1: i = 0;",
+        "        1:    2: total = 0;",
+        "        1:    3: while (i < 10) {",
+        "       10:    4:     if (i < 3) { total = total + 1 } else { total = total + 2 };",
+        "                 branch: then 3, else 7",
+        "       10:    5:     i = i + 1",
+        "        -:    6: };",
+        "        1:    7: if (total > 100) {",
+        "                 branch: then 0, skipped 1",
+        "    #####:    8:     print(\"big\")",
+        "        -:    9: };",
+        "        1:   10: function f(x) {",
+        "    #####:   11:     return x",
+        "        -:   12: }",
+    ], "\n".join(listing)
+    assert listing[15] == "9 of 11 statement(s) executed."
+    assert listing[17] == "       10 passes  line    3: while (i < 10) {"
+
+def test_error():
+    print("testing a program that fails")
+    source = """i = 0;
+while (i < 5) {
+    x = [1, 2, 3][i];
+    i = i + 1
+};
+print(x)"""
+    ast, positions, coverage = measure(source)
+    assert isinstance(coverage.error, IndexError)
+    assert coverage.failed() is ast["statements"][1]["do"]["statements"][0]
+    listing = report(source)
+    assert listing[:8] == [
+        "        1:    1: i = 0;",
+        "        1:    2: while (i < 5) {",
+        "        4:    3:     x = [1, 2, 3][i];",
+        "                 error: IndexError: list index out of range",
+        "        3:    4:     i = i + 1",
+        "        -:    5: };",
+        "    #####:    6: print(x)",
+        "",
+    ], "\n".join(listing)
+    assert listing[8:10] == ["4 of 5 statement(s) executed.",
+                             "the program stopped with IndexError: list index out of range"]
+    assert listing[11] == "        4 passes  line    2: while (i < 5) {"
+    # an error in a called function marks the statement inside it
+    ast, positions, coverage = measure("function f(a) {\n    return a.k\n};\ny = f(1)")
+    assert coverage.failed() is ast["statements"][0]["value"]["body"][0]
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        sys.exit(main(sys.argv[1:]))
+    test_positions()
+    test_counts()
+    test_annotate()
+    test_error()
+    print("done.")
@@ -0,0 +1,448 @@
+"""
+dfa.py
+
+A table-driven lexer generated from a patterns table like tokenizer.patterns.
+
+Each pattern's regular expression is parsed (literals, escapes, character
+classes, ".", grouping, "|", "*", "+", "?" and counts like {4}) and compiled into a
+nondeterministic automaton, and the subset construction turns the union into
+a deterministic one.  Characters are grouped into classes that no pattern
+tells apart, so the automaton is stored as a few compact arrays:
+
+    classes      array of bytes: the class of each ASCII character
+    transitions  array of shorts: transitions[state * class_count + class]
+                 is the next state, or -1
+    accepting    array of shorts: the index of the pattern a state accepts,
+                 or -1
+
+The classes are found by matching each character against each of the
+patterns' character sets with re itself, so "\\d", "\\s" and "." mean exactly
+what they mean to the regex tokenizer, non-ASCII characters included (those
+get their class through a small cache).
+
+The scanner walks the table in a single loop, so the cost per character does
+not depend on how many token kinds there are.  It takes the longest match and,
+between patterns matching the same length, the one listed first.  The regex
+tokenizer takes the first pattern that matches at all, which is the same
+thing as long as no pattern can match a proper prefix of a longer match of a
+pattern listed after it ("==" before "=", and so on); Lexer checks that when
+it builds the tables and raises ValueError if it is not so.
+
+usage: python dfa.py             run the tests
+       python dfa.py benchmark   compare with the regex tokenizer
+"""
+
+import itertools
+import re
+import sys
+import time
+from array import array
+
+import tokenizer
+
+def parse_regex(source):
+    """
+    Returns (tree, atoms) for a regular expression, where the tree is built of
+    ("atom", index), ("concat", items), ("alternation", items), ("star", item),
+    ("plus", item) and ("optional", item), and atoms lists the source of each
+    character set (a literal, an escape, a class or ".").
+    """
+    atoms = []
+    tree, position = parse_alternation(source, 0, atoms)
+    if position != len(source):
+        raise ValueError(f"unbalanced ')' in {source!r}")
+    return tree, atoms
+
+def parse_alternation(source, position, atoms):
+    items = []
+    while True:
+        item, position = parse_concatenation(source, position, atoms)
+        items.append(item)
+        if position < len(source) and source[position] == "|":
+            position += 1
+        else:
+            break
+    if len(items) == 1:
+        return items[0], position
+    return ("alternation", items), position
+
+def parse_concatenation(source, position, atoms):
+    items = []
+    while position < len(source) and source[position] not in "|)":
+        item, position = parse_atom(source, position, atoms)
+        if position < len(source) and source[position] in "*+?":
+            item = ({"*": "star", "+": "plus", "?": "optional"}[source[position]], item)
+            position += 1
+        elif position < len(source) and source[position] == "{":
+            item, position = parse_count(source, position, item)
+        if position < len(source) and source[position] in "*+?{":
+            raise ValueError(f"unsupported repetition at {position} in {source!r}")
+        items.append(item)
+    return ("concat", items), position
+
+def parse_count(source, position, item):
+    """
+    Expands a counted repetition, x{n} or x{m,n}, into copies of x.
+    """
+    match = re.compile(r"\{(\d+)(?:(,)(\d+))?\}").match(source, position)
+    if not match:
+        raise ValueError(f"unsupported repetition at {position} in {source!r}")
+    least = int(match.group(1))
+    most = int(match.group(3)) if match.group(2) else least
+    if most < least:
+        raise ValueError(f"bad repetition count at {position} in {source!r}")
+    return ("concat", [item] * least + [("optional", item)] * (most - least)), match.end()
+
+def parse_atom(source, position, atoms):
+    character = source[position]
+    if character == "(":
+        if source.startswith("(?", position):
+            raise ValueError(f"unsupported group at {position} in {source!r}")
+        item, position = parse_alternation(source, position + 1, atoms)
+        if position >= len(source) or source[position] != ")":
+            raise ValueError(f"missing ')' in {source!r}")
+        return item, position + 1
+    if character == "[":
+        end = position + 1
+        if end < len(source) and source[end] == "^":
+            end += 1
+        end += 1  # a "]" right after "[" or "[^" is a member
+        while end < len(source) and source[end] != "]":
+            end += 2 if source[end] == "\\" else 1
+        if end >= len(source):
+            raise ValueError(f"missing ']' in {source!r}")
+        end += 1
+    elif character == "\\":
+        if position + 1 >= len(source) or source[position + 1] in "0123456789AbBZ":
+            raise ValueError(f"unsupported escape at {position} in {source!r}")
+        end = position + 2
+    elif character in "*+?{}^$":
+        raise ValueError(f"unsupported regular expression syntax {character!r} at {position} in {source!r}")
+    else:
+        end = position + 1
+    text = source[position:end] if character in "[\\." else re.escape(character)
+    if text not in atoms:
+        atoms.append(text)
+    return ("atom", atoms.index(text)), end
+
+class Nfa:
+    """
+    A nondeterministic automaton: edges[state] lists (atom, target) pairs
+    and empty[state] the targets reached without consuming a character.
+    """
+    def __init__(self):
+        self.edges = []
+        self.empty = []
+        self.accepts = {}
+
+    def state(self):
+        self.edges.append([])
+        self.empty.append([])
+        return len(self.edges) - 1
+
+    def fragment(self, tree, atom_numbers):
+        """
+        Adds states for a regex tree; returns its (start, end) states.
+        """
+        kind = tree[0]
+        start = self.state()
+        if kind == "atom":
+            end = self.state()
+            self.edges[start].append((atom_numbers[tree[1]], end))
+            return start, end
+        if kind == "concat":
+            end = start
+            for item in tree[1]:
+                item_start, item_end = self.fragment(item, atom_numbers)
+                self.empty[end].append(item_start)
+                end = item_end
+            return start, end
+        end = self.state()
+        if kind == "alternation":
+            for item in tree[1]:
+                item_start, item_end = self.fragment(item, atom_numbers)
+                self.empty[start].append(item_start)
+                self.empty[item_end].append(end)
+            return start, end
+        item_start, item_end = self.fragment(tree[1], atom_numbers)
+        self.empty[start].append(item_start)
+        self.empty[item_end].append(end)
+        if kind in ["star", "plus"]:
+            self.empty[item_end].append(item_start)
+        if kind in ["star", "optional"]:
+            self.empty[start].append(end)
+        return start, end
+
+    def closure(self, states):
+        states = set(states)
+        stack = list(states)
+        while stack:
+            for target in self.empty[stack.pop()]:
+                if target not in states:
+                    states.add(target)
+                    stack.append(target)
+        return frozenset(states)
+
+def non_ascii_signatures(atoms):
+    """
+    Returns (always, sometimes, signatures) for the characters above ASCII:
+    the atoms matching all of them, the atoms matching some, and each
+    combination of atoms that some such character matches exactly.
+    """
+    text = "".join(map(chr, range(128, sys.maxunicode + 1)))
+    always = []
+    sometimes = []
+    for number, atom in enumerate(atoms):
+        if re.search(atom, text):
+            if re.search(f"(?!{atom})[\\s\\S]", text):
+                sometimes.append(number)
+            else:
+                always.append(number)
+    signatures = []
+    for choice in itertools.product([True, False], repeat=len(sometimes)):
+        test = "".join(("(?=" if chosen else "(?!") + atoms[number] + ")" for number, chosen in zip(sometimes, choice))
+        if re.search(test + "[\\s\\S]", text):
+            signatures.append(frozenset(always + [number for number, chosen in zip(sometimes, choice) if chosen]))
+    return always, sometimes, signatures
+
+class Lexer:
+    def __init__(self, patterns):
+        self.tags = []
+        self.atoms = []
+        nfa = Nfa()
+        start = nfa.state()
+        for pattern, tag in patterns:
+            source = pattern if type(pattern) is str else pattern.pattern
+            tree, atoms = parse_regex(source)
+            atom_numbers = []
+            for atom in atoms:
+                if atom not in self.atoms:
+                    self.atoms.append(atom)
+                atom_numbers.append(self.atoms.index(atom))
+            pattern_start, pattern_end = nfa.fragment(tree, atom_numbers)
+            nfa.empty[start].append(pattern_start)
+            nfa.accepts[pattern_end] = len(self.tags)
+            self.tags.append(tag)
+        self.compiled_atoms = [re.compile(atom) for atom in self.atoms]
+
+        # character classes: characters that match the same atoms
+        signatures = []
+        ascii_classes = []
+        for code in range(128):
+            signature = frozenset(number for number, atom in enumerate(self.compiled_atoms) if atom.fullmatch(chr(code)))
+            if signature not in signatures:
+                signatures.append(signature)
+            ascii_classes.append(signatures.index(signature))
+        self.always, self.sometimes, wide_signatures = non_ascii_signatures(self.atoms)
+        for signature in wide_signatures:
+            if signature not in signatures:
+                signatures.append(signature)
+        self.signatures = signatures
+        self.class_count = len(signatures)
+        self.classes = array("B" if self.class_count < 256 else "H", ascii_classes)
+        self.wide_classes = {}
+
+        # subset construction
+        sets = [nfa.closure([start])]
+        numbers = {sets[0]: 0}
+        transitions = []
+        accepting = []
+        for states in sets:
+            accepted = [nfa.accepts[state] for state in states if state in nfa.accepts]
+            accepting.append(min(accepted) if accepted else -1)
+            for signature in signatures:
+                targets = {target for state in states for atom, target in nfa.edges[state] if atom in signature}
+                if not targets:
+                    transitions.append(-1)
+                    continue
+                target_set = nfa.closure(targets)
+                if target_set not in numbers:
+                    numbers[target_set] = len(sets)
+                    sets.append(target_set)
+                transitions.append(numbers[target_set])
+        self.state_count = len(sets)
+        self.transitions = array("h", transitions)
+        self.accepting = array("h", accepting)
+        self.check_priorities()
+
+    def check_priorities(self):
+        """
+        Raises ValueError if a state accepting one pattern leads to a state
+        accepting a pattern listed after it, where first-match and longest
+        match would disagree.
+        """
+        for state in range(self.state_count):
+            accepted = self.accepting[state]
+            if accepted < 0:
+                continue
+            seen = {state}
+            stack = [state]
+            while stack:
+                current = stack.pop()
+                for k in range(self.class_count):
+                    target = self.transitions[current * self.class_count + k]
+                    if target >= 0 and target not in seen:
+                        if self.accepting[target] > accepted:
+                            raise ValueError(f"pattern {self.tags[accepted]!r} matches a prefix of a longer "
+                                             f"{self.tags[self.accepting[target]]!r} token listed after it")
+                        seen.add(target)
+                        stack.append(target)
+
+    def wide_class(self, character):
+        if character not in self.wide_classes:
+            signature = frozenset(self.always + [
+                number for number in self.sometimes if self.compiled_atoms[number].fullmatch(character)
+            ])
+            self.wide_classes[character] = self.signatures.index(signature)
+        return self.wide_classes[character]
+
+    def table_size(self):
+        """
+        Returns the size in bytes of the classes, transitions and accepting arrays.
+        """
+        return sum(len(table) * table.itemsize for table in [self.classes, self.transitions, self.accepting])
+
+    def tokenize(self, characters):
+        """
+        Returns the same tokens as tokenizer.tokenize.
+        """
+        classes = self.classes
+        transitions = self.transitions
+        accepting = self.accepting
+        class_count = self.class_count
+        tags = self.tags
+        keywords = tokenizer.keywords
+        token_value = tokenizer.token_value
+        tokens = []
+        position = 0
+        length = len(characters)
+        while position < length:
+            state = 0
+            tag = -1
+            end = index = position
+            while index < length:
+                code = ord(characters[index])
+                k = classes[code] if code < 128 else self.wide_class(characters[index])
+                state = transitions[state * class_count + k]
+                if state < 0:
+                    break
+                index += 1
+                if accepting[state] >= 0:
+                    tag = accepting[state]
+                    end = index
+            if tag < 0 or tags[tag] == "error":
+                raise Exception("Syntax error")
+            tag = tags[tag]
+            if tag == "identifier":
+                tag = keywords.get(characters[position:end], tag)
+            if tag != "whitespace":
+                tokens.append({
+                    "tag":tag,
+                    "position":position,
+                    "value":token_value(tag, characters[position:end])
+                })
+            position = end
+        # append end-of-stream marker
+        tokens.append({
+            "tag":None,
+            "value":None,
+            "position":position
+        })
+        return tokens
+
+lexer = Lexer(tokenizer.patterns)
+
+def tokenize(characters):
+    return lexer.tokenize(characters)
+
+def test_parse_regex():
+    print("test parse regex")
+    tree, atoms = parse_regex(r'"([^"\\]|\\[tn"\\])*"')
+    assert atoms == ['"', r'[^"\\]', "\\\\", r'[tn"\\]']
+    assert tree == ("concat", [("atom", 0), ("star", ("alternation", [
+        ("concat", [("atom", 1)]), ("concat", [("atom", 2), ("atom", 3)])
+    ])), ("atom", 0)])
+    assert parse_regex("a{2,3}")[0] == ("concat", [("concat", [("atom", 0), ("atom", 0), ("optional", ("atom", 0))])])
+    for source in ["a{,2}", "a{3,2}", "(?:a)", "a*?", "(a", "[ab", r"\1", "^a"]:
+        try:
+            parse_regex(source)
+            assert False, f"expected ValueError for {source!r}"
+        except ValueError:
+            pass
+
+def test_priorities():
+    print("test priorities")
+    small = Lexer([["==", "=="], ["=", "="], ["[a-z]+", "identifier"], [r"\s+", "whitespace"], [".", "error"]])
+    tokens = small.tokenize("a==b = c")
+    assert [(token["tag"], token["value"]) for token in tokens] == [
+        ("identifier", "a"), ("==", "=="), ("identifier", "b"), ("=", "="), ("identifier", "c"), (None, None)
+    ]
+    assert small.class_count == 5
+    # "a" listed first would end every "ab" token early for the regex tokenizer
+    try:
+        Lexer([["a", "a"], ["ab", "ab"]])
+        assert False, "expected ValueError"
+    except ValueError as e:
+        assert "'a' matches a prefix of a longer 'ab'" in str(e)
+
+def test_same_tokens():
+    print("test same tokens as tokenizer")
+    import benchmark
+    import generator
+    sources = list(benchmark.load_programs().values())
+    sources.append(generator.runnable_program(40, seed=3))
+    sources += [
+        ".5 1. 1.5 1..2 .. a.b", "printer iffy if print", '"a\\"b\\\\" "\\t\\n"', "x=1;y!=2&&!z||w<=3>=4",
+        "x = \"café 中\"", "x = ١٢ + 1", "x = 1", "\n\t x \r\n", "",
+    ]
+    for source in sources:
+        assert tokenize(source) == tokenizer.tokenize(source), source
+    for source in ["$1+2", "x = \"abc", "x = é", "1 \\ 2"]:
+        for tokenize_function in [tokenize, tokenizer.tokenize]:
+            try:
+                tokenize_function(source)
+                assert False, f"expected a syntax error for {source!r}"
+            except Exception as e:
+                assert "Syntax error" in str(e)
+
+def test_tables():
+    print("test tables")
+    assert lexer.accepting[0] == -1
+    assert len(lexer.transitions) == lexer.state_count * lexer.class_count
+    assert lexer.classes[ord("g")] == lexer.classes[ord("q")] != lexer.classes[ord("a")]
+    assert lexer.table_size() < 4096
+
+def benchmark_lexers():
+    """
+    Times the regex tokenizer and the DFA on the benchmark programs, then
+    again with extra operator patterns ahead of the existing operators.
+    """
+    import benchmark
+    source = "\n".join(benchmark.load_programs().values()) * 20
+    extra = [[re.compile(re.escape(f"@{i}@")), f"@{i}@"] for i in range(40)]
+    first_operator = [tag for pattern, tag in tokenizer.patterns].index("+")
+    saved = tokenizer.patterns
+    print(f"{len(source)} characters")
+    print("token kinds   states  classes  table bytes   regex s     dfa s")
+    for patterns in [saved, saved[:first_operator] + extra + saved[first_operator:]]:
+        tokenizer.patterns = patterns
+        generated = Lexer(patterns)
+        start = time.perf_counter()
+        expected = tokenizer.tokenize(source)
+        regex_time = time.perf_counter() - start
+        start = time.perf_counter()
+        tokens = generated.tokenize(source)
+        dfa_time = time.perf_counter() - start
+        assert tokens == expected
+        print(f"{len(patterns):>11} {generated.state_count:>8} {generated.class_count:>8} {generated.table_size():>12}"
+              f" {regex_time:>9.3f} {dfa_time:>9.3f}")
+    tokenizer.patterns = saved
+
+if __name__ == "__main__":
+    test_parse_regex()
+    test_priorities()
+    test_same_tokens()
+    test_tables()
+    if "benchmark" in sys.argv:
+        benchmark_lexers()
+    print("done.")
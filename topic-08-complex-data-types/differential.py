@@ -0,0 +1,443 @@
+"""
+differential.py
+
+Differential testing of the evaluation backends.
+
+Each program is run on the reference backend (the parser's dict AST) and on
+every other backend, and the runs are compared on three things: what was
+printed, the final top-level environment, and the exception raised, if any.
+When a backend disagrees, the program is shrunk by repeatedly deleting
+statements and replacing expressions with their subexpressions, for as long
+as the same disagreement remains, and the smallest program is reported.
+
+A backend is a function from the parser's dict AST to the tree evaluate()
+runs on, so new engines and AST passes are checked by adding to `backends`.
+
+usage: python differential.py                  run the tests
+       python differential.py [--fuzz N] [--seed S] [--jobs J]
+                              [--backend NAME ...] [program.t ...]
+
+With no program files the corpus is the benchmark programs plus N generated
+programs (200 by default): straight-line programs, programs whose statements
+run in a loop, and free-form programs.  The corpus is checked in a process pool.
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import benchmark
+import evaluator
+import flat
+import generator
+import image
+import optimize
+import parser
+import tracing
+from rope import Rope
+from tokenizer import tokenize
+
+reference = "dict"
+
+def image_backend(ast):
+    # round trip through a program image file, as runner.py does
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.timg")
+        image.write_image(flat.from_dict(ast), path)
+        return image.read_image(path).node()
+
+backends = dict(benchmark.backends)
+backends["image"] = image_backend
+backends["licm"] = optimize.hoist_invariants
+backends["dce"] = optimize.eliminate_dead_code
+backends["optimized"] = optimize.optimize
+
+builtin_names = {id(function): name for name, function in evaluator.builtin_functions.items()}
+
+def fingerprint(value):
+    """
+    Returns a flat list describing a value, for comparing values across runs.
+    Shared and cyclic references are numbered, function values are described
+    by their parameters, and deep structures do not hit the recursion limit.
+    """
+    description = []
+    seen = {}
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        kind = type(value)
+        if kind is str or kind is Rope:
+            description.append(("str", str(value)))
+        elif value is None or kind in [int, float, bool]:
+            description.append((kind.__name__, repr(value)))
+        elif kind is list or kind is dict:
+            if id(value) in seen:
+                description.append(("ref", seen[id(value)]))
+                continue
+            seen[id(value)] = len(seen)
+            if kind is list:
+                description.append(("list", len(value)))
+                stack.extend(reversed(value))
+            elif value.get("tag") == "function" and "environment" in value:
+                description.append(("function", evaluator.parameter_names(value)))
+            else:
+                keys = sorted(key for key in value if key != "$parent")
+                description.append(("object", keys))
+                stack.extend(value[key] for key in reversed(keys))
+        elif callable(value):
+            description.append(("builtin", builtin_names.get(id(value), repr(value))))
+        else:
+            description.append((kind.__name__, repr(value)))
+    return description
+
+class OverBudget(Exception):
+    pass
+
+class LoopBudget(tracing.Listener):
+    """
+    Stops a run after a number of loop passes, so that shrinking a program
+    cannot hang on a loop whose counter update was deleted.
+    """
+    def __init__(self, passes):
+        self.passes = passes
+
+    def iteration(self, node, environment):
+        self.passes -= 1
+        if self.passes < 0:
+            raise OverBudget("Too many loop passes.")
+
+def outcome(ast, backend, budget=None):
+    """
+    Runs a dict AST on one backend and returns what it printed, its final
+    environment and the exception it raised, if any.  With a budget, the
+    run is traced and raises OverBudget after that many loop passes.
+    """
+    environment = {}
+    output = io.StringIO()
+    error = None
+    try:
+        tree = backends[backend](ast)
+        with contextlib.redirect_stdout(output), contextlib.ExitStack() as stack:
+            if budget is not None:
+                stack.enter_context(tracing.listening(LoopBudget(budget)))
+            evaluator.evaluate(tree, environment)
+    except OverBudget:
+        raise
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    # names starting with "$" belong to the implementation (optimizer temporaries, scope links)
+    environment = {name: value for name, value in environment.items() if not name.startswith("$")}
+    return {"output": output.getvalue(), "environment": fingerprint(environment), "error": error}
+
+def disagreements(ast, backend_names=None, budget=None):
+    """
+    Returns a list of (backend, field) where a backend differs from the reference.
+    """
+    expected = outcome(ast, reference, budget)
+    found = []
+    for backend in backend_names or backends:
+        if backend == reference:
+            continue
+        actual = outcome(ast, backend, budget)
+        for field in ["output", "environment", "error"]:
+            if actual[field] != expected[field]:
+                found.append((backend, field))
+    return found
+
+# MINIMIZATION
+
+expression_fields = ["left", "right", "value", "object", "index", "function"]
+
+def is_node(value):
+    return type(value) is dict and "tag" in value
+
+def reductions(node):
+    """
+    Yields smaller variants of an AST node (or a list of nodes), one change each.
+    """
+    if type(node) is list:
+        for i in range(len(node)):
+            yield node[:i] + node[i + 1:]
+        for i, item in enumerate(node):
+            for smaller in reductions(item):
+                yield node[:i] + [smaller] + node[i + 1:]
+        return
+    if type(node) is not dict:
+        return
+    tag = node.get("tag")
+    if tag in flat.schema and tag not in ["program", "block", "assign", "print", "return", "if", "while", "function"]:
+        for field in expression_fields:
+            if is_node(node.get(field)):
+                yield node[field]
+    if tag == "if":
+        if node["else"]:
+            yield {**node, "else": None}
+        yield node["then"]
+    for field, value in node.items():
+        if is_node(value) or type(value) is list:
+            for smaller in reductions(value):
+                yield {**node, field: smaller}
+
+def minimize(ast, still_fails):
+    """
+    Greedily applies reductions while still_fails(ast) holds and returns the result.
+    """
+    reduced = True
+    while reduced:
+        reduced = False
+        for candidate in reductions(ast):
+            if still_fails(candidate):
+                ast = candidate
+                reduced = True
+                break
+    return ast
+
+# UNPARSING
+
+def unparse_string(value):
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\t", "\\t")
+    return '"' + escaped + '"'
+
+def unparse(ast):
+    """
+    Returns source text that parses back to the given dict AST.
+    """
+    tag = ast["tag"]
+    if tag == "number":
+        return repr(ast["value"])
+    if tag == "string":
+        return unparse_string(ast["value"])
+    if tag == "identifier":
+        return ast["value"]
+    if tag in evaluator.binary_operators:
+        return f"({unparse(ast['left'])} {tag} {unparse(ast['right'])})"
+    if tag == "and" or tag == "or":
+        operator = "&&" if tag == "and" else "||"
+        return f"({unparse(ast['left'])} {operator} {unparse(ast['right'])})"
+    if tag == "not":
+        return f"(not {unparse(ast['value'])})"
+    if tag == "negate":
+        return f"(-{unparse(ast['value'])})"
+    if tag == "array":
+        return "[" + ", ".join(unparse(value) for value in ast["values"]) + "]"
+    if tag == "object":
+        return "{" + ", ".join(f"{unparse_string(item['key'])}: {unparse(item['value'])}" for item in ast["values"]) + "}"
+    if tag == "index":
+        return f"{unparse(ast['object'])}[{unparse(ast['index'])}]"
+    if tag == "member":
+        if ast["object"]["tag"] == "number":
+            # "1.x" would read as the number "1." followed by x
+            return f"({unparse(ast['object'])}).{ast['property']}"
+        return f"{unparse(ast['object'])}.{ast['property']}"
+    if tag == "call":
+        return f"{unparse(ast['function'])}{unparse(ast['arguments'])}"
+    if tag == "arguments":
+        return "(" + ", ".join(unparse(value) for value in ast["values"]) + ")"
+    if tag == "function":
+        parameters = ", ".join(parameter["value"] for parameter in ast["parameters"])
+        return f"(function({parameters}) {unparse_block(ast['body'])})"
+    if tag == "print":
+        return "print" + unparse(ast["arguments"])
+    if tag == "if":
+        text = f"if ({unparse(ast['condition'])}) {unparse(ast['then'])}"
+        if ast["else"]:
+            text += f" else {unparse(ast['else'])}"
+        return text
+    if tag == "while":
+        return f"while ({unparse(ast['condition'])}) {unparse(ast['do'])}"
+    if tag == "return":
+        return "return" if ast["value"] is None else f"return {unparse(ast['value'])}"
+    if tag == "assign":
+        return f"{unparse_statement(ast['target'])} = {unparse(ast['value'])}"
+    if tag == "block":
+        return unparse_block(ast["statements"])
+    if tag == "program":
+        return ";\n".join(unparse_statement(statement) for statement in ast["statements"])
+    raise Exception(f"Unknown AST node [{tag}].")
+
+def unparse_block(statements):
+    if not statements:
+        return "{ }"
+    return "{ " + "; ".join(unparse_statement(statement) for statement in statements) + " }"
+
+def unparse_statement(ast):
+    # a statement that starts with "{" is read as a block
+    text = unparse(ast)
+    if text.startswith("{") and ast["tag"] != "block":
+        return f"({text})"
+    return text
+
+# CORPUS
+
+def check(item, backend_names=None):
+    """
+    Checks one (name, source) pair and returns (name, disagreements, minimized source).
+    """
+    name, source = item
+    try:
+        ast = parser.parse(tokenize(source))
+    except Exception as e:
+        return name, [("parse", f"{type(e).__name__}: {e}")], None
+    found = disagreements(ast, backend_names)
+    if not found:
+        return name, [], None
+    first = found[0]
+    # smaller programs may loop forever, so allow them only a few times the original's loop passes
+    counter = tracing.Counter()
+    with tracing.listening(counter), contextlib.redirect_stdout(io.StringIO()):
+        try:
+            evaluator.evaluate(ast, {})
+        except Exception:
+            pass
+    budget = 10 * counter.counts["iteration"] + 100
+
+    def still_fails(candidate):
+        try:
+            return first in disagreements(candidate, [first[0]], budget=budget)
+        except OverBudget:
+            return False
+
+    smallest = minimize(ast, still_fails)
+    return name, found, unparse(smallest)
+
+def corpus(fuzz=200, seed=0, files=None):
+    """
+    Returns [(name, source)]: the given files, or the benchmarks plus generated programs.
+    """
+    if files:
+        programs = []
+        for path in files:
+            with open(path, "r") as f:
+                programs.append((path, f.read()))
+        return programs
+    programs = list(benchmark.load_programs().items())
+    for i in range(fuzz):
+        # rotate between straight-line programs, loops, and free-form programs,
+        # which mostly end in an exception that every backend must raise the same way
+        if i % 3 == 0:
+            source = generator.runnable_program(20, seed=seed + i, depth=3)
+        elif i % 3 == 1:
+            source = generator.looping_program(10, seed=seed + i)
+        else:
+            source = "".join(generator.Generator(seed=seed + i, mix=free_form_mix).program(10))
+        programs.append((f"fuzz-{seed + i}", source))
+    return programs
+
+# loops may not terminate in free-form programs
+free_form_mix = {"statement": {"while_statement": 0}}
+
+def check_all(programs, backend_names=None, jobs=None, report=print, timeout=60):
+    """
+    Checks programs in a process pool and returns the failing results.
+    A program that is not checked within `timeout` seconds of being waited
+    for (a backend that loops forever, say) is reported as a failure.
+    """
+    failures = []
+    with multiprocessing.Pool(jobs) as pool:
+        pending = [(item[0], pool.apply_async(check, (item, backend_names))) for item in programs]
+        for name, result in pending:
+            try:
+                name, found, smallest = result.get(timeout)
+            except multiprocessing.TimeoutError:
+                found, smallest = [("timeout", f"no result after {timeout} s")], None
+            if found:
+                failures.append((name, found, smallest))
+                report(f"{name}: {', '.join(f'{backend} {field}' for backend, field in found)}")
+                if smallest is not None:
+                    report("  minimized: " + smallest.replace("\n", "\n             "))
+    report(f"{len(failures)} of {len(programs)} program(s) disagree.")
+    return failures
+
+def main(arguments):
+    argument_parser = argparse.ArgumentParser(description="Compare every backend against the reference evaluator.")
+    argument_parser.add_argument("files", nargs="*", help="programs to check (default: benchmarks and fuzz corpus)")
+    argument_parser.add_argument("--fuzz", type=int, default=200, help="number of generated programs")
+    argument_parser.add_argument("--seed", type=int, default=0)
+    argument_parser.add_argument("--jobs", type=int, help="worker processes (default: one per core)")
+    argument_parser.add_argument("--backend", action="append", choices=list(backends))
+    argument_parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for each program")
+    options = argument_parser.parse_args(arguments)
+    programs = corpus(options.fuzz, options.seed, options.files)
+    failures = check_all(programs, options.backend, options.jobs, timeout=options.timeout)
+    return 1 if failures else 0
+
+def test_fingerprint():
+    print("testing fingerprint")
+    assert fingerprint(Rope("ab") + "c") == fingerprint("abc")
+    assert fingerprint(1) != fingerprint(1.0) and fingerprint(1) != fingerprint(True)
+    cycle = {"a": 1}
+    cycle["self"] = cycle
+    assert fingerprint(cycle) == [("object", ["a", "self"]), ("int", "1"), ("ref", 0)]
+    chain = 0
+    for i in range(5000):
+        chain = {"next": chain}
+    assert len(fingerprint(chain)) == 5001
+    assert fingerprint(evaluator.builtin_functions["len"]) == [("builtin", "len")]
+
+def test_unparse():
+    print("testing unparse")
+    source = ('x = [1, 2.5, "a\\"b\\\\c\\n", {k: -y, "s": not 0}]; function f(a, b) { return a.k[b] };'
+              ' if (x[0] < 2 && 1 || 0) { print(f(x, 1)) } else { while (0) { return } }; g = function() { return }')
+    ast = parser.parse(tokenize(source))
+    assert parser.parse(tokenize(unparse(ast))) == ast
+    for seed in range(20):
+        ast = parser.parse(tokenize("".join(generator.Generator(seed=seed).program(5))))
+        assert parser.parse(tokenize(unparse(ast))) == ast
+
+def test_agreement():
+    print("testing agreement")
+    for name, source in corpus(fuzz=6, seed=100):
+        assert check((name, source)) == (name, [], None), name
+
+# programs that once made a backend disagree
+regressions = [
+    # a loop that never runs must not raise: n / 2 overflows once n is a big int
+    ("licm-overflow", "n = 2; j = 0; while (j < 11) { n = n * n; j = j + 1 }; "
+                      "i = 0; while (i < 0) { y = n / 2; i = i + 1 }; z = 1"),
+    ("dce-overflow", "function f(){ n = 2; j = 0; while (j < 11) { n = n * n; j = j + 1 }; "
+                     "y = n / 2; return 0 }; r = f()"),
+    # a name only holds a number after its number assignment has run
+    ("dce-parameter", 'function f(n) { t = n - 2; n = 1; return n }; r = f("s")'),
+    ("dce-builtin", "function f() { t = len - 1; len = 3; return 0 }; r = f()"),
+]
+
+def test_regressions():
+    print("testing regressions")
+    # compared without check(), whose shrinking could square n for much longer
+    for name, source in regressions:
+        assert disagreements(parser.parse(tokenize(source))) == [], name
+
+def test_minimize():
+    print("testing minimize")
+    backends["broken"] = lambda ast: {**ast, "statements": ast["statements"][:-1]} if ast["statements"] and "42" in unparse(ast) else ast
+    try:
+        source = "a = 1; b = [a, 2]; if (a) { print(b) }; c = 3 * (42 + a); d = 4"
+        name, found, smallest = check(("example", source), ["broken"])
+        assert ("broken", "environment") in found
+        assert smallest == "c = 42", smallest
+    finally:
+        del backends["broken"]
+
+def test_check_all():
+    print("testing check_all")
+    lines = []
+    failures = check_all([("ok", "x = 1; print(x)"), ("bad", "x = ("), ("slow", "while (1) { }")],
+                         jobs=2, report=lines.append, timeout=1)
+    assert [name for name, _, _ in failures] == ["bad", "slow"]
+    assert failures[1][1][0][0] == "timeout"
+    assert lines[-1] == "2 of 3 program(s) disagree."
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        sys.exit(main(sys.argv[1:]))
+    test_fingerprint()
+    test_unparse()
+    test_agreement()
+    test_regressions()
+    test_minimize()
+    test_check_all()
+    print("done.")
@@ -0,0 +1,363 @@
+from tokenizer import tokenize
+from parser import parse
+from rope import Rope
+from itertools import repeat
+import copy
+import operator
+
+printed_string = None
+
+
+binary_operators = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+def evaluate(ast, environment=None):
+    """
+    Evaluates an AST node and returns (value, returning).
+    The returning flag is set by a return statement and propagated by callers.
+    """
+    if environment is None:
+        environment = {}
+    return evaluate_step(ast, environment)
+
+def evaluate_untraced(ast, environment):
+    """
+    Evaluates one node, evaluating its children through evaluate_step.
+    """
+    global printed_string
+    tag = ast["tag"]
+    if tag == "number" or tag == "string":
+        return ast["value"], False
+    if tag == "identifier":
+        identifier = ast["value"]
+        scope = environment
+        while scope is not None:
+            if identifier in scope:
+                return scope[identifier], False
+            scope = scope.get("$parent")
+        if identifier in builtin_functions:
+            return builtin_functions[identifier], False
+        raise Exception(f"Value [{identifier}] not found in environment.")
+    if tag == "+":
+        left_value, _ = evaluate_step(ast["left"], environment)
+        right_value, _ = evaluate_step(ast["right"], environment)
+        if type(left_value) is str and type(right_value) is str:
+            return Rope(left_value) + right_value, False
+        return left_value + right_value, False
+    if tag in binary_operators:
+        left_value, _ = evaluate_step(ast["left"], environment)
+        right_value, _ = evaluate_step(ast["right"], environment)
+        return binary_operators[tag](left_value, right_value), False
+    if tag == "and":
+        left_value, _ = evaluate_step(ast["left"], environment)
+        if not left_value:
+            return left_value, False
+        return evaluate_step(ast["right"], environment)[0], False
+    if tag == "or":
+        left_value, _ = evaluate_step(ast["left"], environment)
+        if left_value:
+            return left_value, False
+        return evaluate_step(ast["right"], environment)[0], False
+    if tag == "not":
+        value, _ = evaluate_step(ast["value"], environment)
+        return not value, False
+    if tag == "negate":
+        value, _ = evaluate_step(ast["value"], environment)
+        return -value, False
+    if tag == "array":
+        return [evaluate_step(value, environment)[0] for value in ast["values"]], False
+    if tag == "object":
+        return {item["key"]: evaluate_step(item["value"], environment)[0] for item in ast["values"]}, False
+    if tag == "index":
+        container, _ = evaluate_step(ast["object"], environment)
+        index, _ = evaluate_step(ast["index"], environment)
+        return container[index], False
+    if tag == "member":
+        container, _ = evaluate_step(ast["object"], environment)
+        return container[ast["property"]], False
+    if tag == "function":
+        return {
+            "tag": "function",
+            "parameters": ast["parameters"],
+            "body": ast["body"],
+            "environment": environment,
+        }, False
+    if tag == "call":
+        function, _ = evaluate_step(ast["function"], environment)
+        arguments = [evaluate_step(value, environment)[0] for value in ast["arguments"]["values"]]
+        return call_step(function, arguments), False
+    if tag == "program":
+        last_value = None
+        for statement in ast["statements"]:
+            value, returning = evaluate_step(statement, environment)
+            if returning:
+                return value, True
+            last_value = value
+        return last_value, False
+    if tag == "block":
+        for statement in ast["statements"]:
+            value, returning = evaluate_step(statement, environment)
+            if returning:
+                return value, True
+        return None, False
+    if tag == "print":
+        values = [evaluate_step(value, environment)[0] for value in ast["arguments"]["values"]]
+        s = " ".join(str(value) for value in values)
+        print(s)
+        printed_string = s
+        return None, False
+    if tag == "if":
+        condition_value, _ = evaluate_step(ast["condition"], environment)
+        if condition_value:
+            return evaluate_step(ast["then"], environment)
+        if ast["else"]:
+            return evaluate_step(ast["else"], environment)
+        return None, False
+    if tag == "while":
+        while evaluate_step(ast["condition"], environment)[0]:
+            value, returning = evaluate_step(ast["do"], environment)
+            if returning:
+                return value, True
+        return None, False
+    if tag == "return":
+        if ast["value"] is None:
+            return None, True
+        value, _ = evaluate_step(ast["value"], environment)
+        return value, True
+    if tag == "assign":
+        target = ast["target"]
+        value, _ = evaluate_step(ast["value"], environment)
+        if target["tag"] == "identifier":
+            environment[target["value"]] = value
+        elif target["tag"] == "index":
+            container, _ = evaluate_step(target["object"], environment)
+            index, _ = evaluate_step(target["index"], environment)
+            container[index] = value
+        elif target["tag"] == "member":
+            container, _ = evaluate_step(target["object"], environment)
+            container[target["property"]] = value
+        else:
+            raise Exception(f"Cannot assign to [{target['tag']}].")
+        return None, False
+    raise Exception(f"Unknown AST node [{tag}].")
+
+# Every node and every call runs through these two names.  tracing.py binds
+# them to traced versions while listeners are installed, and back to these
+# when the last one is removed, so an untraced run checks for nothing.
+evaluate_step = evaluate_untraced
+
+def parameter_names(function):
+    """
+    Returns the parameter names of a function value made by evaluate().
+    """
+    return [parameter["value"] for parameter in function["parameters"]]
+
+def call_function(function, arguments):
+    """
+    Calls a built-in (a Python callable) or a function value created by evaluate().
+    """
+    return call_step(function, arguments)
+
+def call_untraced(function, arguments):
+    if callable(function):
+        return function(*arguments)
+    assert type(function) is dict and function["tag"] == "function", f"Cannot call [{function}]."
+    parameters = function["parameters"]
+    assert len(parameters) == len(arguments), f"Expected {len(parameters)} arguments, got {len(arguments)}."
+    local_environment = {"$parent": function["environment"]}
+    for name, argument in zip(parameter_names(function), arguments):
+        local_environment[name] = argument
+    for statement in function["body"]:
+        value, returning = evaluate_step(statement, local_environment)
+        if returning:
+            return value
+    return None
+
+call_step = call_untraced
+
+# BUILT-IN FUNCTIONS
+#
+# Each built-in works on a whole array in a single call, so a loop over n
+# elements costs one interpreter dispatch instead of n.  The per-element work
+# is pushed into map(), sum() and the operator module, which run in C.
+
+def elementwise(function, a, b):
+    if type(a) is list and type(b) is list:
+        assert len(a) == len(b), f"Array lengths differ: {len(a)} and {len(b)}."
+        return list(map(function, a, b))
+    if type(a) is list:
+        return list(map(function, a, repeat(b, len(a))))
+    if type(b) is list:
+        return list(map(function, repeat(a, len(b)), b))
+    return function(a, b)
+
+def builtin_map(function, values):
+    if callable(function):
+        return list(map(function, values))
+    return [call_function(function, [value]) for value in values]
+
+def builtin_fill(count, value):
+    if type(value) is list or type(value) is dict:
+        # each element gets its own copy, so changing one row leaves the others alone
+        return [copy.copy(value) for _ in range(count)]
+    return [value] * count
+
+def builtin_dot(a, b):
+    assert len(a) == len(b), f"Array lengths differ: {len(a)} and {len(b)}."
+    return sum(map(operator.mul, a, b))
+
+builtin_functions = {
+    "len": len,
+    "range": lambda *arguments: list(range(*arguments)),
+    "fill": builtin_fill,
+    "sum": sum,
+    "dot": builtin_dot,
+    "add": lambda a, b: elementwise(operator.add, a, b),
+    "mul": lambda a, b: elementwise(operator.mul, a, b),
+    "map": builtin_map,
+}
+
+def eval(s, environment=None):
+    tokens = tokenize(s)
+    ast = parse(tokens)
+    result, _ = evaluate(ast, environment)
+    return result
+
+def test_evaluate_number():
+    print("testing evaluate number")
+    assert evaluate({"tag":"number","value":4}) == (4, False)
+
+def test_evaluate_expression():
+    print("testing evaluate expression")
+    assert eval("1+2+3") == 6
+    assert eval("1+2*3") == 7
+    assert eval("(1+2)*3") == 9
+    assert eval("(1.0+2.1)*3") == 9.3
+    assert eval("4/2") == 2
+    assert eval("1<2") == True
+    assert eval("2<=1") == False
+    assert eval("2==2") == True
+    assert eval("1!=1") == False
+    assert eval("-1") == -1
+    assert eval("!1") == False
+    assert eval("0&&1") == False
+    assert eval("1&&2") == 2
+    assert eval("0||0") == False
+    assert eval("0||3") == 3
+
+def test_evaluate_identifier():
+    print("testing evaluate identifier")
+    try:
+        eval("x+3")
+        assert False, "Error expected for missing value in environment"
+    except Exception as e:
+        assert "not found" in str(e)
+    assert eval("x+3", {"x":3}) == 6
+    assert eval("x+y", {"$parent":{"$parent":{"x":4}},"y":5}) == 9
+
+def test_evaluate_print():
+    print("testing evaluate print")
+    assert eval("print(3)") == None
+    assert printed_string == "3"
+    assert eval("print(1,\"a\",[2])") == None
+    assert printed_string == "1 a [2]"
+
+def test_evaluate_assignment():
+    print("testing evaluate assignment")
+    env = {"x":4}
+    eval("x=7;a=[1,2];a[0]=x;o={k:1};o.k=2;o[\"j\"]=3", env)
+    assert env["x"] == 7
+    assert env["a"] == [7,2]
+    assert env["o"] == {"k":2,"j":3}
+
+def test_evaluate_if_while():
+    print("testing evaluate if and while")
+    env = {"x":4,"y":5}
+    eval("if(0){x=5}else{y=9}", env)
+    assert env["x"] == 4 and env["y"] == 9
+    eval("while(x<6){y=y+1;x=x+1}", env)
+    assert env["x"] == 6 and env["y"] == 11
+
+def test_evaluate_data():
+    print("testing evaluate arrays and objects")
+    assert eval("[1,2,[3,4]][2][1]") == 4
+    assert eval("x={a:1,\"b\":{c:[5]}}.b.c[0];x") == 5
+    assert eval("\"abc\"[1]") == "b"
+
+def test_evaluate_strings():
+    print("testing evaluate strings")
+    env = {}
+    eval("s=\"\";i=0;while(i<5){s=s+\"ab\";i=i+1};t=\"<\"+s+\">\";c=s[1];n=len(s);e=s==\"ababababab\"", env)
+    assert type(env["s"]) is Rope
+    assert env["s"] == "ababababab"
+    assert env["t"] == "<ababababab>"
+    assert env["c"] == "b"
+    assert env["n"] == 10
+    assert env["e"] == True
+    eval("print(s)", env)
+    assert printed_string == "ababababab"
+    assert eval("(\"a\"+\"b\")*2") == "abab" and eval("2*(\"a\"+\"b\")") == "abab"
+
+def test_evaluate_function():
+    print("testing evaluate function")
+    env = {}
+    eval("function f(x){if(x>10){return 42};return x+1};a=f(1);b=f(11)", env)
+    assert env["a"] == 2 and env["b"] == 42
+    env = {}
+    eval("function counter(n){return function(){return n}};c=counter(3)()", env)
+    assert env["c"] == 3
+    env = {}
+    eval("function fib(n){if(n<2){return n};return fib(n-1)+fib(n-2)};x=fib(10)", env)
+    assert env["x"] == 55
+    assert eval("x=function(){return}();x") == None
+
+def test_evaluate_builtins():
+    print("testing evaluate built-in functions")
+    env = {}
+    eval("a=range(4);b=fill(4,2);c=add(a,b);d=mul(a,b);e=mul(a,3)", env)
+    assert env["a"] == [0,1,2,3]
+    assert env["b"] == [2,2,2,2]
+    assert env["c"] == [2,3,4,5]
+    assert env["d"] == [0,2,4,6]
+    assert env["e"] == [0,3,6,9]
+    assert eval("sum(range(1,5))") == 10
+    assert eval("dot([1,2,3],[4,5,6])") == 32
+    assert eval("len(fill(5,0))") == 5
+    # arrays and objects are copied, not shared between elements
+    eval("a=fill(3,[0,0]);a[0][0]=1;o=fill(2,{k:1});o[1].k=2", env)
+    assert env["a"] == [[1,0],[0,0],[0,0]]
+    assert env["o"] == [{"k":1},{"k":2}]
+    assert eval("map(function(x){return x*x},[1,2,3])") == [1,4,9]
+    assert eval("map(len,[[1],[],[1,2]])") == [1,0,2]
+    try:
+        eval("add([1],[1,2])")
+        assert False, "Error expected for mismatched array lengths"
+    except AssertionError as e:
+        assert "lengths differ" in str(e)
+    # the whole-array call and the element loop agree
+    env = {}
+    eval("a=range(100);b=range(100);c=fill(100,0);i=0;while(i<100){c[i]=a[i]+b[i];i=i+1};d=add(a,b)", env)
+    assert env["c"] == env["d"]
+
+if __name__ == "__main__":
+    test_evaluate_number()
+    test_evaluate_expression()
+    test_evaluate_identifier()
+    test_evaluate_print()
+    test_evaluate_assignment()
+    test_evaluate_if_while()
+    test_evaluate_data()
+    test_evaluate_strings()
+    test_evaluate_function()
+    test_evaluate_builtins()
+    print("done.")
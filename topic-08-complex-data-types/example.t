@@ -0,0 +1,6 @@
+a = range(10);
+b = fill(10, 2);
+print(add(a, b));
+print(dot(a, b));
+function square(x) { return x * x };
+print(sum(map(square, a)))
@@ -0,0 +1,429 @@
+"""
+flat.py
+
+A flat, array-encoded AST.
+
+The whole tree lives in a few parallel arrays instead of linked dicts:
+
+    kinds[i]      index of node i's tag in `tags`
+    starts[i]     node i's operands are operands[starts[i]:starts[i+1]]
+    operands      child node indices, list counts, constant and name indices
+    positions[i]  source offset of node i's first token (-1 when not known)
+
+plus a constant pool (numbers and string literals) and a name pool
+(identifiers, properties, object keys).  Nodes are stored in post-order, so
+children always come before their parent and the root is the last node.
+
+The encoding is a handful of arrays and two lists, which makes it cheap to
+pickle and to write into a program image, and it adds almost nothing for the
+garbage collector to track.  FlatNode gives read-only mapping access to any
+node, decoding its fields the first time they are read, so evaluate() can run
+directly on a flat AST without converting it back.
+"""
+
+import gc
+import pickle
+import sys
+import time
+import tracemalloc
+from array import array
+from collections.abc import Mapping
+
+# Field layout of each tag.  Field kinds:
+#   node      one child node index
+#   optional  a child node index, or -1 for None
+#   nodes     a count followed by that many child node indices
+#   entries   a count followed by (name index, child node index) pairs
+#   constant  an index into the constant pool
+#   name      an index into the name pool
+schema = {
+    "number": [("value", "constant")],
+    "string": [("value", "constant")],
+    "identifier": [("value", "name")],
+    "not": [("value", "node")],
+    "negate": [("value", "node")],
+    "array": [("values", "nodes")],
+    "object": [("values", "entries")],
+    "index": [("object", "node"), ("index", "node")],
+    "member": [("object", "node"), ("property", "name")],
+    "arguments": [("values", "nodes")],
+    "call": [("function", "node"), ("arguments", "node")],
+    "function": [("parameters", "nodes"), ("body", "nodes")],
+    "print": [("arguments", "node")],
+    "if": [("condition", "node"), ("then", "node"), ("else", "optional")],
+    "while": [("condition", "node"), ("do", "node")],
+    "return": [("value", "optional")],
+    "assign": [("target", "node"), ("value", "node")],
+    "block": [("statements", "nodes")],
+    "program": [("statements", "nodes")],
+}
+for tag in ["+", "-", "*", "/", "<", ">", "<=", ">=", "==", "!=", "and", "or"]:
+    schema[tag] = [("left", "node"), ("right", "node")]
+
+tags = list(schema)
+kind_of_tag = {tag: kind for kind, tag in enumerate(tags)}
+layouts = [schema[tag] for tag in tags]
+
+class FlatAST:
+    def __init__(self, kinds, starts, operands, positions, constants, names):
+        self.kinds = kinds
+        self.starts = starts
+        self.operands = operands
+        self.positions = positions
+        self.constants = constants
+        self.names = names
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def root(self):
+        return len(self.kinds) - 1
+
+    def tag(self, index):
+        return tags[self.kinds[index]]
+
+    def fields(self, index):
+        """
+        Decodes node `index` into {field: value}; child nodes are left as indices.
+        """
+        operands = self.operands
+        position = self.starts[index]
+        fields = {}
+        for field, kind in layouts[self.kinds[index]]:
+            if kind == "node":
+                fields[field] = operands[position]
+                position += 1
+            elif kind == "optional":
+                child = operands[position]
+                fields[field] = None if child < 0 else child
+                position += 1
+            elif kind == "nodes":
+                count = operands[position]
+                fields[field] = list(operands[position + 1:position + 1 + count])
+                position += 1 + count
+            elif kind == "entries":
+                count = operands[position]
+                fields[field] = [
+                    (self.names[operands[position + 1 + 2 * k]], operands[position + 2 + 2 * k])
+                    for k in range(count)
+                ]
+                position += 1 + 2 * count
+            elif kind == "constant":
+                fields[field] = self.constants[operands[position]]
+                position += 1
+            else:
+                fields[field] = self.names[operands[position]]
+                position += 1
+        return fields
+
+    def children(self, index):
+        """
+        Returns the indices of the direct children of node `index`, in field order.
+        """
+        fields = self.fields(index)
+        children = []
+        for field, kind in layouts[self.kinds[index]]:
+            value = fields[field]
+            if kind == "node" or (kind == "optional" and value is not None):
+                children.append(value)
+            elif kind == "nodes":
+                children.extend(value)
+            elif kind == "entries":
+                children.extend(child for _, child in value)
+        return children
+
+    def walk(self, index=None):
+        """
+        Yields node indices in pre-order, using an explicit stack.
+        """
+        stack = [self.root if index is None else index]
+        while stack:
+            index = stack.pop()
+            yield index
+            stack.extend(reversed(self.children(index)))
+
+    def node(self, index=None):
+        return FlatNode(self, self.root if index is None else index)
+
+    def to_dict(self, index=None):
+        """
+        Returns node `index` (the root by default) as a dict AST.
+        """
+        # children come before their parent, so in index order every child is built first
+        built = {}
+        for index in sorted(self.walk(index)):
+            ast = {"tag": self.tag(index)}
+            fields = self.fields(index)
+            for field, kind in layouts[self.kinds[index]]:
+                value = fields[field]
+                if kind == "node":
+                    value = built[value]
+                elif kind == "optional":
+                    value = None if value is None else built[value]
+                elif kind == "nodes":
+                    value = [built[child] for child in value]
+                elif kind == "entries":
+                    value = [{"key": key, "value": built[child]} for key, child in value]
+                ast[field] = value
+            built[index] = ast
+        return ast
+
+class FlatNode(Mapping):
+    """
+    A read-only mapping view of one node of a FlatAST.
+
+    The fields are decoded the first time any of them is read, and child
+    nodes become FlatNodes of their own.  Lookups, get(), `in`, iteration and
+    == all go through the decoded fields, so a node compares equal to the
+    dict AST it was encoded from.
+    """
+    __slots__ = ("flat", "index", "decoded")
+
+    def __init__(self, flat, index):
+        self.flat = flat
+        self.index = index
+        self.decoded = None
+
+    def __getitem__(self, key):
+        return (self.decoded or self.decode())[key]
+
+    def __iter__(self):
+        return iter(self.decoded or self.decode())
+
+    def __len__(self):
+        return len(self.decoded or self.decode())
+
+    def __repr__(self):
+        return f"FlatNode({self.flat.tag(self.index)!r}, {self.index})"
+
+    def decode(self):
+        flat = self.flat
+        fields = flat.fields(self.index)
+        decoded = {"tag": flat.tag(self.index)}
+        for field, kind in layouts[flat.kinds[self.index]]:
+            value = fields[field]
+            if kind == "node":
+                value = FlatNode(flat, value)
+            elif kind == "optional":
+                value = None if value is None else FlatNode(flat, value)
+            elif kind == "nodes":
+                value = [FlatNode(flat, child) for child in value]
+            elif kind == "entries":
+                value = [{"key": name, "value": FlatNode(flat, child)} for name, child in value]
+            decoded[field] = value
+        self.decoded = decoded
+        return decoded
+
+    def to_dict(self):
+        return self.flat.to_dict(self.index)
+
+def from_dict(ast, positions=None):
+    """
+    Encodes a dict AST (or a nodes.py AST) as a FlatAST.  positions maps
+    id(node) to a source offset, as parser.parse_with_positions() returns.
+    """
+    positions_of = positions or {}
+    kinds = array("i")
+    starts = array("i")
+    operands = array("i")
+    positions = array("i")
+    constants = []
+    constant_index = {}
+    names = []
+    name_index = {}
+
+    def constant(value):
+        key = (type(value), value)
+        if key not in constant_index:
+            constant_index[key] = len(constants)
+            constants.append(value)
+        return constant_index[key]
+
+    def name(value):
+        if value not in name_index:
+            name_index[value] = len(names)
+            names.append(value)
+        return name_index[value]
+
+    def children(ast):
+        for field, kind in schema[ast["tag"]]:
+            value = ast[field]
+            if kind == "node" or (kind == "optional" and value is not None):
+                yield value
+            elif kind == "nodes":
+                yield from value
+            elif kind == "entries":
+                for item in value:
+                    yield item["value"]
+
+    def encode(ast):
+        # post-order with an explicit stack, so nesting deeper than the
+        # recursion limit still encodes; each node is pushed with its child
+        # count once its children are pushed, and finds their indices on top
+        # of `encoded`
+        encoded = []
+        stack = [(ast, None)]
+        while stack:
+            ast, count = stack.pop()
+            if count is None:
+                nodes = list(children(ast))
+                stack.append((ast, len(nodes)))
+                stack.extend((child, None) for child in reversed(nodes))
+                continue
+            child_indices = iter(encoded[len(encoded) - count:])
+            del encoded[len(encoded) - count:]
+            node_operands = []
+            for field, kind in schema[ast["tag"]]:
+                value = ast[field]
+                if kind == "node":
+                    node_operands.append(next(child_indices))
+                elif kind == "optional":
+                    node_operands.append(-1 if value is None else next(child_indices))
+                elif kind == "nodes":
+                    node_operands.append(len(value))
+                    node_operands.extend(next(child_indices) for _ in value)
+                elif kind == "entries":
+                    node_operands.append(len(value))
+                    for item in value:
+                        node_operands.append(name(item["key"]))
+                        node_operands.append(next(child_indices))
+                elif kind == "constant":
+                    node_operands.append(constant(value))
+                else:
+                    node_operands.append(name(value))
+            encoded.append(len(kinds))
+            kinds.append(kind_of_tag[ast["tag"]])
+            starts.append(len(operands))
+            operands.extend(node_operands)
+            positions.append(positions_of.get(id(ast), -1))
+
+    encode(ast)
+    starts.append(len(operands))
+    return FlatAST(kinds, starts, operands, positions, constants, names)
+
+test_source = 'x = [1, "a", {k: -y, "j": 2.5}]; if (x[0] < 2 && !z) { print(x.k) } else { f(1)(2) }; while (0) { return }; function g(a, b) { return a * 2 }; if (1) { }'
+
+def test_from_dict():
+    print("testing flat from_dict")
+    from tokenizer import tokenize
+    from parser import parse
+    ast = parse(tokenize(test_source))
+    flat = from_dict(ast)
+    assert flat.tag(flat.root) == "program"
+    assert flat.to_dict() == ast
+    flat = from_dict(parse(tokenize("a = 1 + 1.0 + a * 1")))
+    assert flat.constants == [1, 1.0]
+    assert flat.names == ["a"]
+    assert from_dict(parse(tokenize(test_source), nodes=True)).to_dict() == ast
+    assert set(from_dict(ast).positions) == {-1}
+
+def test_positions():
+    print("testing flat positions")
+    from tokenizer import tokenize
+    from parser import parse_with_positions
+    flat = from_dict(*parse_with_positions(tokenize(test_source)))
+    assert -1 not in flat.positions
+    found = {(flat.tag(index), test_source[flat.positions[index]:][:4]) for index in flat.walk()}
+    assert ("program", "x = ") in found and ("array", "[1, ") in found and ("negate", "-y, ") in found
+    assert ("if", "if (") in found and ("<", "x[0]") in found and ("call", "f(1)") in found
+    assert ("return", "retu") in found and ("function", "func") in found
+
+def test_walk():
+    print("testing flat walk")
+    from tokenizer import tokenize
+    from parser import parse
+    flat = from_dict(parse(tokenize("a = b + 1; print(a)")))
+    walked = [flat.tag(index) for index in flat.walk()]
+    assert walked == ["program", "assign", "identifier", "+", "identifier", "number", "print", "arguments", "identifier"]
+    assert sorted(flat.walk()) == list(range(len(flat)))
+    assert [flat.tag(index) for index in flat.children(flat.root)] == ["assign", "print"]
+
+def test_flat_node():
+    print("testing flat node")
+    from tokenizer import tokenize
+    from parser import parse
+    from evaluator import evaluate
+    ast = parse(tokenize(test_source))
+    node = from_dict(ast).node()
+    assert node["statements"][1]["else"]["tag"] == "block"
+    assert node.to_dict() == ast and node == ast and ast == node
+    node = from_dict(ast).node()
+    assert "statements" in node and node.get("statements") is node["statements"]
+    assert set(node) == {"tag", "statements"} and len(node) == 2 and node.get("else") is None
+    source = "function fib(n){if(n<2){return n};return fib(n-1)+fib(n-2)};o={a:[1,2]};o.a[1]=fib(10)"
+    environment = {}
+    evaluate(from_dict(parse(tokenize(source))).node(), environment)
+    assert environment["o"] == {"a": [1, 55]}
+
+def test_deep():
+    print("testing flat deep nesting")
+    from tokenizer import tokenize
+    from parser import parse
+    depth = 3 * sys.getrecursionlimit()
+    limit = sys.getrecursionlimit()
+    # the parser needs a dozen or so frames a level, but encoding and decoding need none
+    sys.setrecursionlimit(20 * depth + 1000)
+    try:
+        ast = parse(tokenize("x = " + "[" * depth + "1" + "]" * depth))
+    finally:
+        sys.setrecursionlimit(limit)
+    flat = from_dict(ast)
+    assert len(flat) == depth + 4
+    node = flat.to_dict()["statements"][0]["value"]
+    for _ in range(depth):
+        node = node["values"][0]
+    assert node == {"tag": "number", "value": 1}
+
+def test_pickle():
+    print("testing flat pickle")
+    from tokenizer import tokenize
+    from parser import parse
+    ast = parse(tokenize(test_source))
+    flat = pickle.loads(pickle.dumps(from_dict(ast)))
+    assert flat.to_dict() == ast
+
+def benchmark_flat():
+    """
+    Compares dict and flat ASTs on memory, GC-tracked objects, pickling and evaluation.
+    """
+    from tokenizer import tokenize
+    from parser import parse
+    from evaluator import evaluate
+    from nodes import generated_program
+    ast = parse(tokenize(generated_program(1000000)))
+    flat = from_dict(ast)
+    for name, tree in [("dict", ast), ("flat", flat)]:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tracked = len(gc.get_objects())
+        copy = pickle.loads(pickle.dumps(tree))
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracked = len(gc.get_objects()) - tracked
+        tracemalloc.stop()
+        del copy
+        start = time.perf_counter()
+        data = pickle.dumps(tree, protocol=pickle.HIGHEST_PROTOCOL)
+        dumped = time.perf_counter() - start
+        start = time.perf_counter()
+        pickle.loads(data)
+        loaded = time.perf_counter() - start
+        print(f"{name}: {memory / 1024:.0f} KB, {tracked} GC-tracked objects, "
+              f"pickle {len(data) / 1024:.0f} KB, dumps {dumped:.3f} s, loads {loaded:.3f} s")
+    loop = "function fib(n){if(n<2){return n};return fib(n-1)+fib(n-2)};i=0;s=0;while(i<20000){s=s+i*2-1;i=i+1};f=fib(18)"
+    for name, tree in [("dict", parse(tokenize(loop))), ("flat", from_dict(parse(tokenize(loop))).node())]:
+        start = time.perf_counter()
+        evaluate(tree, {})
+        print(f"{name} AST evaluate: {time.perf_counter() - start:.3f} s")
+
+if __name__ == "__main__":
+    test_from_dict()
+    test_positions()
+    test_walk()
+    test_flat_node()
+    test_deep()
+    test_pickle()
+    if "benchmark" in sys.argv:
+        benchmark_flat()
+    print("done.")
@@ -0,0 +1,393 @@
+"""
+generator.py
+
+Generates random programs from the EBNF `grammar` in parser.py.
+
+The grammar text is parsed into a small expression tree and expanded at
+random.  The shape of the output is tunable:
+
+    depth       how deeply expressions and statements may nest
+    width       the most repetitions of any { ... } group
+    repeat      the chance of taking each optional part or further repetition
+    statements  the number of top-level statements
+    mix         weights for rule alternatives, keyed by the alternative's
+                text in the grammar, e.g. {"statement": {"while_statement": 0}}
+
+Once `depth` is reached, the generator only picks the alternatives that
+close off nesting soonest.  Every generated statement is checked with the
+real parser and regenerated if it does not parse, because the grammar is
+looser than the parser in a few places (a statement that starts with "{" is
+always read as a block, for example).  Programs are yielded statement by
+statement so that large ones can be streamed to disk.
+
+usage: python generator.py                            run the tests
+       python generator.py statements [output.t]     write a random program
+       python generator.py benchmark                 and the scaling curves
+"""
+
+import contextlib
+import io
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+import parser
+from tokenizer import tokenize
+
+# rules whose expansion counts as one level of nesting
+nesting_rules = {"expression", "statement"}
+
+def parse_grammar(lines):
+    """
+    Parses "name = expression" lines into {name: tree}.  Trees are tuples:
+    ("alt", [trees]), ("seq", [trees]), ("opt", tree), ("rep", tree),
+    ("lit", text), ("token", kind) or ("rule", name); alternatives also
+    carry their source text as a third element, for weighting.
+    """
+    rules = {}
+    for line in lines:
+        name, text = line.split("=", 1)
+        rules[name.strip()] = parse_ebnf(text.strip())
+    return rules
+
+def ebnf_tokens(text):
+    tokens = []
+    position = 0
+    while position < len(text):
+        c = text[position]
+        if c.isspace():
+            position += 1
+        elif c == '"':
+            end = text.index('"', position + 1)
+            tokens.append(text[position:end + 1])
+            position = end + 1
+        elif c == "<":
+            end = text.index(">", position)
+            tokens.append(text[position:end + 1])
+            position = end + 1
+        elif c in "|[]{}()":
+            tokens.append(c)
+            position += 1
+        else:
+            end = position
+            while end < len(text) and (text[end].isalnum() or text[end] == "_"):
+                end += 1
+            tokens.append(text[position:end])
+            position = end
+    return tokens
+
+def parse_ebnf(text):
+    tokens = ebnf_tokens(text)
+    tree, rest = parse_alternatives(tokens)
+    assert rest == [], f"Unexpected {rest[0]} in grammar rule [{text}]"
+    return tree
+
+def parse_alternatives(tokens):
+    alternatives = []
+    start = len(tokens)
+    tree, tokens = parse_sequence(tokens)
+    alternatives.append(tree)
+    while tokens and tokens[0] == "|":
+        tree, tokens = parse_sequence(tokens[1:])
+        alternatives.append(tree)
+    if len(alternatives) == 1:
+        return alternatives[0], tokens
+    return ("alt", alternatives), tokens
+
+def parse_sequence(tokens):
+    items = []
+    source = []
+    while tokens and tokens[0] not in ["|", "]", "}", ")"]:
+        token = tokens[0]
+        if token in ["[", "{", "("]:
+            closing = {"[": "]", "{": "}", "(": ")"}[token]
+            tree, rest = parse_alternatives(tokens[1:])
+            assert rest and rest[0] == closing, f"Expected {closing} in grammar"
+            source.extend(tokens[:len(tokens) - len(rest) + 1])
+            tokens = rest[1:]
+            items.append({"[": ("opt", tree), "{": ("rep", tree), "(": tree}[token])
+            continue
+        if token.startswith('"'):
+            items.append(("lit", token[1:-1]))
+        elif token.startswith("<"):
+            items.append(("token", token[1:-1]))
+        elif token in ["identifier", "string", "number"]:
+            items.append(("token", token))
+        else:
+            items.append(("rule", token))
+        source.append(token)
+        tokens = tokens[1:]
+    return ("seq", items, " ".join(source)), tokens
+
+def nesting_costs(rules):
+    """
+    Returns {rule: the fewest nesting-rule expansions needed to finish it}.
+    """
+    costs = {name: math.inf for name in rules}
+
+    def cost(tree):
+        kind = tree[0]
+        if kind == "alt":
+            return min(cost(item) for item in tree[1])
+        if kind == "seq":
+            return sum(cost(item) for item in tree[1])
+        if kind in ["opt", "rep", "lit", "token"]:
+            return 0
+        return (1 if tree[1] in nesting_rules else 0) + costs[tree[1]]
+
+    changed = True
+    while changed:
+        changed = False
+        for name, tree in rules.items():
+            value = cost(tree)
+            if value < costs[name]:
+                costs[name] = value
+                changed = True
+    return costs, cost
+
+class Generator:
+    def __init__(self, depth=3, width=3, repeat=0.3, mix=None, seed=None, names=None, targets=None, overrides=None, grammar=None):
+        lines = list(grammar or parser.grammar)
+        for name, text in (overrides or {}).items():
+            lines = [line for line in lines if line.split("=", 1)[0].strip() != name] + [f"{name} = {text}"]
+        self.rules = parse_grammar(lines)
+        self.costs, self.cost = nesting_costs(self.rules)
+        self.depth = depth
+        self.width = width
+        self.repeat = repeat
+        self.mix = mix or {}
+        self.random = random.Random(seed)
+        self.names = names or ["a", "b", "c", "x", "y", "z", "count", "total", "item", "node"]
+        self.targets = targets or self.names
+
+    def token(self, kind):
+        if kind == "number":
+            if self.random.random() < 0.2:
+                return f"{self.random.randint(0, 99)}.{self.random.randint(0, 9)}"
+            return str(self.random.randint(0, 99))
+        if kind == "string":
+            letters = "abcdefgh xyz"
+            text = "".join(self.random.choice(letters) for _ in range(self.random.randint(0, 6)))
+            if self.random.random() < 0.2:
+                text += self.random.choice(["\\n", "\\t", '\\"', "\\\\"])
+            return '"' + text + '"'
+        if kind == "target":
+            return self.random.choice(self.targets)
+        return self.random.choice(self.names)
+
+    def choose(self, rule, alternatives, level):
+        if level >= self.depth:
+            best = min(self.cost(item) for item in alternatives)
+            alternatives = [item for item in alternatives if self.cost(item) == best]
+            return self.random.choice(alternatives)
+        weights = self.mix.get(rule, {})
+        weighted = [(item, weights.get(item[2] if item[0] == "seq" else "", 1)) for item in alternatives]
+        weighted = [(item, weight) for item, weight in weighted if weight > 0]
+        total = sum(weight for _, weight in weighted)
+        pick = self.random.random() * total
+        for item, weight in weighted:
+            pick -= weight
+            if pick < 0:
+                return item
+        return weighted[-1][0]
+
+    def expand(self, tree, rule, level, output):
+        kind = tree[0]
+        if kind == "alt":
+            self.expand(self.choose(rule, tree[1], level), rule, level, output)
+        elif kind == "seq":
+            for item in tree[1]:
+                self.expand(item, rule, level, output)
+        elif kind == "opt":
+            if level < self.depth and self.random.random() < self.repeat:
+                self.expand(tree[1], rule, level, output)
+        elif kind == "rep":
+            count = 0
+            while count < self.width and level < self.depth and self.random.random() < self.repeat:
+                self.expand(tree[1], rule, level, output)
+                count += 1
+        elif kind == "lit":
+            output.append(tree[1])
+        elif kind == "token":
+            output.append(self.token(tree[1]))
+        else:
+            name = tree[1]
+            self.expand(self.rules[name], name, level + (1 if name in nesting_rules else 0), output)
+
+    def generate(self, rule="statement"):
+        """
+        Returns the text of one random expansion of `rule` that the parser accepts.
+        """
+        parse_function = getattr(parser, "parse_" + rule)
+        for _ in range(100):
+            output = []
+            self.expand(("rule", rule), None, 0, output)
+            text = " ".join(output)
+            try:
+                tokens = tokenize(text)
+                _, rest = parse_function(tokens)
+                if rest[0]["tag"] is None:
+                    return text
+            except Exception:
+                pass
+        raise Exception(f"Could not generate a parseable {rule}.")
+
+    def program(self, statements):
+        """
+        Yields the text of a program of `statements` statements, one piece per statement.
+        """
+        for i in range(statements):
+            yield (";\n" if i > 0 else "") + self.generate("statement")
+
+def write_program(path, statements, **options):
+    """
+    Streams a generated program to `path` and returns the number of characters written.
+    """
+    written = 0
+    with open(path, "w") as f:
+        for piece in Generator(**options).program(statements):
+            f.write(piece)
+            written += len(piece)
+    return written
+
+# Options for programs that evaluate to completion: no loops, functions or
+# calls, only numbers and names, and assignments go to names that are never
+# read, so values stay small.
+runnable_names = ["p0", "p1", "p2", "p3", "p4"]
+runnable_options = {
+    "names": runnable_names,
+    "targets": ["v0", "v1", "v2", "v3", "v4"],
+    "overrides": {
+        "assignment_statement": '<target> "=" expression',
+        "simple_expression": '<number> | <identifier> | "(" expression ")" | "-" expression | "not" expression',
+        "complex_expression": "simple_expression",
+        "arithmetic_term": 'arithmetic_factor { "*" arithmetic_factor }',
+        "statement": "if_statement | print_statement | assignment_statement",
+    },
+}
+
+def runnable_program(statements, seed=None, depth=4, width=3):
+    prelude = "; ".join(f"{name} = {i + 2}" for i, name in enumerate(runnable_names))
+    body = "".join(Generator(depth=depth, width=width, seed=seed, **runnable_options).program(statements))
+    return prelude + ";\n" + body
+
+def looping_program(statements, seed=None, passes=3, depth=3, width=3):
+    """
+    Returns a runnable program whose generated statements run inside a counted
+    while loop and read the names they assign.  Every name starts out as a
+    float, so repeated products overflow to inf rather than growing without bound.
+    """
+    targets = runnable_options["targets"]
+    options = {**runnable_options, "names": runnable_names + targets + ["k"]}
+    prelude = "; ".join(f"{name} = {i + 1.5}" for i, name in enumerate(runnable_names + targets))
+    body = "".join(Generator(depth=depth, width=width, seed=seed, **options).program(statements))
+    return f"{prelude};\nk = 0;\nwhile (k < {passes}) {{\n{body};\nk = k + 1\n}}"
+
+def test_parse_grammar():
+    print("testing parse_grammar")
+    rules = parse_grammar(parser.grammar)
+    assert set(rules) >= {"program", "statement", "expression", "simple_expression"}
+    assert rules["expression"] == ("seq", [("rule", "logical_expression")], "logical_expression")
+    tree = rules["arithmetic_term"]
+    assert tree[0] == "seq" and tree[1][1][0] == "rep"
+    assert rules["statement"][0] == "alt" and len(rules["statement"][1]) == 6
+    costs, _ = nesting_costs(rules)
+    # print() and a bare name need no further nesting; an if needs a condition and a block
+    assert costs["statement"] == 0 and costs["expression"] == 0 and costs["if_statement"] == 2
+
+def test_generate():
+    print("testing generate")
+    generator = Generator(seed=1)
+    for _ in range(50):
+        text = generator.generate()
+        parser.parse(tokenize(text))
+    source = "".join(Generator(seed=2).program(30))
+    ast = parser.parse(tokenize(source))
+    assert len(ast["statements"]) == 30
+
+def test_mix_and_depth():
+    print("testing mix and depth")
+    generator = Generator(seed=3, mix={"statement": {"while_statement": 1, "if_statement": 0, "print_statement": 0,
+                                                      "function_statement": 0, "return_statement": 0, "assignment_statement": 0}})
+    for _ in range(10):
+        assert generator.generate().startswith("while")
+    shallow = Generator(seed=4, depth=1)
+    for _ in range(20):
+        ast = parser.parse(tokenize(shallow.generate()))
+        assert "block" not in str(ast) or "'statements': []" in str(ast)
+
+def test_runnable_program():
+    print("testing runnable program")
+    import evaluator
+    for seed in range(5):
+        source = runnable_program(40, seed=seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluator.evaluate(parser.parse(tokenize(source)), {})
+
+def test_looping_program():
+    print("testing looping program")
+    import evaluator
+    for seed in range(5):
+        environment = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluator.evaluate(parser.parse(tokenize(looping_program(20, seed=seed))), environment)
+        assert environment["k"] == 3
+
+def test_write_program():
+    print("testing write_program")
+    import os, tempfile
+    path = os.path.join(tempfile.mkdtemp(), "generated.t")
+    written = write_program(path, 25, seed=5)
+    with open(path) as f:
+        source = f.read()
+    assert len(source) == written
+    assert len(parser.parse(tokenize(source))["statements"]) == 25
+
+def run_phases(source):
+    import evaluator
+    start = time.perf_counter()
+    tokens = tokenize(source)
+    tokenized = time.perf_counter()
+    ast = parser.parse(tokens)
+    parsed = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        evaluator.evaluate(ast, {})
+    evaluated = time.perf_counter()
+    return tokenized - start, parsed - tokenized, evaluated - parsed
+
+def benchmark_scaling(sizes=(50, 100, 200, 400, 800)):
+    """
+    Prints time and peak memory of tokenize, parse and evaluate against program size.
+    Memory is measured in a second run, since tracing allocations slows everything down.
+    """
+    print(f"{'statements':>10} {'chars':>8} {'tokenize s':>11} {'parse s':>9} {'evaluate s':>11} {'peak KB':>9}")
+    for size in sizes:
+        source = runnable_program(size, seed=size, depth=3)
+        tokenized, parsed, evaluated = run_phases(source)
+        tracemalloc.start()
+        run_phases(source)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{size:>10} {len(source):>8} {tokenized:>11.4f} {parsed:>9.4f} {evaluated:>11.4f} {peak / 1024:>9.0f}")
+
+if __name__ == "__main__":
+    if sys.argv[1:] and sys.argv[1] != "benchmark":
+        statements = int(sys.argv[1])
+        if len(sys.argv) > 2:
+            write_program(sys.argv[2], statements)
+        else:
+            for piece in Generator().program(statements):
+                sys.stdout.write(piece)
+            print()
+    else:
+        test_parse_grammar()
+        test_generate()
+        test_mix_and_depth()
+        test_runnable_program()
+        test_looping_program()
+        test_write_program()
+        if "benchmark" in sys.argv:
+            benchmark_scaling()
+        print("done.")
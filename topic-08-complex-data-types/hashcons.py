@@ -0,0 +1,259 @@
+"""
+hashcons.py
+
+Hash-consed ASTs: structurally identical subtrees become one shared node.
+
+parse_shared() interns nodes as the parser builds them (through the
+parser's builder hook), so a repeated subtree is dropped as soon as it is
+parsed and the unshared tree never exists.  Each node (and each list of
+nodes) is looked up in the table by a flat tuple of its field values, where
+a child is keyed by its identity (it is already the shared copy), a string
+by itself, and any other constant by its type and value, so 1, 1.0 and True
+stay apart.  The first node with a given key is kept and every later one is
+replaced by it, so generated programs full of repeated i + 1, a[i] and
+constants keep one copy of each.  Table.share() does the same for an AST
+that is already built.
+
+The keys are only needed while interning.  parse_shared() releases them
+when it makes its own table; a table passed in, to share nodes across
+programs, keeps them until release() is called.  Table.cached() keeps
+per-node results (inferred types, compiled code, names read), computed once
+per unique subtree, and holds the nodes it has seen so their ids stay valid.
+
+Nothing in the evaluator, the optimizer or flat.py changes an AST in place,
+so they all run on shared ASTs.  Tools that key results by node identity,
+like cover.py and tracing.py listeners, see a shared node once for all the
+places it appears, so they should run on ASTs that are not shared.
+
+usage: python hashcons.py             run the tests
+       python hashcons.py benchmark   node counts, memory and cache hits
+"""
+
+import sys
+import timeit
+import tracemalloc
+
+from parser import parse, parse_program, TokenSlice
+from tokenizer import tokenize
+
+# first items of the keys of lists and of object entries, which no tag equals
+list_key = object()
+entry_key = object()
+
+def key(value):
+    kind = type(value)
+    if kind is dict or kind is list:
+        return id(value)
+    if kind is str or value is None:
+        return value
+    return (kind, value)
+
+class Table:
+    """
+    The intern table: maps the structure of a node to its shared copy.
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.caches = {}
+
+    def intern(self, node):
+        """
+        Returns the shared copy of a node or list whose children are shared.
+        """
+        if type(node) is list:
+            return self.nodes.setdefault((list_key, *map(key, node)), node)
+        for name, value in node.items():
+            if type(value) is list:
+                node[name] = self.intern(value)
+        if "tag" in node:
+            # every node with a given tag has the same fields, in the same order
+            return self.nodes.setdefault(tuple(map(key, node.values())), node)
+        return self.nodes.setdefault((entry_key, key(node["key"]), id(node["value"])), node)
+
+    def build(self, ast, position):
+        # the parser's builder hook: the children were built, and interned, first
+        return self.intern(ast)
+
+    def share(self, node):
+        """
+        Returns the shared copy of a node, list or constant.
+        """
+        if type(node) is list:
+            return self.intern([self.share(item) for item in node])
+        if type(node) is dict:
+            return self.intern({name: self.share(value) for name, value in node.items()})
+        return node
+
+    def release(self):
+        """
+        Drops the keys.  Nodes shared until now stay shared, but later ones
+        will not be shared with them.
+        """
+        self.nodes = {}
+
+    def cached(self, function, node):
+        """
+        Returns function(node), computing it once per shared node.
+        """
+        cache = self.caches.setdefault(function, {})
+        key = id(node)
+        if key not in cache:
+            # the node is kept with its result, so its id is not reused
+            cache[key] = (node, function(node))
+        return cache[key][1]
+
+def parse_shared(tokens, table=None):
+    """
+    Returns (ast, table) with the AST's identical subtrees shared.  Without a
+    table, a new one is used and its keys are released afterwards.
+    """
+    release = table is None
+    table = table if table is not None else Table()
+    ast, _ = parse_program(TokenSlice(tokens, builder=table.build))
+    if release:
+        table.release()
+    return ast, table
+
+def count_nodes(ast, unique=False):
+    """
+    Returns the number of dict nodes in an AST, each shared node counted
+    once per place it appears, or just once if unique.
+    """
+    seen = set()
+    count = 0
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if type(node) not in [dict, list]:
+            continue
+        if unique:
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+        values = node.values() if type(node) is dict else node
+        count += type(node) is dict
+        stack.extend(values)
+    return count
+
+def test_sharing():
+    print("testing sharing")
+    ast, table = parse_shared(tokenize("a[i + 1] = b[i + 1] + (i + 1); c = 1; d = 1; e = 1.0; f = true == 1"))
+    assign = ast["statements"][0]
+    left = assign["target"]["index"]
+    right = assign["value"]["left"]["index"]
+    assert left is right is assign["value"]["right"]
+    one = ast["statements"][1]["value"]
+    assert one is ast["statements"][2]["value"] is left["right"]
+    assert ast["statements"][3]["value"] is not one
+    assert ast == parse(tokenize("a[i + 1] = b[i + 1] + (i + 1); c = 1; d = 1; e = 1.0; f = true == 1"))
+    assert count_nodes(ast) == 30 and count_nodes(ast, unique=True) == 21
+    assert table.nodes == {}
+    # sharing a built AST gives the same
+    shared = Table().share(parse(tokenize("a[i + 1] = b[i + 1] + (i + 1); c = 1; d = 1; e = 1.0; f = true == 1")))
+    assert shared == ast and count_nodes(shared, unique=True) == 21
+    # an object entry is not confused with a node whose tag is its key
+    ast, _ = parse_shared(tokenize('x = {"not": y}; z = not y; w = {k: 1, j: 1}'))
+    statements = ast["statements"]
+    assert statements[0]["value"]["values"][0] is not statements[1]["value"]
+    assert statements[2]["value"]["values"][0]["value"] is statements[2]["value"]["values"][1]["value"]
+
+def test_shared_table():
+    print("testing shared table")
+    table = Table()
+    first, _ = parse_shared(tokenize("x = [1, 2]; y = {k: x}"), table)
+    second, _ = parse_shared(tokenize("z = 3; y = {k: x}"), table)
+    assert first["statements"][1] is second["statements"][1]
+    table.release()
+    third, _ = parse_shared(tokenize("y = {k: x}"), table)
+    assert third["statements"][0] == first["statements"][1] and third["statements"][0] is not first["statements"][1]
+    calls = []
+
+    def reads(node):
+        calls.append(node)
+        return node["value"]["values"][0]["value"]["value"]
+
+    assert table.cached(reads, first["statements"][1]) == "x"
+    assert table.cached(reads, second["statements"][1]) == "x"
+    assert len(calls) == 1
+
+def test_evaluate_shared():
+    print("testing evaluate shared")
+    import contextlib, io
+    import benchmark
+    import evaluator
+    for name, source in benchmark.load_programs().items():
+        outputs = []
+        for ast in [parse(tokenize(source)), parse_shared(tokenize(source))[0]]:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                evaluator.evaluate(ast, {})
+            outputs.append(output.getvalue())
+        assert outputs[0] == outputs[1], name
+
+def size(*objects):
+    """
+    Returns the bytes taken by objects and everything they hold, each object counted once.
+    """
+    seen = set()
+    total = 0
+    stack = list(objects)
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        total += sys.getsizeof(value)
+        if type(value) is dict:
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif type(value) in [list, tuple]:
+            stack.extend(value)
+    return total
+
+def peak(function, *arguments):
+    """
+    Returns (function(*arguments), peak KB allocated while it ran).
+    """
+    tracemalloc.start()
+    try:
+        result = function(*arguments)
+        return result, tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+def benchmark_sharing():
+    """
+    Prints node counts, AST sizes and peak parsing memory before and after
+    sharing, and how much a per-node cache saves over calling a function at
+    every node.
+    """
+    import benchmark
+    import generator
+    import optimize
+    programs = dict(benchmark.load_programs())
+    programs["generated 400"] = generator.runnable_program(400, seed=1)
+    programs["looping 400"] = generator.looping_program(400, seed=1)
+    print(f"{'program':<20} {'nodes':>7} {'unique':>7} {'tree KB':>8} {'shared KB':>10} {'keys KB':>8}"
+          f" {'parse peak':>11} {'shared peak':>12} {'parse s':>8} {'shared s':>9} {'all_reads':>10} {'cached':>7}")
+    for name, source in programs.items():
+        tokens = tokenize(source)
+        ast, parse_peak = peak(parse, tokens)
+        (shared, table), shared_peak = peak(parse_shared, tokens, Table())
+        keys = size(*table.nodes.keys()) + sys.getsizeof(table.nodes)
+        table.release()
+        parse_time = min(timeit.repeat(lambda: parse(tokens), number=1, repeat=3))
+        shared_time = min(timeit.repeat(lambda: parse_shared(tokens), number=1, repeat=3))
+        for node in optimize.walk(shared):
+            table.cached(optimize.all_reads, node)
+        visits = sum(1 for node in optimize.walk(ast))
+        print(f"{name:<20} {count_nodes(ast):>7} {count_nodes(shared, unique=True):>7} {size(ast) / 1024:>8.0f}"
+              f" {size(shared) / 1024:>10.0f} {keys / 1024:>8.0f} {parse_peak:>11.0f} {shared_peak:>12.0f}"
+              f" {parse_time:>8.3f} {shared_time:>9.3f} {visits:>10} {len(table.caches[optimize.all_reads]):>7}")
+
+if __name__ == "__main__":
+    test_sharing()
+    test_shared_table()
+    test_evaluate_shared()
+    if "benchmark" in sys.argv:
+        benchmark_sharing()
+    print("done.")
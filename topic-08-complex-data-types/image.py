@@ -0,0 +1,325 @@
+"""
+image.py
+
+Precompiled program images.
+
+An image stores a flat AST (see flat.py) so a program can start running
+without tokenizing or parsing.  The loader maps the file with mmap and reads
+everything through memoryview: the node arrays are cast in place, and
+constants and names are decoded one at a time, the first time a node that
+uses them is evaluated.  The mapping stays open until the Image is closed,
+so load it in a with statement, or use read_image() for a copy in memory.
+
+Layout (all integers little-endian):
+
+    header    magic "TIMG", version (u32), grammar hash (32 bytes, sha256),
+              section count (u32)
+    table     per section: name (8 bytes), offset (u64), length (u64)
+    sections  kinds, starts, operands, position   int32 arrays (position is
+                                                 each node's source offset)
+              consts                             pool of numbers and strings
+              names                              pool of names
+
+A pool is a count (u32), count + 1 entry offsets (u32) and the entry bytes.
+A constant entry is a type byte (i, f or s) followed by its text in UTF-8;
+a name entry is just its UTF-8 text.
+"""
+
+import hashlib
+import mmap
+import struct
+import sys
+import time
+from array import array
+
+import flat
+import parser
+from tokenizer import tokenize
+
+magic = b"TIMG"
+version = 1
+grammar_hash = hashlib.sha256("\n".join(parser.grammar).encode("utf-8")).digest()
+array_sections = ["kinds", "starts", "operands", "position"]
+
+header_format = "<4sI32sI"
+entry_format = "<8sQQ"
+
+def pool_bytes(entries):
+    offsets = array("I", [0])
+    for entry in entries:
+        offsets.append(offsets[-1] + len(entry))
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    return struct.pack("<I", len(entries)) + offsets.tobytes() + b"".join(entries)
+
+def constant_bytes(value):
+    if type(value) is int:
+        return b"i" + str(value).encode("ascii")
+    if type(value) is float:
+        return b"f" + repr(value).encode("ascii")
+    return b"s" + value.encode("utf-8")
+
+def array_bytes(values):
+    values = array("i", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+def write_image(flat_ast, path):
+    """
+    Writes a FlatAST to `path` as a program image.
+    """
+    sections = [
+        (b"kinds", array_bytes(flat_ast.kinds)),
+        (b"starts", array_bytes(flat_ast.starts)),
+        (b"operands", array_bytes(flat_ast.operands)),
+        (b"position", array_bytes(flat_ast.positions)),
+        (b"consts", pool_bytes([constant_bytes(value) for value in flat_ast.constants])),
+        (b"names", pool_bytes([name.encode("utf-8") for name in flat_ast.names])),
+    ]
+    offset = struct.calcsize(header_format) + len(sections) * struct.calcsize(entry_format)
+    table = []
+    for name, data in sections:
+        offset += -offset % 8
+        table.append((name, offset, len(data)))
+        offset += len(data)
+    with open(path, "wb") as f:
+        f.write(struct.pack(header_format, magic, version, grammar_hash, len(sections)))
+        for name, offset, length in table:
+            f.write(struct.pack(entry_format, name, offset, length))
+        for (name, offset, length), (_, data) in zip(table, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+
+def compile_file(source_path, image_path, optimized=False):
+    """
+    Tokenizes and parses a source file, optionally optimizes it, and writes its program image.
+    """
+    with open(source_path, "r") as f:
+        source = f.read()
+    ast, positions = parser.parse_with_positions(tokenize(source))
+    program = ast
+    if optimized:
+        import optimize
+        # nodes the optimizer rebuilt have no position (-1); ast stays alive
+        # so their ids can't collide with the ids in positions
+        program = optimize.optimize(ast)
+    write_image(flat.from_dict(program, positions), image_path)
+
+class Pool:
+    """
+    A lazily decoded constant or name pool inside a mapped image.
+    """
+    def __init__(self, view, decode):
+        self.count = struct.unpack_from("<I", view, 0)[0]
+        self.offsets = view[4:4 + 4 * (self.count + 1)].cast("I")
+        self.data = view[4 + 4 * (self.count + 1):]
+        self.decode = decode
+        self.cache = {}
+
+    def release(self):
+        self.offsets.release()
+        self.data.release()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index not in self.cache:
+            if not 0 <= index < self.count:
+                raise IndexError(index)
+            entry = self.data[self.offsets[index]:self.offsets[index + 1]]
+            self.cache[index] = self.decode(entry)
+        return self.cache[index]
+
+def decode_constant(entry):
+    kind, text = entry[:1], bytes(entry[1:]).decode("utf-8")
+    if kind == b"i":
+        return int(text)
+    if kind == b"f":
+        return float(text)
+    return text
+
+def decode_name(entry):
+    return sys.intern(bytes(entry).decode("utf-8"))
+
+def is_image(path):
+    with open(path, "rb") as f:
+        return f.read(len(magic)) == magic
+
+class Image(flat.FlatAST):
+    """
+    A FlatAST that reads from a mapped program image.  close() releases the
+    memoryviews and unmaps the file; nodes of a closed image can't be read.
+    """
+    def __init__(self, mapping, views, kinds, starts, operands, positions, constants, names):
+        super().__init__(kinds, starts, operands, positions, constants, names)
+        self.mapping = mapping
+        self.views = views
+
+    def close(self):
+        if self.mapping.closed:
+            return
+        for values in [self.kinds, self.starts, self.operands, self.positions]:
+            if type(values) is memoryview:
+                values.release()
+        self.constants.release()
+        self.names.release()
+        for view in reversed(self.views):
+            view.release()
+        self.mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+def load_image(path):
+    """
+    Maps a program image and returns an Image that reads from the mapping.
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    views = [view]
+    try:
+        image_magic, image_version, image_hash, count = struct.unpack_from(header_format, view, 0)
+        if image_magic != magic:
+            raise Exception(f"{path} is not a program image.")
+        if image_version != version:
+            raise Exception(f"Program image version {image_version} is not supported (expected {version}).")
+        if image_hash != grammar_hash:
+            raise Exception(f"Program image {path} was built for a different grammar; recompile it.")
+        sections = {}
+        for k in range(count):
+            name, offset, length = struct.unpack_from(entry_format, view, struct.calcsize(header_format) + k * struct.calcsize(entry_format))
+            sections[name.rstrip(b"\0").decode("ascii")] = view[offset:offset + length]
+        views.extend(sections.values())
+        if sys.byteorder == "little":
+            arrays = [sections[name].cast("i") for name in array_sections]
+        else:
+            arrays = []
+            for name in array_sections:
+                values = array("i", sections[name])
+                values.byteswap()
+                arrays.append(values)
+        return Image(mapping, views, *arrays, Pool(sections["consts"], decode_constant), Pool(sections["names"], decode_name))
+    except Exception:
+        for view in reversed(views):
+            view.release()
+        mapping.close()
+        raise
+
+def read_image(path):
+    """
+    Returns a FlatAST with everything in a program image copied into memory,
+    and the file unmapped.
+    """
+    with load_image(path) as image:
+        arrays = [array("i", values) for values in [image.kinds, image.starts, image.operands, image.positions]]
+        return flat.FlatAST(*arrays, list(image.constants), list(image.names))
+
+def test_image_round_trip():
+    print("testing image round trip")
+    import os, tempfile
+    source = 'x = [1, 2.5, "sé", {k: -y}]; if (x[0] < 2) { print(x.k) } else { f(1)(2) }; while (0) { return }'
+    ast = parser.parse(tokenize(source))
+    path = os.path.join(tempfile.mkdtemp(), "program.timg")
+    write_image(flat.from_dict(ast), path)
+    assert is_image(path)
+    with load_image(path) as image:
+        assert image.constants.cache == {}
+        assert image.to_dict() == ast
+    assert image.mapping.closed
+    try:
+        image.to_dict()
+        assert False, "Expected a closed image to be unreadable"
+    except ValueError:
+        pass
+    assert read_image(path).to_dict() == ast
+
+def test_image_evaluate():
+    print("testing image evaluate")
+    import os, tempfile
+    from evaluator import evaluate
+    directory = tempfile.mkdtemp()
+    source_path = os.path.join(directory, "program.t")
+    image_path = os.path.join(directory, "program.timg")
+    with open(source_path, "w") as f:
+        f.write("function fib(n){if(n<2){return n};return fib(n-1)+fib(n-2)};x=fib(10);if(0){y=\"unused\"}")
+    compile_file(source_path, image_path)
+    environment = {}
+    with load_image(image_path) as image:
+        evaluate(image.node(), environment)
+        # the constant that was never evaluated was never decoded
+        assert "unused" not in image.constants.cache.values()
+    assert environment["x"] == 55
+
+def test_image_positions():
+    print("testing image positions")
+    import os, tempfile
+    source = "x = 1;\nif (x) { y = x + 2 }"
+    directory = tempfile.mkdtemp()
+    source_path = os.path.join(directory, "program.t")
+    image_path = os.path.join(directory, "program.timg")
+    with open(source_path, "w") as f:
+        f.write(source)
+    compile_file(source_path, image_path)
+    image = read_image(image_path)
+    found = {(image.tag(index), source[image.positions[index]:][:5]) for index in image.walk()}
+    assert ("if", "if (x") in found and ("+", "x + 2") in found and ("number", "2 }") in found
+    assert -1 not in image.positions
+
+def test_image_checks():
+    print("testing image header checks")
+    import os, tempfile
+    path = os.path.join(tempfile.mkdtemp(), "program.timg")
+    write_image(flat.from_dict(parser.parse(tokenize("x=1"))), path)
+    with open(path, "r+b") as f:
+        f.seek(8)
+        f.write(b"\xff")
+    try:
+        load_image(path)
+        assert False, "Expected a grammar hash mismatch"
+    except Exception as e:
+        assert "different grammar" in str(e)
+    # the failed load unmapped the file, so it can be replaced
+    write_image(flat.from_dict(parser.parse(tokenize("x=1"))), path)
+
+def benchmark_startup():
+    """
+    Compares time to a runnable AST: parse from source, unpickle, and map an image.
+    """
+    import os, pickle, tempfile
+    from nodes import generated_program
+    directory = tempfile.mkdtemp()
+    for size in [25000, 50000, 100000]:
+        source = generated_program(size)
+        source_path = os.path.join(directory, "program.t")
+        image_path = os.path.join(directory, "program.timg")
+        with open(source_path, "w") as f:
+            f.write(source)
+        compile_file(source_path, image_path)
+        start = time.perf_counter()
+        with open(source_path, "r") as f:
+            parser.parse(tokenize(f.read()))
+        parsed = time.perf_counter() - start
+        data = pickle.dumps(parser.parse(tokenize(source)))
+        start = time.perf_counter()
+        pickle.loads(data)
+        unpickled = time.perf_counter() - start
+        start = time.perf_counter()
+        with load_image(image_path) as image:
+            image.node()
+        mapped = time.perf_counter() - start
+        print(f"{size:>7} bytes: parse {parsed:.4f} s, unpickle dict AST {unpickled:.4f} s, map image {mapped:.6f} s")
+
+if __name__ == "__main__":
+    test_image_round_trip()
+    test_image_evaluate()
+    test_image_positions()
+    test_image_checks()
+    if "benchmark" in sys.argv:
+        benchmark_startup()
+    print("done.")
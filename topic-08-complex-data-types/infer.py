@@ -0,0 +1,243 @@
+"""
+infer.py
+
+Static type inference, and a count of the operators it could specialize.
+
+Each expression gets one of the types
+
+    int  float  bool  number  string  array  object  unknown
+
+where number means int, float or bool.  A variable's type is the join of
+the types of everything assigned to it in its scope (program or function
+body), found by iterating to a fixed point.  Parameters, variables of
+enclosing scopes and call results other than built-ins are unknown.  So is
+a variable the scope may read before its own first assignment has run
+(function f(n) { y = n + n; n = 1 } reads the argument), since that read
+sees a value from outside.
+
+operator_counts() uses the types to count, per program, the binary
+operators whose operands are both known numbers, the "+" operators on two
+known strings, and the rest.  Those are the operators a compiler could
+specialize.  The tree-walking evaluator cannot use this: its generic path
+for a binary operator is already one operator-module call, and running
+specialized tags behind type guards measured no faster, so the AST is not
+rewritten.
+
+usage: python infer.py             run the tests
+       python infer.py benchmark   operator counts on the benchmark programs
+"""
+
+import sys
+import time
+
+from optimize import reads, walk
+from parser import parse
+from tokenizer import tokenize
+
+number_types = {"int", "float", "bool", "number"}
+arithmetic_tags = {"+", "-", "*", "/"}
+comparison_tags = {"<", ">", "<=", ">=", "==", "!="}
+
+builtin_types = {"len": "int", "range": "array", "fill": "array", "map": "array", "dot": "number", "sum": "number"}
+
+def join(a, b):
+    """
+    Returns the least type that covers both a and b (None is the empty type).
+    """
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if a in number_types and b in number_types:
+        return "number"
+    return "unknown"
+
+def expression_type(node, variables):
+    tag = node["tag"]
+    if tag == "number":
+        return "float" if type(node["value"]) is float else "int"
+    if tag == "string":
+        return "string"
+    if tag == "array":
+        return "array"
+    if tag == "object":
+        return "object"
+    if tag == "identifier":
+        return variables.get(node["value"], "unknown")
+    if tag in comparison_tags or tag == "not":
+        return "bool"
+    if tag == "negate":
+        value = expression_type(node["value"], variables)
+        return "int" if value == "bool" else value if value in number_types else "unknown"
+    if tag == "and" or tag == "or":
+        return join(expression_type(node["left"], variables), expression_type(node["right"], variables))
+    if tag in arithmetic_tags:
+        left = expression_type(node["left"], variables)
+        right = expression_type(node["right"], variables)
+        if left in number_types and right in number_types:
+            if tag == "/" or "float" in [left, right]:
+                return "float"
+            if left == "number" or right == "number":
+                return "number"
+            return "int"
+        if tag == "+" and left == right and left in ["string", "array"]:
+            return left
+        if tag == "*" and {left, right} in [{"string", "int"}, {"string", "bool"}]:
+            return "string"
+        return "unknown"
+    if tag == "index" and expression_type(node["object"], variables) == "string":
+        return "string"
+    if tag == "call" and node["function"]["tag"] == "identifier" and node["function"]["value"] not in variables:
+        return builtin_types.get(node["function"]["value"], "unknown")
+    return "unknown"
+
+def read_before_assigned(statements, defined, found):
+    """
+    Adds to found the names the statements may read before they have
+    certainly assigned them, given the names in defined were assigned first.
+    """
+    for statement in statements:
+        tag = statement["tag"]
+        if tag == "if":
+            found |= reads(statement["condition"]) - defined
+            read_before_assigned(statement["then"]["statements"], set(defined), found)
+            if statement["else"]:
+                read_before_assigned(statement["else"]["statements"], set(defined), found)
+        elif tag == "while":
+            # the first pass reads what the body assigns later
+            found |= reads(statement["condition"]) - defined
+            read_before_assigned(statement["do"]["statements"], set(defined), found)
+        elif tag == "block":
+            read_before_assigned(statement["statements"], defined, found)
+        elif tag == "assign" and statement["target"]["tag"] == "identifier":
+            found |= reads(statement["value"]) - defined
+            defined.add(statement["target"]["value"])
+        else:
+            found |= reads(statement) - defined
+    return found
+
+def variable_types(statements, bound=()):
+    """
+    Returns {name: type} for the variables assigned in a scope, and the names
+    in bound (the parameters and the enclosing scopes' variables), which are
+    unknown unless assigned before they are read.
+    """
+    assigned = {}
+    for node in walk({"tag": "block", "statements": statements}):
+        if node["tag"] == "assign" and node["target"]["tag"] == "identifier":
+            assigned.setdefault(node["target"]["value"], []).append(node["value"])
+    outside = read_before_assigned(statements, set(), set()) & set(assigned)
+    variables = {name: "unknown" for name in set(bound) | outside}
+    changed = True
+    while changed:
+        changed = False
+        for name, values in assigned.items():
+            if name in outside:
+                continue
+            inferred = None
+            for value in values:
+                inferred = join(inferred, expression_type(value, variables) if name in variables or
+                                not reads_itself(value, name) else None)
+            if inferred is not None and variables.get(name) != inferred:
+                variables[name] = inferred
+                changed = True
+    return variables
+
+def reads_itself(node, name):
+    # an assignment like total = total + 1 adds nothing until total has a type from elsewhere
+    return any(child["tag"] == "identifier" and child["value"] == name for child in walk(node))
+
+def count_operators(statements, counts, bound=()):
+    variables = variable_types(statements, bound)
+    for node in walk({"tag": "block", "statements": statements}):
+        tag = node["tag"]
+        if tag == "function":
+            parameters = [parameter["value"] for parameter in node["parameters"]]
+            count_operators(node["body"], counts, set(variables) | set(parameters))
+        elif tag in arithmetic_tags or tag in comparison_tags:
+            left = expression_type(node["left"], variables)
+            right = expression_type(node["right"], variables)
+            if left in number_types and right in number_types:
+                counts["number"] += 1
+            elif tag == "+" and left == "string" and right == "string":
+                counts["string"] += 1
+            else:
+                counts["generic"] += 1
+
+def operator_counts(ast):
+    """
+    Returns {"number": n, "string": n, "generic": n}: the program's binary
+    operators with two number operands, "+" operators with two string
+    operands, and the rest.
+    """
+    counts = {"number": 0, "string": 0, "generic": 0}
+    count_operators(ast["statements"], counts)
+    return counts
+
+def test_expression_types():
+    print("testing expression types")
+    variables = {"i": "int", "x": "float", "s": "string", "b": "bool"}
+
+    def type_of(source):
+        return expression_type(parse(tokenize("t = " + source))["statements"][0]["value"], variables)
+
+    cases = {
+        "1": "int", "1.5": "float", '"a"': "string", "[1]": "array", "{a: 1}": "object",
+        "i + 1": "int", "i + x": "float", "i / 2": "float", "i + b": "int", "-b": "int",
+        "i < x": "bool", "not s": "bool", "s + s": "string", "s * 3": "string", "s[0]": "string",
+        "s + i": "unknown", "len(s)": "int", "q": "unknown", "q + 1": "unknown", "i && x": "number",
+    }
+    for source, expected in cases.items():
+        assert type_of(source) == expected, (source, type_of(source))
+
+def test_variable_types():
+    print("testing variable types")
+    variables = variable_types(parse(tokenize(
+        'i = 0; t = 0; while (i < 10) { t = t + i / 2; i = i + 1 }; s = ""; s = s + "x"; m = 1; m = "one"; '
+        'a = []; function f(n) { return n }'
+    ))["statements"])
+    assert variables == {"i": "int", "t": "number", "s": "string", "m": "unknown", "a": "array", "f": "unknown"}
+    # a read before the scope's own assignment sees a parameter, an outer variable or a built-in
+    def types(source, bound=()):
+        return variable_types(parse(tokenize(source))["statements"], bound)
+    assert types("y = n + n; n = 1", ["n"]) == {"n": "unknown", "y": "unknown"}
+    assert types("n = 1; y = n + n", ["n"]) == {"n": "int", "y": "int"}
+    assert types("i = 0; while (i < 3) { y = k; k = 1; i = i + 1 }") == {"i": "int", "k": "unknown", "y": "unknown"}
+    assert types("if (c) { k = 1 }; y = k; k = 2") == {"k": "unknown", "y": "unknown"}
+    assert types("{ k = 1 }; y = k + 1", ["len"]) == {"k": "int", "y": "int", "len": "unknown"}
+    assert types("t = len; len = 3") == {"len": "unknown", "t": "unknown"}
+
+def test_operator_counts():
+    print("testing operator counts")
+    counts = operator_counts(parse(tokenize(
+        'i = 0; s = ""; while (i < 3) { s = s + "x"; i = i + 1 }; o = {k: i * 2}; function f(n) { return n + 1 }'
+    )))
+    assert counts == {"number": 3, "string": 1, "generic": 1}
+    # n may be the string argument when n + n runs, so it has no one type in f, and
+    # len may be the program's variable
+    counts = operator_counts(parse(tokenize(
+        'function f(n) { y = n + n; n = 1; return n * 2 }; len = 2; function g(s) { return len(s) + 1 }'
+    )))
+    assert counts == {"number": 0, "string": 0, "generic": 3}
+
+def benchmark_operator_counts():
+    """
+    Prints, per benchmark program, how many binary operators have operand
+    types known statically, and how long the inference takes.
+    """
+    import benchmark
+    print(f"{'program':<20} {'number':>7} {'string':>7} {'generic':>8} {'infer s':>8}")
+    for name, source in benchmark.load_programs().items():
+        ast = parse(tokenize(source))
+        start = time.perf_counter()
+        counts = operator_counts(ast)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<20} {counts['number']:>7} {counts['string']:>7} {counts['generic']:>8} {elapsed:>8.4f}")
+
+if __name__ == "__main__":
+    test_expression_types()
+    test_variable_types()
+    test_operator_counts()
+    if "benchmark" in sys.argv:
+        benchmark_operator_counts()
+    print("done.")
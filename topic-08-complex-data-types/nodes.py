@@ -0,0 +1,283 @@
+"""
+nodes.py
+
+Compact AST node classes.
+
+The parser builds the AST out of nested dicts.  These classes hold the same
+fields in __slots__, which costs about a third of the memory of a dict.
+parse(tokens, nodes=True) builds them directly, node by node, and
+to_dict()/from_dict() convert between the two forms.
+
+Fields are read as attributes (node.left, node.statements).  A node is
+also a read-only mapping from the keys of its dict form to the same fields
+(node["left"], node["else"]), like flat.py's FlatNode, so evaluator.py and
+the other code written for dict ASTs run on nodes unchanged.
+"""
+
+import sys
+import time
+import tracemalloc
+from collections.abc import Mapping
+
+class Node(Mapping):
+    __slots__ = ()
+    tag = None
+
+    def __init_subclass__(cls):
+        # the dict keys of the slots; "else" is not a valid attribute name, so If has an else_ slot
+        cls.names = tuple(field.rstrip("_") for field in cls.__slots__)
+        # dict key -> attribute, tag first as in the dict AST; Entry has no tag
+        cls.attributes = dict(zip(cls.names, cls.__slots__))
+        if cls.tag is not None and "tag" not in cls.attributes:
+            cls.attributes = {"tag": "tag", **cls.attributes}
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    def fields(self):
+        """
+        Returns the node as one level of its dict form, with child nodes left as they are.
+        """
+        fields = {} if self.tag is None else {"tag": self.tag}
+        for key, field in zip(self.names, self.__slots__):
+            fields[key] = getattr(self, field)
+        return fields
+
+    def __getitem__(self, key):
+        return getattr(self, self.attributes[key])
+
+    def __iter__(self):
+        return iter(self.attributes)
+
+    def __len__(self):
+        return len(self.attributes)
+
+    def to_dict(self):
+        return to_dict(self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({to_dict(self)})"
+
+class Number(Node):
+    __slots__ = ("value",)
+    tag = "number"
+
+class String(Node):
+    __slots__ = ("value",)
+    tag = "string"
+
+class Identifier(Node):
+    __slots__ = ("value",)
+    tag = "identifier"
+
+class BinOp(Node):
+    __slots__ = ("tag", "left", "right")
+
+class Not(Node):
+    __slots__ = ("value",)
+    tag = "not"
+
+class Negate(Node):
+    __slots__ = ("value",)
+    tag = "negate"
+
+class Array(Node):
+    __slots__ = ("values",)
+    tag = "array"
+
+class Object(Node):
+    __slots__ = ("values",)
+    tag = "object"
+
+class Entry(Node):
+    """
+    A key/value pair of an object literal (untagged in the dict AST).
+    """
+    __slots__ = ("key", "value")
+
+class Index(Node):
+    __slots__ = ("object", "index")
+    tag = "index"
+
+class Member(Node):
+    __slots__ = ("object", "property")
+    tag = "member"
+
+class Arguments(Node):
+    __slots__ = ("values",)
+    tag = "arguments"
+
+class Call(Node):
+    __slots__ = ("function", "arguments")
+    tag = "call"
+
+class Function(Node):
+    __slots__ = ("parameters", "body")
+    tag = "function"
+
+class Print(Node):
+    __slots__ = ("arguments",)
+    tag = "print"
+
+class If(Node):
+    __slots__ = ("condition", "then", "else_")
+    tag = "if"
+
+class While(Node):
+    __slots__ = ("condition", "do")
+    tag = "while"
+
+class Return(Node):
+    __slots__ = ("value",)
+    tag = "return"
+
+class Assign(Node):
+    __slots__ = ("target", "value")
+    tag = "assign"
+
+class Block(Node):
+    __slots__ = ("statements",)
+    tag = "block"
+
+class Program(Node):
+    __slots__ = ("statements",)
+    tag = "program"
+
+node_classes = {
+    cls.tag: cls
+    for cls in [
+        Number, String, Identifier, Not, Negate, Array, Object, Index, Member,
+        Arguments, Call, Function, Print, If, While, Return, Assign, Block, Program
+    ]
+}
+for tag in ["+", "-", "*", "/", "<", ">", "<=", ">=", "==", "!=", "and", "or"]:
+    node_classes[tag] = BinOp
+
+def from_fields(ast):
+    """
+    Returns the node object for one dict node whose children are already nodes.
+    """
+    cls = node_classes[ast["tag"]] if "tag" in ast else Entry
+    return cls(*[ast[key] for key in cls.names])
+
+def from_dict(ast):
+    """
+    Converts a dict AST (or a list of them) into node objects.
+    """
+    if type(ast) is list:
+        return [from_dict(item) for item in ast]
+    if type(ast) is not dict:
+        return ast
+    return from_fields({field: from_dict(value) for field, value in ast.items()})
+
+def to_dict(node):
+    """
+    Converts node objects (or a list of them) back into a dict AST.
+    """
+    if type(node) is list:
+        return [to_dict(item) for item in node]
+    if not isinstance(node, Node):
+        return node
+    return {key: to_dict(value) for key, value in node.fields().items()}
+
+def test_from_dict():
+    print("testing from_dict")
+    from tokenizer import tokenize
+    from parser import parse
+    source = 'x = [1, "a", {k: -y}]; if (x[0] < 2 && !z) { print(x.k) } else { f(1)(2) }; while (0) { return }; function g(a) { return a * 2 }'
+    ast = parse(tokenize(source))
+    node = from_dict(ast)
+    assert type(node) is Program
+    assert type(node.statements[0]) is Assign
+    assert node.statements[0].value.values[2].values[0].key == "k"
+    assert node.statements[1].condition.tag == "and"
+    assert node.statements[1].else_.tag == "block"
+    assert to_dict(node) == ast
+    # ...and reads like it
+    assign = node.statements[0]
+    assert assign["target"]["value"] == "x" and dict(assign) == {"tag": "assign", "target": assign.target, "value": assign.value}
+    assert node.statements[1]["else"] is node.statements[1].else_ and node.statements[1].condition["tag"] == "and"
+    entry = assign.value.values[2].values[0]
+    assert list(entry) == ["key", "value"] and "tag" not in entry and entry.get("tag") is None
+    assert node == ast
+
+def test_parse_nodes():
+    print("testing parse with nodes")
+    from tokenizer import tokenize
+    from parser import parse
+    import nodes
+    node = parse(tokenize("print(1 + 2)"), nodes=True)
+    assert type(node) is nodes.Program and type(node.statements[0].arguments.values[0]) is nodes.BinOp
+    source = 'x = [1, "a", {k: -y}]; if (x[0] < 2 && !z) { print(x.k) } else { f(1)(2) }; function g(a) { return a * 2 }'
+    assert nodes.to_dict(parse(tokenize(source), nodes=True)) == parse(tokenize(source))
+    assert node.to_dict() == {'tag': 'program', 'statements': [{'tag': 'print', 'arguments': {'tag': 'arguments', 'values': [{'tag': '+', 'left': {'tag': 'number', 'value': 1}, 'right': {'tag': 'number', 'value': 2}}]}}]}
+
+def test_evaluate_nodes():
+    print("testing evaluate with nodes")
+    from tokenizer import tokenize
+    from parser import parse
+    from evaluator import evaluate
+    source = "function fib(n){if(n<2){return n};return fib(n-1)+fib(n-2)};o={a:[1,2]};o.a[1]=fib(10);s=\"x\"+\"y\""
+    for ast in [parse(tokenize(source)), parse(tokenize(source), nodes=True)]:
+        environment = {}
+        evaluate(ast, environment)
+        assert environment["o"] == {"a": [1, 55]}
+        assert environment["s"] == "xy"
+
+def generated_program(size):
+    """
+    Returns a program of roughly `size` characters built from a few statement shapes.
+    """
+    shapes = [
+        "x{i} = (a + {i}) * b[{i}] - c.d",
+        "if (x{i} < {i}) {{ y = f(x{i}, \"s{i}\") }} else {{ y = [1, 2, {i}] }}",
+        "while (i < {i}) {{ i = i + 1; t = {{k: i, v: -i}} }}",
+    ]
+    statements = []
+    length = 0
+    i = 0
+    while length < size:
+        statement = shapes[i % len(shapes)].format(i=i)
+        statements.append(statement)
+        length += len(statement) + 2
+        i += 1
+    return ";\n".join(statements)
+
+def benchmark_nodes():
+    """
+    Compares dict and node ASTs for a 1MB program: memory held by the AST,
+    peak memory while parsing, and evaluator speed.
+    """
+    from tokenizer import tokenize
+    from parser import parse
+    from evaluator import evaluate
+    source = generated_program(1000000)
+    tokens = tokenize(source)
+    print(f"source: {len(source)} characters, {len(tokens)} tokens")
+    for name, nodes in [("dict", False), ("node", True)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        ast = parse(tokens, nodes=nodes)
+        elapsed = time.perf_counter() - start
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del ast
+        print(f"{name} AST: {memory / 1024:.0f} KB held, {peak / 1024:.0f} KB peak while parsing, parsed in {elapsed:.3f} s")
+    loop = "function fib(n){if(n<2){return n};return fib(n-1)+fib(n-2)};i=0;s=0;while(i<20000){s=s+i*2-1;i=i+1};f=fib(18)"
+    for name, nodes in [("dict", False), ("node", True)]:
+        ast = parse(tokenize(loop), nodes=nodes)
+        times = []
+        for _ in range(5):
+            start = time.perf_counter()
+            evaluate(ast, {})
+            times.append(time.perf_counter() - start)
+        print(f"{name} AST evaluate: {min(times):.3f} s")
+
+if __name__ == "__main__":
+    test_from_dict()
+    test_parse_nodes()
+    test_evaluate_nodes()
+    if "benchmark" in sys.argv:
+        benchmark_nodes()
+    print("done.")
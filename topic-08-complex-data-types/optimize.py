@@ -0,0 +1,594 @@
+"""
+optimize.py
+
+Optimization passes over the parser's dict AST.  Each pass returns a new
+AST and leaves its input unchanged.
+
+Loop-invariant code motion
+
+    while (i < n * m) { a[k * 2 + 1] = i; i = i + 1 }
+
+becomes
+
+    $licm0 = n * m; $licm1 = k * 2 + 1;
+    while (i < $licm0) { a[$licm1] = i; i = i + 1 }
+
+An expression is moved out of a loop when it is invariant (it reads no
+variable that the loop assigns) and cannot fail.  Moving it means it runs
+before the loop, perhaps when the loop would not have run it at all, so an
+expression that could raise an error, print or allocate stays where it is.
+An expression cannot fail when it is made of number literals and variables
+that hold numbers (every assignment to them in their scope is a number
+expression, and one of them runs before the loop), combined by comparisons,
+"and", "or", "not" and negation.  Arithmetic can fail even on numbers: an
+int too big for a float raises OverflowError when it meets a float or is
+divided.  So + - * only count when both sides are known ints, and "/" and
+any other arithmetic only when both sides are literals that evaluate.
+
+A function call cannot change the caller's variables (assignment always
+binds in the current scope), so only the loop's own assignments are
+considered.  Temporaries are named with a "$", which no program identifier
+can start with.
+"""
+
+import sys
+
+from tokenizer import tokenize
+from parser import parse
+import parser
+from evaluator import binary_operators
+
+number_operators = {"+", "-", "*", "<", ">", "<=", ">=", "==", "!=", "and", "or"}
+
+def map_children(node, function):
+    """
+    Returns a copy of node with function applied to each child node.
+    """
+    copy = {}
+    for field, value in node.items():
+        if type(value) is dict and "tag" in value:
+            value = function(value)
+        elif type(value) is list:
+            value = [
+                {**item, "value": function(item["value"])} if "key" in item else function(item)
+                for item in value
+            ]
+        copy[field] = value
+    return copy
+
+def walk(node):
+    """
+    Yields node and its descendants, not descending into function bodies.
+    """
+    return parser.walk(node, functions=False)
+
+def assignments(node):
+    """
+    Returns {name: [assigned expressions]} for the variables a node assigns.
+    """
+    found = {}
+    for child in walk(node):
+        if child["tag"] == "assign" and child["target"]["tag"] == "identifier":
+            found.setdefault(child["target"]["value"], []).append(child["value"])
+    return found
+
+def is_number(node, numbers):
+    """
+    Returns True if the expression always evaluates to a number, if it evaluates at all.
+    """
+    tag = node["tag"]
+    if tag == "number":
+        return True
+    if tag == "identifier":
+        return node["value"] in numbers
+    if tag in number_operators or tag == "/":
+        return is_number(node["left"], numbers) and is_number(node["right"], numbers)
+    if tag == "not" or tag == "negate":
+        return is_number(node["value"], numbers)
+    return False
+
+def is_int(node, numbers):
+    """
+    Returns True if the expression always evaluates to an int (or a bool), if it evaluates at all.
+    """
+    tag = node["tag"]
+    if tag == "number":
+        return type(node["value"]) is int
+    if tag == "identifier":
+        return numbers.get(node["value"]) == "int"
+    if tag in ["+", "-", "*", "and", "or"]:
+        return is_int(node["left"], numbers) and is_int(node["right"], numbers)
+    if tag in number_operators or tag == "not":
+        return is_number(node, numbers)
+    if tag == "negate":
+        return is_int(node["value"], numbers)
+    return False
+
+def number_variables(statements):
+    """
+    Returns {name: "int" or "number"} for the names whose every assignment in
+    this scope is a number expression, "int" if every one is an int expression.
+    """
+    found = assignments({"tag": "block", "statements": statements})
+    numbers = {name: "int" for name in found}
+    changed = True
+    while changed:
+        changed = False
+        for name, values in found.items():
+            if name not in numbers:
+                continue
+            if not all(is_number(value, numbers) for value in values):
+                del numbers[name]
+                changed = True
+            elif numbers[name] == "int" and not all(is_int(value, numbers) for value in values):
+                numbers[name] = "number"
+                changed = True
+    return numbers
+
+def cannot_fail(node, numbers, defined):
+    tag = node["tag"]
+    if tag == "number":
+        return True
+    if tag == "identifier":
+        return node["value"] in numbers and node["value"] in defined
+    if tag in ["+", "-", "*", "/"]:
+        left, right = node["left"], node["right"]
+        if left["tag"] == "number" and right["tag"] == "number":
+            try:
+                binary_operators[tag](left["value"], right["value"])
+                return True
+            except Exception:
+                return False
+        # an int too big for a float overflows against a float, and when divided
+        return tag != "/" and is_int(left, numbers) and is_int(right, numbers) \
+            and cannot_fail(left, numbers, defined) and cannot_fail(right, numbers, defined)
+    if tag in number_operators:
+        return cannot_fail(node["left"], numbers, defined) and cannot_fail(node["right"], numbers, defined)
+    if tag == "not" or tag == "negate":
+        return cannot_fail(node["value"], numbers, defined)
+    return False
+
+def reads(node):
+    return {child["value"] for child in walk(node) if child["tag"] == "identifier"}
+
+class LoopHoister:
+    def __init__(self):
+        self.count = 0
+
+    def temporary(self):
+        name = f"$licm{self.count}"
+        self.count += 1
+        return name
+
+    def scope(self, statements):
+        return self.statements(statements, number_variables(statements), set())
+
+    def statements(self, statements, numbers, defined):
+        """
+        Optimizes a statement list, innermost loops first, and returns the new list.
+        `defined` holds the names certainly assigned before the list starts.
+        """
+        result = []
+        defined = set(defined)
+        for statement in statements:
+            tag = statement["tag"]
+            if tag == "while":
+                body = self.statements(statement["do"]["statements"], numbers, defined)
+                statement = {**statement, "condition": self.functions(statement["condition"]),
+                             "do": {**statement["do"], "statements": body}}
+                hoisted, statement = self.hoist(statement, numbers, defined)
+                result.extend(hoisted)
+                defined.update(assignment["target"]["value"] for assignment in hoisted)
+            elif tag == "if":
+                statement = {
+                    **statement,
+                    "condition": self.functions(statement["condition"]),
+                    "then": self.block(statement["then"], numbers, defined),
+                    "else": statement["else"] and self.block(statement["else"], numbers, defined),
+                }
+            elif tag == "block":
+                statement = self.block(statement, numbers, defined)
+            else:
+                statement = self.functions(statement)
+                if tag == "assign" and statement["target"]["tag"] == "identifier":
+                    defined.add(statement["target"]["value"])
+            result.append(statement)
+        return result
+
+    def block(self, block, numbers, defined):
+        return {**block, "statements": self.statements(block["statements"], numbers, defined)}
+
+    def functions(self, node):
+        # function bodies are scopes of their own
+        if node["tag"] == "function":
+            return {**node, "body": self.scope(node["body"])}
+        return map_children(node, self.functions)
+
+    def hoist(self, loop, numbers, defined):
+        """
+        Returns (assignments to temporaries, loop) with invariant expressions moved out.
+        """
+        assigned = set(assignments(loop))
+        temporaries = {}
+
+        def replace(node):
+            tag = node["tag"]
+            if tag == "function":
+                return node
+            if (tag in number_operators or tag in ["/", "not", "negate"]) and not reads(node) & assigned \
+                    and cannot_fail(node, numbers, defined):
+                key = repr(node)
+                if key not in temporaries:
+                    temporaries[key] = (self.temporary(), node)
+                return {"tag": "identifier", "value": temporaries[key][0]}
+            return map_children(node, replace)
+
+        loop = {**loop, "condition": replace(loop["condition"]), "do": replace(loop["do"])}
+        hoisted = [
+            {"tag": "assign", "target": {"tag": "identifier", "value": name}, "value": value}
+            for name, value in temporaries.values()
+        ]
+        return hoisted, loop
+
+def hoist_invariants(ast, verbose=False):
+    """
+    Returns a program AST with loop-invariant expressions moved out of while loops.
+    """
+    hoister = LoopHoister()
+    ast = {**ast, "statements": hoister.scope(ast["statements"])}
+    if verbose:
+        print(f"loop-invariant code motion: hoisted {hoister.count} expression(s)", file=sys.stderr)
+    return ast
+
+class DeadCodeEliminator:
+    def __init__(self):
+        self.unreachable = 0
+        self.branches = 0
+        self.stores = 0
+
+    def scope(self, statements, parameters, live_at_exit):
+        """
+        Returns the statement list of a program or function body without dead code.
+        live_at_exit holds the names still needed when the scope ends, or None
+        for a program, whose variables all stay visible in its environment.
+        """
+        # nested functions are rewritten here, before this scope's own state is set
+        statements = self.reachable(statements)
+        # an error ends a program with its environment visible, so there every
+        # statement that might fail counts as a read of every variable
+        self.exposed = live_at_exit is None
+        if live_at_exit is None:
+            live_at_exit = set(assignments({"tag": "block", "statements": statements}))
+        self.captured = captured_names(statements)
+        self.numbers = number_variables(statements)
+        self.exit = live_at_exit | self.captured
+        # parameters are always bound, but hold whatever they were given, and a
+        # built-in is a function, until this scope's own number assignment to
+        # them runs: so they can be read, but are not defined as numbers
+        self.parameters = set(parameters)
+        statements, _ = self.statements(statements, self.exit, set(), True)
+        return statements
+
+    def reachable(self, statements):
+        """
+        Folds constant if and while conditions and drops statements after a
+        return, throughout a statement list, and rewrites nested functions.
+        """
+        result = []
+        for index, statement in enumerate(statements):
+            tag = statement["tag"]
+            if tag in ["if", "while"] and statement["condition"]["tag"] in ["number", "string"]:
+                self.branches += 1
+                taken = bool(statement["condition"]["value"])
+                if tag == "while" and not taken:
+                    continue
+                if tag == "if":
+                    statement = statement["then"] if taken else statement["else"]
+                    if statement is None:
+                        continue
+            tag = statement["tag"]
+            if tag == "if":
+                statement = {**statement, "condition": self.functions(statement["condition"]),
+                             "then": self.reachable_block(statement["then"]),
+                             "else": statement["else"] and self.reachable_block(statement["else"])}
+            elif tag == "while":
+                statement = {**statement, "condition": self.functions(statement["condition"]),
+                             "do": self.reachable_block(statement["do"])}
+            elif tag == "block":
+                statement = self.reachable_block(statement)
+            else:
+                statement = self.functions(statement)
+            result.append(statement)
+            if always_returns(statement):
+                self.unreachable += len(statements) - index - 1
+                break
+        return result
+
+    def reachable_block(self, block):
+        return {**block, "statements": self.reachable(block["statements"])}
+
+    def functions(self, node):
+        if node["tag"] == "function":
+            parameters = [parameter["value"] for parameter in node["parameters"]]
+            return {**node, "body": self.scope(node["body"], parameters, set())}
+        return map_children(node, self.functions)
+
+    def statements(self, statements, live, defined, rewrite):
+        """
+        Returns (statements, names live before them) given the names live after
+        them.  With rewrite set, stores to names that are not live are removed.
+        """
+        defined_before = []
+        defined = set(defined)
+        for statement in statements:
+            defined_before.append(set(defined))
+            if statement["tag"] == "assign" and statement["target"]["tag"] == "identifier":
+                defined.add(statement["target"]["value"])
+        result = []
+        for statement, defined in zip(reversed(statements), reversed(defined_before)):
+            tag = statement["tag"]
+            if tag == "assign" and statement["target"]["tag"] == "identifier":
+                name = statement["target"]["value"]
+                if name not in live and has_no_effect(statement["value"], self.numbers, defined, self.parameters):
+                    if rewrite:
+                        self.stores += 1
+                    continue
+                live = (live - {name}) | reads(statement["value"])
+            elif tag == "if":
+                then, then_live = self.statements(statement["then"]["statements"], live, defined, rewrite)
+                if statement["else"]:
+                    other, other_live = self.statements(statement["else"]["statements"], live, defined, rewrite)
+                    statement = {**statement, "else": {**statement["else"], "statements": other}}
+                else:
+                    other_live = live
+                statement = {**statement, "then": {**statement["then"], "statements": then}}
+                live = then_live | other_live | reads(statement["condition"])
+            elif tag == "while":
+                condition = reads(statement["condition"])
+                loop_live = live | condition
+                while True:
+                    _, body_live = self.statements(statement["do"]["statements"], loop_live, defined, False)
+                    if body_live | live | condition == loop_live:
+                        break
+                    loop_live = body_live | live | condition
+                body, _ = self.statements(statement["do"]["statements"], loop_live, defined, rewrite)
+                statement = {**statement, "do": {**statement["do"], "statements": body}}
+                live = loop_live
+            elif tag == "block":
+                body, live = self.statements(statement["statements"], live, defined, rewrite)
+                statement = {**statement, "statements": body}
+            elif tag == "return":
+                live = self.exit | (reads(statement["value"]) if statement["value"] else set())
+            else:
+                live = live | reads(statement)
+            if self.exposed and not (tag == "assign" and statement["target"]["tag"] == "identifier"
+                                     and has_no_effect(statement["value"], self.numbers, defined, self.parameters)):
+                live = live | self.exit
+            result.append(statement)
+        result.reverse()
+        return result, live | self.captured
+
+def always_returns(statement):
+    tag = statement["tag"]
+    if tag == "return":
+        return True
+    if tag == "block":
+        return any(always_returns(child) for child in statement["statements"])
+    if tag == "if":
+        return statement["else"] is not None and always_returns(statement["then"]) and always_returns(statement["else"])
+    return False
+
+def captured_names(statements):
+    """
+    Returns the names read inside functions defined in a scope, which a call
+    can read at any time.
+    """
+    names = set()
+    for node in walk({"tag": "block", "statements": statements}):
+        if node["tag"] == "function":
+            for statement in node["body"]:
+                names |= all_reads(statement)
+    return names
+
+def all_reads(node):
+    """
+    Returns the names read by a node, including inside nested functions.
+    """
+    names = set()
+    for child in walk(node):
+        if child["tag"] == "identifier":
+            names.add(child["value"])
+        elif child["tag"] == "function":
+            for statement in child["body"]:
+                names |= all_reads(statement)
+    return names
+
+def has_no_effect(node, numbers, defined, bound):
+    """
+    Returns True if evaluating the expression cannot fail, print or change
+    anything.  `defined` holds the names certainly assigned by then, and
+    `bound` other names that can be read, but not used as numbers.
+    """
+    tag = node["tag"]
+    if tag in ["number", "string", "function"]:
+        return True
+    if tag == "identifier":
+        return node["value"] in defined or node["value"] in bound
+    if tag == "array":
+        return all(has_no_effect(value, numbers, defined, bound) for value in node["values"])
+    if tag == "object":
+        return all(has_no_effect(item["value"], numbers, defined, bound) for item in node["values"])
+    if tag == "not":
+        return has_no_effect(node["value"], numbers, defined, bound)
+    # arithmetic only on known ints or on literals, see cannot_fail()
+    return cannot_fail(node, numbers, defined)
+
+def eliminate_dead_code(ast, verbose=False):
+    """
+    Returns a program AST without unreachable statements, constant branches
+    and stores to variables that are never read afterwards.
+    """
+    eliminator = DeadCodeEliminator()
+    ast = {**ast, "statements": eliminator.scope(ast["statements"], [], None)}
+    if verbose:
+        print(f"dead code elimination: removed {eliminator.unreachable} unreachable statement(s), "
+              f"{eliminator.branches} constant branch(es), {eliminator.stores} dead store(s)", file=sys.stderr)
+    return ast
+
+def optimize(ast, verbose=False):
+    """
+    Runs every optimization pass over a program AST.
+    """
+    return hoist_invariants(eliminate_dead_code(ast, verbose), verbose)
+
+def optimized(source, optimization=optimize):
+    return optimization(parse(tokenize(source)))
+
+def hoisted(source):
+    return optimized(source, hoist_invariants)
+
+def eliminated(source):
+    return optimized(source, eliminate_dead_code)
+
+def test_hoist_condition_and_index():
+    print("testing hoist condition and index")
+    ast = hoisted("n = 3; m = 4; k = 1; a = fill(12, 0); i = 0; while (i < n * m) { a[k * 2 + 1] = i; i = i + 1 }")
+    statements = ast["statements"]
+    assert [statement["target"]["value"] for statement in statements[5:7]] == ["$licm0", "$licm1"]
+    loop = statements[7]
+    assert loop["condition"]["right"] == {"tag": "identifier", "value": "$licm0"}
+    assert loop["do"]["statements"][0]["target"]["index"] == {"tag": "identifier", "value": "$licm1"}
+    from evaluator import evaluate
+    environment = {}
+    evaluate(ast, environment)
+    assert environment["a"][3] == 11 and environment["i"] == 12
+
+def test_not_hoisted():
+    print("testing expressions that stay in the loop")
+    cases = [
+        "n = 1; i = 0; while (i < 3) { n = n + 1; x = n * 2; i = i + 1 }",  # n changes in the loop
+        "i = 0; while (i < 3) { x = n * 2; i = i + 1 }",                    # n is never assigned
+        "n = \"s\"; i = 0; while (i < 3) { x = n + n; i = i + 1 }",         # n is a string
+        "n = 1; i = 0; while (i < 3) { x = 4 / n; i = i + 1 }",            # n may be zero
+        "n = 1; i = 0; while (i < 3) { x = n / 2; i = i + 1 }",            # n may be too big for a float
+        "n = 1; i = 0; while (i < 3) { x = n + 0.5; i = i + 1 }",          # ...and so may an int/float mix
+        "n = 0.5; i = 0; while (i < 3) { x = n * 2; i = i + 1 }",          # n is not known to be an int
+        "a = [1]; i = 0; while (i < 3) { x = len(a) * 2; i = i + 1 }",     # calls may have effects
+        "i = 0; while (i < 3) { if (i) { n = 1 }; x = n * 2; i = i + 1 }", # n is not assigned before the loop
+        "i = 0; while (i < 3) { i = i + 1 }",
+    ]
+    for source in cases:
+        assert hoisted(source) == parse(tokenize(source)), source
+    # ...but these do move
+    for source in ["n = 1; i = 0; while (i < 3) { x = n * 2 + -n; i = i + 1 }",
+                   "n = 1; i = 0; while (i < 3) { x = 1 / 2 < n; i = i + 1 }",
+                   "n = 1; i = 0; while (i < 3) { if (i > 1) { print(n < 2 && not n) }; i = i + 1 }"]:
+        assert hoisted(source) != parse(tokenize(source)), source
+
+def test_nested_loops_and_functions():
+    print("testing nested loops and functions")
+    source = """
+        n = 5; total = 0; i = 0;
+        while (i < n) {
+            j = 0;
+            while (j < n * 2) { total = total + i * n + j; j = j + 1 };
+            i = i + 1
+        };
+        function f(x) { y = 2; c = 0; while (c < y * 3) { c = c + 1 }; return c + x }
+    """
+    ast = hoisted(source)
+    from evaluator import evaluate
+    expected = {}
+    evaluate(parse(tokenize(source)), expected)
+    environment = {}
+    evaluate(ast, environment)
+    assert environment["total"] == expected["total"]
+    assert environment["f"]["body"][2]["target"]["value"].startswith("$licm")
+    from evaluator import call_function
+    assert call_function(environment["f"], [1]) == 7
+    # the input AST is left unchanged
+    original = parse(tokenize(source))
+    copy = parse(tokenize(source))
+    hoist_invariants(original)
+    assert original == copy
+
+def test_unreachable_and_constant_branches():
+    print("testing unreachable statements and constant branches")
+    assert eliminated("function f() { x = 1; return x; print(x); y = 2 }") == \
+        parse(tokenize("function f() { x = 1; return x }"))
+    assert eliminated("function f(a) { if (a) { return 1 } else { return 2 }; print(a) }") == \
+        parse(tokenize("function f(a) { if (a) { return 1 } else { return 2 } }"))
+    assert eliminated('if (0) { print(1) }; if ("") { print(2) } else { print(3) }; while (0) { print(4) }') == \
+        parse(tokenize("{ print(3) }"))
+    assert eliminated("if (1) { x = 1 } else { x = 2 }; return; x = 3") == parse(tokenize("{ x = 1 }; return"))
+    # a return inside a branch that may not run does not end the list
+    source = "function f(a) { if (a) { return 1 }; return 2 }"
+    assert eliminated(source) == parse(tokenize(source))
+
+def test_dead_stores():
+    print("testing dead stores")
+    # overwritten before being read
+    assert eliminated("x = 1; x = 2; print(x)") == parse(tokenize("x = 2; print(x)"))
+    # ...but the environment is visible if the program stops with an error in between
+    source = "x = 1; y = [].k; x = 2"
+    assert eliminated(source) == parse(tokenize(source))
+    # locals that are never read again
+    assert eliminated('function f(a) { u = [a, {k: "s"}]; v = a; w = 2 * 3; return a }') == \
+        parse(tokenize("function f(a) { return a }"))
+    kept = [
+        "x = 1; if (c) { x = 2 }; print(x)",                        # read on one path
+        "function f(a) { t = g(a); return a }",                      # the call may print
+        "function f(a) { t = b; return a }",                         # b may be undefined
+        "function f(a) { t = a * 2; return a }",                     # a may not be a number
+        "function f() { n = 1; g = function() { return n }; return g }",  # read by a closure
+        "function f() { i = 0; while (i < 3) { i = i + 1 } }",       # read by the loop condition
+        "x = 1",                                                    # a program's variables stay visible
+    ]
+    for source in kept:
+        assert eliminated(source) == parse(tokenize(source)), source
+    # a parameter or a built-in only holds a number once its number assignment has run
+    from evaluator import evaluate
+    for source in ['function f(n) { t = n - 2; n = 1; return n }; r = f("s")',
+                   "function f() { t = len - 1; len = 3; return 0 }; r = f()"]:
+        assert eliminated(source)["statements"][0]["value"]["body"][0]["target"]["value"] == "t", source
+        try:
+            evaluate(eliminated(source), {})
+            assert False, "Expected a TypeError"
+        except TypeError:
+            pass
+    # dividing a big int raises OverflowError, so the store stays
+    source = "function f() { n = 2; j = 0; while (j < 11) { n = n * n; j = j + 1 }; y = n / 2; return 0 }; r = f()"
+    assert eliminated(source) == parse(tokenize(source))
+    try:
+        evaluate(eliminated(source), {})
+        assert False, "Expected an OverflowError"
+    except OverflowError:
+        pass
+    assert eliminated("function f(a) { w = 2 * 3 < 0.5; v = -(1 + 2); return a }") == \
+        parse(tokenize("function f(a) { return a }"))
+    source = "function f() { i = 0; s = 0; while (i < 3) { s = s + i; i = i + 1 }; return i }"
+    assert eliminated(source) == parse(tokenize("function f() { i = 0; while (i < 3) { i = i + 1 }; return i }"))
+
+def test_optimize_programs():
+    print("testing optimize on the benchmark programs")
+    import contextlib, io
+    import benchmark
+    from evaluator import evaluate
+    for name, source in benchmark.load_programs().items():
+        results = []
+        for ast in [parse(tokenize(source)), optimized(source)]:
+            output = io.StringIO()
+            environment = {}
+            with contextlib.redirect_stdout(output):
+                evaluate(ast, environment)
+            results.append((output.getvalue(), sorted(name for name in environment if not name.startswith("$"))))
+        assert results[0] == results[1], name
+
+if __name__ == "__main__":
+    test_hoist_condition_and_index()
+    test_not_hoisted()
+    test_nested_loops_and_functions()
+    test_unreachable_and_constant_branches()
+    test_dead_stores()
+    test_optimize_programs()
+    print("done.")
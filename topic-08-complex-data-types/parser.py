@@ -1,5 +1,9 @@
 #!/usr/bin/env python
+import multiprocessing
+import sys
 from tokenizer import tokenize
+from sys import intern
+from nodes import from_dict, from_fields
 
 """
 parser.py
@@ -23,7 +27,7 @@ grammar = """
     logical_term = logical_factor { "&&" logical_factor }
     logical_expression = logical_term { "||" logical_term }
     expression = logical_expression
-    print_statement = "print" [ expression ]
+    print_statement = "print" arguments
     if_statement = "if" "(" expression ")" block [ "else" block ]
     while_statement = "while" "(" expression ")" block
     return_statement = "return" [ expression ]
@@ -33,27 +37,135 @@ grammar = """
     program = [ statement { ";" statement } ]
 """
 
+# The parse functions step past a token with tokens[1:].  On a list that
+# copies the rest of the list, which makes parsing quadratic in the length of
+# the program, so parse() hands them a TokenSlice, where tokens[n:] is a new
+# view of the same list.
+#
+# A TokenSlice also says which AST to build: every node goes through
+# build(tokens, ast), which returns the dict, or with parse(tokens,
+# nodes=True) the nodes.py object for it, so no dict tree is kept.  And it
+# can carry a recovery object that parses the blocks (see recover.py).
+
+class ParseError(Exception):
+    """
+    A syntax error at tokens[index] of the token list being parsed, whose
+    source offset is position.
+    """
+    def __init__(self, message, index=None, position=None):
+        super().__init__(message)
+        self.index = index
+        self.position = position
+
+def error(tokens, message, offset=0):
+    """
+    Returns the ParseError for tokens[offset].
+    """
+    index = tokens.start + offset if type(tokens) is TokenSlice else offset
+    return ParseError(message, index, tokens[offset]["position"])
+
+class TokenSlice:
+    """
+    A read-only view of a token list from index start on.
+
+    builder, if given, is called as builder(ast, position) for every node the
+    parser makes, with the source offset of the node's first token, and
+    returns the node to use in its place.  recovery, if given, parses every
+    block in place of parse_block(), with recovery.parse_block(tokens).
+    """
+    __slots__ = ["tokens", "start", "builder", "recovery"]
+
+    def __init__(self, tokens, start=0, builder=None, recovery=None):
+        if type(tokens) is TokenSlice:
+            builder, recovery = tokens.builder or builder, tokens.recovery or recovery
+            tokens, start = tokens.tokens, tokens.start + start
+        self.tokens = tokens
+        self.start = min(start, len(tokens))
+        self.builder = builder
+        self.recovery = recovery
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            if index.step is None and index.stop is None and (index.start or 0) >= 0:
+                return TokenSlice(self.tokens, self.start + (index.start or 0), self.builder, self.recovery)
+            return self.tokens[self.start:][index]
+        if index < 0:
+            return self.tokens[index]
+        return self.tokens[self.start + index]
+
+    def __len__(self):
+        return len(self.tokens) - self.start
+
+    def __iter__(self):
+        return iter(self.tokens[self.start:])
+
+    def __repr__(self):
+        return f"TokenSlice({self.tokens[self.start:]!r})"
+
+def build(start, ast):
+    """
+    Returns the dict node ast, or what the slice's builder makes of it; start
+    is the token slice at the node's first token.
+    """
+    if type(start) is TokenSlice and start.builder:
+        return start.builder(ast, start[0]["position"])
+    return ast
+
+def build_node(ast, position):
+    return from_fields(ast)
+
+def test_parse_error():
+    print("testing ParseError...")
+    source = "x = [1, 2; y = 3"
+    try:
+        parse(tokenize(source))
+        assert False, "Expected a syntax error"
+    except ParseError as e:
+        assert e.index == 6 and e.position == source.index(";")
+        assert str(e).startswith("Expected ']'")
+    try:
+        parse(tokenize("x = 1 +"))
+        assert False, "Expected a syntax error"
+    except ParseError as e:
+        assert e.index == 4 and e.position == 7 and str(e).startswith("Unexpected token 'None'")
+
+def block_statements(block):
+    return block["statements"] if type(block) is dict else block.statements
+
+def test_token_slice():
+    print("testing TokenSlice...")
+    tokens = tokenize("x = f(1, 2)")
+    view = TokenSlice(tokens)[2:]
+    assert view[0]["tag"] == "identifier" and view[-1]["tag"] is None
+    assert view.tokens is tokens and view[1:].start == 3 and len(view[1:]) == len(tokens) - 3
+    assert list(view[1:]) == tokens[3:] and view[1:4] == tokens[3:6]
+    assert len(view[100:]) == 0
+    ast, rest = parse_expression(view)
+    assert ast == parse_expression(tokens[2:])[0] and len(rest) == 1
+
 def parse_parameters(tokens):
     """
     parameters = "(" [ identifier { "," identifier } ] ")"
     """
-    assert tokens[0]["tag"] == "(", f"Expected '(' but got {tokens[0]}"
+    if tokens[0]["tag"] != "(":
+        raise error(tokens, f"Expected '(' but got {tokens[0]}")
     tokens = tokens[1:]
     identifiers = []
     if tokens[0]["tag"] != ")":
         if tokens[0]["tag"] == "identifier":
-            identifiers.append({"tag": "identifier", "value": tokens[0]["value"]})
+            identifiers.append(build(tokens, {"tag": "identifier", "value": tokens[0]["value"]}))
             tokens = tokens[1:]
         else:
-            raise Exception(f"Expected identifier but got {tokens[0]}")
+            raise error(tokens, f"Expected identifier but got {tokens[0]}")
         while tokens[0]["tag"] == ",":
             tokens = tokens[1:]
             if tokens[0]["tag"] == "identifier":
-                identifiers.append({"tag": "identifier", "value": tokens[0]["value"]})
+                identifiers.append(build(tokens, {"tag": "identifier", "value": tokens[0]["value"]}))
                 tokens = tokens[1:]
             else:
-                raise Exception(f"Expected identifier but got {tokens[0]}")
-    assert tokens[0]["tag"] == ")", f"Expected ')' but got {tokens[0]}"
+                raise error(tokens, f"Expected identifier but got {tokens[0]}")
+    if tokens[0]["tag"] != ")":
+        raise error(tokens, f"Expected ')' but got {tokens[0]}")
     return {"tag": "parameters", "identifiers": identifiers}, tokens[1:]
 
 def test_parse_parameters():
@@ -93,7 +205,9 @@ def parse_arguments(tokens):
     """
     arguments = "(" [ expression { "," expression } ] ")"
     """
-    assert tokens[0]["tag"] == "(", f"Expected '(' but got {tokens[0]}"
+    start = tokens
+    if tokens[0]["tag"] != "(":
+        raise error(tokens, f"Expected '(' but got {tokens[0]}")
     tokens = tokens[1:]
     values = []
     if tokens[0]["tag"] != ")":
@@ -103,8 +217,9 @@ def parse_arguments(tokens):
             tokens = tokens[1:]
             expr, tokens = parse_expression(tokens)
             values.append(expr)
-    assert tokens[0]["tag"] == ")", f"Expected ')' but got {tokens[0]}"
-    return {"tag": "arguments", "values": values}, tokens[1:]
+    if tokens[0]["tag"] != ")":
+        raise error(tokens, f"Expected ')' but got {tokens[0]}")
+    return build(start, {"tag": "arguments", "values": values}), tokens[1:]
 
 def test_parse_arguments():
     """
@@ -143,8 +258,12 @@ def parse_block(tokens):
     """
     block = "{" statement { ";" statement } "}"
     """
+    if type(tokens) is TokenSlice and tokens.recovery:
+        return tokens.recovery.parse_block(tokens)
+    start = tokens
     expected_tag = "{"
-    assert tokens[0]["tag"] == expected_tag, f"Expected '{expected_tag}' but got {tokens[0]}"
+    if tokens[0]["tag"] != expected_tag:
+        raise error(tokens, f"Expected '{expected_tag}' but got {tokens[0]}")
     tokens = tokens[1:]
     statements = []
     if tokens[0]["tag"] != "}":
@@ -155,8 +274,9 @@ def parse_block(tokens):
             statement, tokens = parse_statement(tokens)
             statements.append(statement)
     expected_tag = "}"
-    assert tokens[0]["tag"] == expected_tag, f"Expected '{expected_tag}' but got {tokens[0]}"
-    return {"tag": "block", "statements": statements}, tokens[1:]
+    if tokens[0]["tag"] != expected_tag:
+        raise error(tokens, f"Expected '{expected_tag}' but got {tokens[0]}")
+    return build(start, {"tag": "block", "statements": statements}), tokens[1:]
 
 
 def test_parse_block():
@@ -171,7 +291,9 @@ def parse_array(tokens):
     """
     array = "[" [ expression { "," expression } ] "]"
     """
-    assert tokens[0]["tag"] == "[", f"Expected '[' but got {tokens[0]}"
+    start = tokens
+    if tokens[0]["tag"] != "[":
+        raise error(tokens, f"Expected '[' but got {tokens[0]}")
     tokens = tokens[1:]
     values = []
     if tokens[0]["tag"] != "]":
@@ -181,8 +303,9 @@ def parse_array(tokens):
             tokens = tokens[1:]
             expr, tokens = parse_expression(tokens)
             values.append(expr)
-    assert tokens[0]["tag"] == "]", f"Expected ']' but got {tokens[0]}"
-    return {"tag": "array", "values": values}, tokens[1:]
+    if tokens[0]["tag"] != "]":
+        raise error(tokens, f"Expected ']' but got {tokens[0]}")
+    return build(start, {"tag": "array", "values": values}), tokens[1:]
 
 def test_parse_array():
     """
@@ -211,30 +334,39 @@ def parse_object(tokens):
     """
     object = "{" [ (string | identifier) ":" expression { "," (string | identifier) ":" expression } ] "}"
     """
+    start = tokens
     expected_tag = "{"
-    assert tokens[0]["tag"] == expected_tag, f"Expected '{expected_tag}' but got {tokens[0]}"
+    if tokens[0]["tag"] != expected_tag:
+        raise error(tokens, f"Expected '{expected_tag}' but got {tokens[0]}")
     tokens = tokens[1:]
     values = []
     if tokens[0]["tag"] != "}":
-        assert tokens[0]["tag"] in ["string","identifier"]
-        key = tokens[0]["value"]
+        if tokens[0]["tag"] not in ["string","identifier"]:
+            raise error(tokens, f"Expected string or identifier but got {tokens[0]}")
+        entry = tokens
+        key = intern(tokens[0]["value"])
         tokens = tokens[1:]
-        assert tokens[0]["tag"] == ":"
+        if tokens[0]["tag"] != ":":
+            raise error(tokens, f"Expected ':' but got {tokens[0]}")
         tokens = tokens[1:]
         expr, tokens = parse_expression(tokens)
-        values.append({"key":key, "value":expr})
+        values.append(build(entry, {"key":key, "value":expr}))
         while tokens[0]["tag"] == ",":
             tokens = tokens[1:]
-            assert tokens[0]["tag"] in ["string","identifier"]
-            key = tokens[0]["value"]
+            if tokens[0]["tag"] not in ["string","identifier"]:
+                raise error(tokens, f"Expected string or identifier but got {tokens[0]}")
+            entry = tokens
+            key = intern(tokens[0]["value"])
             tokens = tokens[1:]
-            assert tokens[0]["tag"] == ":"
+            if tokens[0]["tag"] != ":":
+                raise error(tokens, f"Expected ':' but got {tokens[0]}")
             tokens = tokens[1:]
             expr, tokens = parse_expression(tokens)
-            values.append({"key":key, "value":expr})
+            values.append(build(entry, {"key":key, "value":expr}))
     expected_tag = "}"
-    assert tokens[0]["tag"] == expected_tag, f"Expected '{expected_tag}' but got {tokens[0]}"
-    return {"tag": "object", "values": values}, tokens[1:]
+    if tokens[0]["tag"] != expected_tag:
+        raise error(tokens, f"Expected '{expected_tag}' but got {tokens[0]}")
+    return build(start, {"tag": "object", "values": values}), tokens[1:]
 
 def test_parse_object():
     """
@@ -256,6 +388,10 @@ def test_parse_object():
     ast, tokens = parse_object(tokens)
     assert ast == {'tag': 'object', 'values': [{'key': 'x', 'value': {'tag': 'number', 'value': 1}}, {'key': 'y', 'value': {'tag': 'number', 'value': 2}}, {'key': 'z', 'value': {'tag': 'number', 'value': 3}}]}
     assert tokens[0]["tag"] is None
+    # Test that string keys are interned like identifiers
+    tokens = tokenize('{"long key":1}')
+    ast, tokens = parse_object(tokens)
+    assert ast["values"][0]["key"] is intern("long key")
     # Test nested object literal
     tokens = tokenize("{x:1, y:2, z:{a:1,b:2,c:[1,2,3]}}")
     ast, tokens = parse_object(tokens)
@@ -265,16 +401,18 @@ def parse_function(tokens):
     """
     function = "function" parameters block
     """
-    assert tokens[0]["tag"] == "function", f"Expected '{function}' but got {tokens[0]}"
+    start = tokens
+    if tokens[0]["tag"] != "function":
+        raise error(tokens, f"Expected 'function' but got {tokens[0]}")
     tokens = tokens[1:]
     parameters, tokens = parse_parameters(tokens)
     block, tokens = parse_block(tokens)
     ast = {
         "tag":"function",
         "parameters" : parameters["identifiers"],
-        "body" : block["statements"]
+        "body" : block_statements(block)
     }    
-    return ast, tokens
+    return build(start, ast), tokens
 
 def test_parse_function():
     """
@@ -291,23 +429,25 @@ def parse_simple_expression(tokens):
     """
     simple_expression = <number> | <string> | <identifier> | "(" expression ")" | "not" expression | "-" expression | function | object | array
     """
+    start = tokens
     token = tokens[0]
     if token["tag"] == "number":
-        return {"tag": "number", "value": token["value"]}, tokens[1:]
+        return build(start, {"tag": "number", "value": token["value"]}), tokens[1:]
     if token["tag"] == "string":
-        return {"tag": "string", "value": token["value"]}, tokens[1:]
+        return build(start, {"tag": "string", "value": token["value"]}), tokens[1:]
     if token["tag"] == "identifier":
-        return {"tag": "identifier", "value": token["value"]}, tokens[1:]
+        return build(start, {"tag": "identifier", "value": token["value"]}), tokens[1:]
     if token["tag"] == "(":
         ast, tokens = parse_expression(tokens[1:])
-        assert tokens[0]["tag"] == ")", f"Expected ')' but got {tokens[0]}"
+        if tokens[0]["tag"] != ")":
+            raise error(tokens, f"Expected ')' but got {tokens[0]}")
         return ast, tokens[1:]
     if token["tag"] == "not":
         ast, tokens = parse_expression(tokens[1:])
-        return {"tag": "not", "value": ast}, tokens
+        return build(start, {"tag": "not", "value": ast}), tokens
     if token["tag"] == "-":
         ast, tokens = parse_expression(tokens[1:])
-        return {"tag": "negate", "value": ast}, tokens
+        return build(start, {"tag": "negate", "value": ast}), tokens
     if token["tag"] == "function":
         ast, tokens = parse_function(tokens)
         return ast, tokens
@@ -315,7 +455,7 @@ def parse_simple_expression(tokens):
         return parse_array(tokens)
     if token["tag"] == "{":
         return parse_object(tokens)    
-    raise Exception(f"Unexpected token '{token['tag']}' at position {token['position']}.")
+    raise error(tokens, f"Unexpected token '{token['tag']}' at position {token['position']}.")
 
 def test_parse_simple_expression():
     """
@@ -358,35 +498,38 @@ def parse_complex_expression(tokens):
     """
     complex_expression = simple_expression { "[" expression "]" | "." identifier | arguments }  
     """
+    start = tokens
     ast, tokens = parse_simple_expression(tokens)
     while True:
         if tokens[0]["tag"] == "[":
             tokens = tokens[1:]
             index, tokens = parse_expression(tokens)
-            ast = {
+            ast = build(start, {
                 "tag":"index",
                 "object":ast,
                 "index":index
-            }
-            assert tokens[0]["tag"] == "]", f"Expected ']' but got {tokens[0]}"
+            })
+            if tokens[0]["tag"] != "]":
+                raise error(tokens, f"Expected ']' but got {tokens[0]}")
             tokens = tokens[1:]
         elif tokens[0]["tag"] == ".":
             tokens = tokens[1:]
-            assert tokens[0]["tag"] == "identifier", "Expected property name"
+            if tokens[0]["tag"] != "identifier":
+                raise error(tokens, "Expected property name")
             property = tokens[0]["value"]
-            ast = {
+            ast = build(start, {
                 "tag": "member",
                 "object": ast,
                 "property": property
-            }
+            })
             tokens = tokens[1:]
         elif tokens[0]["tag"] == "(":
             arguments, tokens = parse_arguments(tokens)
-            ast = {
+            ast = build(start, {
                 "tag":"call",
                 "function":ast,
                 "arguments":arguments
-            }
+            })
         else:
             break
     return ast, tokens
@@ -445,11 +588,12 @@ def parse_arithmetic_term(tokens):
     """
     arithmetic_term = arithmetic_factor { ("*" | "/") arithmetic_factor }
     """
+    start = tokens
     node, tokens = parse_arithmetic_factor(tokens)
     while tokens[0]["tag"] in ["*", "/"]:
         tag = tokens[0]["tag"]
         right_node, tokens = parse_arithmetic_factor(tokens[1:])
-        node = {"tag": tag, "left": node, "right": right_node}
+        node = build(start, {"tag": tag, "left": node, "right": right_node})
     return node, tokens
 
 def test_parse_arithmetic_term():
@@ -486,11 +630,12 @@ def parse_arithmetic_expression(tokens):
     """
     arithmetic_expression = arithmetic_term { ("+" | "-") arithmetic_term }
     """
+    start = tokens
     ast, tokens = parse_arithmetic_term(tokens)
     while tokens[0]["tag"] in ["+", "-"]:
         tag = tokens[0]["tag"]
         right_node, tokens = parse_arithmetic_term(tokens[1:])
-        ast = {"tag": tag, "left": ast, "right": right_node}
+        ast = build(start, {"tag": tag, "left": ast, "right": right_node})
     return ast, tokens
 
 def test_parse_arithmetic_expression():
@@ -541,11 +686,12 @@ def parse_relational_expression(tokens):
     """
     relational_expression = arithmetic_expression { ("<" | ">" | "<=" | ">=" | "==" | "!=") arithmetic_expression }
     """
+    start = tokens
     node, tokens = parse_arithmetic_expression(tokens)
     while tokens[0]["tag"] in ["<", ">", "<=", ">=", "==", "!="]:
         tag = tokens[0]["tag"]
         right_node, tokens = parse_arithmetic_expression(tokens[1:])
-        node = {"tag": tag, "left": node, "right": right_node}
+        node = build(start, {"tag": tag, "left": node, "right": right_node})
     return node, tokens
 
 def test_parse_relational_expression():
@@ -611,11 +757,12 @@ def parse_logical_term(tokens):
     """
     logical_term = logical_factor { "&&" logical_factor }
     """
+    start = tokens
     node, tokens = parse_logical_factor(tokens)
     while tokens[0]["tag"] == "and":
         tag = tokens[0]["tag"]
         next_node, tokens = parse_logical_factor(tokens[1:])
-        node = {"tag": tag, "left": node, "right": next_node}
+        node = build(start, {"tag": tag, "left": node, "right": next_node})
     return node, tokens
 
 def test_parse_logical_term():
@@ -649,11 +796,12 @@ def parse_logical_expression(tokens):
     """
     logical_expression = logical_term { "||" logical_term }
     """
+    start = tokens
     node, tokens = parse_logical_term(tokens)
     while tokens[0]["tag"] == "or":
         tag = tokens[0]["tag"]
         next_node, tokens = parse_logical_term(tokens[1:])
-        node = {"tag": tag, "left": node, "right": next_node}
+        node = build(start, {"tag": tag, "left": node, "right": next_node})
     return node, tokens
 
 def test_parse_logical_expression():
@@ -713,17 +861,20 @@ def test_parse_expression():
 
 def parse_print_statement(tokens):
     """
-    print_statement = "print" [ expression ]
+    print_statement = "print" arguments
     """
-    assert tokens[0]["tag"] == "print", f"Expected 'print', got {tokens[0]}"
+    start = tokens
+    if tokens[0]["tag"] != "print":
+        raise error(tokens, f"Expected 'print', got {tokens[0]}")
     tokens = tokens[1:]
-    assert tokens[0]["tag"] == "(", f"Expected \"(\", got {tokens[0]}"
+    if tokens[0]["tag"] != "(":
+        raise error(tokens, f"Expected \"(\", got {tokens[0]}")
     arguments, tokens = parse_arguments(tokens)
-    return {"tag": "print", "arguments": arguments}, tokens
+    return build(start, {"tag": "print", "arguments": arguments}), tokens
 
 def test_parse_print_statement():
     """
-    print_statement = "print" [ expression ]
+    print_statement = "print" arguments
     """
     print("testing parse_print_statement...")
     ast, tokens = parse_print_statement(tokenize("print(1)"))
@@ -737,12 +888,16 @@ def parse_if_statement(tokens):
     """
     if_statement = "if" "(" expression ")" block [ "else" block ]
     """
-    assert tokens[0]["tag"] == "if", f"Expected 'if', got {tokens[0]}"
+    start = tokens
+    if tokens[0]["tag"] != "if":
+        raise error(tokens, f"Expected 'if', got {tokens[0]}")
     tokens = tokens[1:]
-    assert tokens[0]["tag"] == "(", f"Expected '(', got {tokens[0]}"
+    if tokens[0]["tag"] != "(":
+        raise error(tokens, f"Expected '(', got {tokens[0]}")
     tokens = tokens[1:]
     condition, tokens = parse_expression(tokens)
-    assert tokens[0]["tag"] == ")", f"Expected ')', got {tokens[0]}"
+    if tokens[0]["tag"] != ")":
+        raise error(tokens, f"Expected ')', got {tokens[0]}")
     tokens = tokens[1:]
     then_statement, tokens = parse_block(tokens)
     else_statement = None
@@ -755,7 +910,7 @@ def parse_if_statement(tokens):
         "then": then_statement,
         "else": else_statement,
     }
-    return ast, tokens
+    return build(start, ast), tokens
 
 def test_parse_if_statement():
     """
@@ -770,12 +925,16 @@ def parse_while_statement(tokens):
     """
     while_statement = "while" "(" expression ")" block
     """
-    assert tokens[0]["tag"] == "while", f"Expected 'while', got {tokens[0]}"
+    start = tokens
+    if tokens[0]["tag"] != "while":
+        raise error(tokens, f"Expected 'while', got {tokens[0]}")
     tokens = tokens[1:]
-    assert tokens[0]["tag"] == "(", f"Expected '(', got {tokens[0]}"
+    if tokens[0]["tag"] != "(":
+        raise error(tokens, f"Expected '(', got {tokens[0]}")
     tokens = tokens[1:]
     condition, tokens = parse_expression(tokens)
-    assert tokens[0]["tag"] == ")", f"Expected ')', got {tokens[0]}"
+    if tokens[0]["tag"] != ")":
+        raise error(tokens, f"Expected ')', got {tokens[0]}")
     tokens = tokens[1:]
     do_statement, tokens = parse_block(tokens)
     ast = {
@@ -783,7 +942,7 @@ def parse_while_statement(tokens):
         "condition": condition,
         "do": do_statement,
     }
-    return ast, tokens
+    return build(start, ast), tokens
 
 def test_parse_while_statement():
     """
@@ -796,12 +955,14 @@ def parse_return_statement(tokens):
     """
     return_statement = "return" [ expression ]
     """
-    assert tokens[0]["tag"] == "return", f"Expected 'return', got {tokens[0]}"
+    start = tokens
+    if tokens[0]["tag"] != "return":
+        raise error(tokens, f"Expected 'return', got {tokens[0]}")
     tokens = tokens[1:]
     if tokens[0]["tag"] not in [None, ";", "}"]:
         expr, tokens = parse_expression(tokens)
-        return {"tag": "return", "value": expr}, tokens
-    return {"tag": "return", "value": None}, tokens
+        return build(start, {"tag": "return", "value": expr}), tokens
+    return build(start, {"tag": "return", "value": None}), tokens
 
 def test_parse_return_statement():
     """
@@ -842,11 +1003,12 @@ def parse_assignment_statement(tokens):
     """
     assignment_statement = expression [ "=" expression ]
     """
+    start = tokens
     target, tokens = parse_expression(tokens)
     if tokens[0]["tag"] == "=":
         tokens = tokens[1:]
         value, tokens = parse_expression(tokens)
-        return {"tag": "assign", "target": target, "value": value}, tokens
+        return build(start, {"tag": "assign", "target": target, "value": value}), tokens
     return target, tokens
 
 def test_parse_assignment_statement():
@@ -867,11 +1029,16 @@ def parse_function_statement(tokens):
     """
     function_statement = "function" identifier parameters block
     """
-    function_token = tokens[0]
-    identifier_token = tokens[1]
-    assignment_token = {'tag': '=', 'position': identifier_token["position"], 'value': '='}
-    tokens = [identifier_token, assignment_token, function_token ] + tokens[2:]
-    return parse_assignment_statement(tokens)
+    start = tokens
+    if tokens[0]["tag"] != "function":
+        raise error(tokens, f"Expected 'function' but got {tokens[0]}")
+    if tokens[1]["tag"] != "identifier":
+        raise error(tokens, f"Expected identifier but got {tokens[1]}", 1)
+    target = build(start[1:], {"tag": "identifier", "value": tokens[1]["value"]})
+    parameters, tokens = parse_parameters(tokens[2:])
+    block, tokens = parse_block(tokens)
+    value = build(start, {"tag": "function", "parameters": parameters["identifiers"], "body": block_statements(block)})
+    return build(start, {"tag": "assign", "target": target, "value": value}), tokens
 
 def test_parse_function_statement():
     """
@@ -883,6 +1050,12 @@ def test_parse_function_statement():
     ast2, _ = parse_function_statement(tokens)
     assert ast1 == ast2
     assert ast2 == {'tag': 'assign', 'target': {'tag': 'identifier', 'value': 'foo'}, 'value': {'tag': 'function', 'parameters': [{'tag': 'identifier', 'value': 'x'}], 'body': []}}
+    try:
+        parse_function_statement(tokenize("function (x) {}"))
+        assert False, "expected a missing name error"
+    except ParseError as e:
+        assert str(e).startswith("Expected identifier"), str(e)
+        assert e.index == 1 and e.position == 9
 
 def parse_statement(tokens):
     """
@@ -899,6 +1072,8 @@ def parse_statement(tokens):
         return parse_print_statement(tokens)
     if tag == "function":
         return parse_function_statement(tokens)
+    if tag == "return":
+        return parse_return_statement(tokens)
     return parse_assignment_statement(tokens)
 
 def test_parse_statement():
@@ -910,11 +1085,14 @@ def test_parse_statement():
     assert ast =={'tag': 'print', 'arguments': {'tag': 'arguments', 'values': [{'tag': 'number', 'value': 1}]}}
     ast, _ = parse_statement(tokenize("x=3"))
     assert ast == {"tag": "assign", "target": {"tag": "identifier", "value": "x"}, "value": {"tag": "number", "value": 3}}
+    ast, _ = parse_statement(tokenize("return x"))
+    assert ast == {"tag": "return", "value": {"tag": "identifier", "value": "x"}}
 
 def parse_program(tokens):
     """
     program = [ statement { ";" statement } ]
     """
+    start = tokens
     statements = []
     if tokens[0]["tag"]:
         statement, tokens = parse_statement(tokens)
@@ -923,8 +1101,9 @@ def parse_program(tokens):
             tokens = tokens[1:]
             statement, tokens = parse_statement(tokens)
             statements.append(statement)
-    assert tokens[0]["tag"] is None, f"Expected end of input at position {tokens[0]['position']}, got [{tokens[0]}]"
-    return {"tag": "program", "statements": statements}, tokens[1:]
+    if tokens[0]["tag"] is not None:
+        raise error(tokens, f"Expected end of input at position {tokens[0]['position']}, got [{tokens[0]}]")
+    return build(start, {"tag": "program", "statements": statements}), tokens[1:]
 
 def test_parse_program():
     """
@@ -934,20 +1113,207 @@ def test_parse_program():
     ast, tokens = parse_program(tokenize("print(1); print(2)"))
     assert ast == {'tag': 'program', 'statements': [{'tag': 'print', 'arguments': {'tag': 'arguments', 'values': [{'tag': 'number', 'value': 1}]}}, {'tag': 'print', 'arguments': {'tag': 'arguments', 'values': [{'tag': 'number', 'value': 2}]}}]}
 
-def parse(tokens):
-    ast, tokens = parse_program(tokens)
+def parse(tokens, nodes=False):
+    """
+    Returns the program's AST: dicts, or with nodes the compact __slots__
+    node classes of nodes.py, built as the parser goes.
+    """
+    ast, tokens = parse_program(TokenSlice(tokens, builder=build_node if nodes else None))
+    return ast
+
+def parse_with_positions(tokens):
+    """
+    Returns (ast, positions) for a dict AST, where positions maps id(node) to
+    the source offset of the node's first token, for every node in the ast.
+    """
+    built = []
+    def record(ast, position):
+        # holding every node keeps the ids of nodes that were dropped unique
+        built.append((ast, position))
+        return ast
+    ast, _ = parse_program(TokenSlice(tokens, builder=record))
+    in_ast = {id(node) for node in walk(ast)}
+    return ast, {id(node): position for node, position in built if id(node) in in_ast}
+
+def walk(ast, functions=True):
+    """
+    Yields the tagged nodes of a dict AST in pre-order, source order, using an
+    explicit stack.  With functions=False it does not descend into function
+    bodies.
+    """
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        yield node
+        if node["tag"] == "function" and not functions:
+            continue
+        children = []
+        for value in node.values():
+            if type(value) is dict and "tag" in value:
+                children.append(value)
+            elif type(value) is list:
+                children.extend(item["value"] if "key" in item else item for item in value)
+        stack.extend(reversed(children))
+
+def test_parse_with_positions():
+    print("testing parse_with_positions...")
+    source = 'x = 1; if (x) { y = f(2) + 3 }; o = {k: "v"}; function g(a) { return a }'
+    ast, positions = parse_with_positions(tokenize(source))
+    assert ast == parse(tokenize(source))
+    nodes = list(walk(ast))
+    assert [node["tag"] for node in nodes[:4]] == ["program", "assign", "identifier", "number"]
+    assert all(id(node) in positions for node in nodes)
+    found = {(node["tag"], source[positions[id(node)]:][:6]) for node in nodes}
+    assert ("if", "if (x)") in found and ("block", "{ y = ") in found
+    assert ("+", "f(2) +") in found and ("call", "f(2) +") in found and ("number", "3 }; o") in found
+    assert ("string", '"v"}; ') in found and ("function", "functi") in found
+    assert ("identifier", "g(a) {") in found and ("return", "return") in found
+    assert len(list(walk(ast, functions=False))) == len(nodes) - 3
+
+# Parallel parsing splits the program at the ";" tokens outside any
+# brackets.  Those can only separate top-level statements, so runs of
+# statements can be parsed by separate processes and their statement lists
+# joined.
+
+def statement_ranges(tokens):
+    """
+    Returns the (start, end) token indexes of the top-level statements.
+    """
+    ranges = []
+    depth = 0
+    start = 0
+    for index, token in enumerate(tokens):
+        tag = token["tag"]
+        if tag in ["(", "[", "{"]:
+            depth += 1
+        elif tag in [")", "]", "}"]:
+            depth -= 1
+        elif tag == ";" and depth == 0:
+            ranges.append((start, index))
+            start = index + 1
+        elif tag is None:
+            ranges.append((start, index))
+    return ranges
+
+def parse_statements(tokens):
+    ast, tokens = parse_program(TokenSlice(tokens))
+    return ast["statements"]
+
+def intern_names(ast):
+    # names come back from the worker processes as separate copies
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if type(node) is list:
+            stack.extend(node)
+        elif type(node) is dict:
+            tag = node.get("tag")
+            if tag == "identifier":
+                node["value"] = intern(node["value"])
+            elif tag == "member":
+                node["property"] = intern(node["property"])
+            elif tag is None and "key" in node:
+                node["key"] = intern(node["key"])
+            stack.extend(value for value in node.values() if type(value) in [list, dict])
+
+def parallel_parse(tokens, nodes=False, jobs=None, chunks=None, minimum_statements=200):
+    """
+    Returns the same AST as parse(), parsing runs of top-level statements in a
+    pool of jobs processes (one per core by default).  Programs with fewer
+    than minimum_statements statements are parsed in this process.  When a
+    piece has a syntax error the program is parsed again in this process, so
+    the error is the one parse() reports; any other error is raised as is.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    ranges = statement_ranges(tokens)
+    if jobs < 2 or len(ranges) < max(minimum_statements, 2):
+        return parse(tokens, nodes)
+    if any(start == end for start, end in ranges):
+        # an empty statement is an error that a piece parsed alone would not show
+        return parse(tokens, nodes)
+    size = -(-len(ranges) // (chunks or jobs * 4))
+    pieces = []
+    for i in range(0, len(ranges), size):
+        start = ranges[i][0]
+        end = ranges[min(i + size, len(ranges)) - 1][1]
+        pieces.append(tokens[start:end] + [{"tag": None, "value": None, "position": tokens[end]["position"]}])
+    try:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(parse_statements, pieces)
+    except ParseError:
+        # a piece ends where the program goes on, so its error can differ
+        return parse(tokens, nodes)
+    ast = {"tag": "program", "statements": [statement for result in results for statement in result]}
+    intern_names(ast)
+    if nodes:
+        ast = from_dict(ast)
     return ast
 
+def test_parallel_parse():
+    print("testing parallel_parse...")
+    from generator import runnable_program
+    tokens = tokenize(runnable_program(40, seed=1) + "; o = {a: 1}; o.a = x; if (o.a) { y = 1; z = [1, 2] }")
+    ast = parallel_parse(tokens, jobs=2, chunks=5, minimum_statements=0)
+    assert ast == parse(tokens)
+    assert ast["statements"][-2]["target"]["property"] is intern("a")
+    from nodes import to_dict
+    assert to_dict(parallel_parse(tokens, nodes=True, jobs=2, minimum_statements=0)) == ast
+    assert statement_ranges(tokenize("x = 1; if (x) { y = 2; z = 3 }; f(1, [2; 3])")) == [(0, 3), (4, 17), (18, 28)]
+    for source in ["x = 1; y = ; z = 3; w = 4", "x = 1; y = 2;"]:
+        tokens = tokenize(source)
+        messages = []
+        for parse_function in [parse, lambda tokens: parallel_parse(tokens, jobs=2, chunks=3, minimum_statements=0)]:
+            try:
+                parse_function(tokens)
+                assert False, "expected a syntax error"
+            except ParseError as e:
+                messages.append(str(e))
+        assert messages[0] == messages[1], messages
+    # errors that are not syntax errors are not hidden by parsing again
+    tokens = tokenize("x = 1; y = 2")
+    tokens[0] = {**tokens[0], "value": (name for name in "x")}
+    try:
+        parallel_parse(tokens, jobs=2, chunks=2, minimum_statements=0)
+        assert False, "expected the tokens not to pickle"
+    except TypeError as e:
+        assert "pickle" in str(e), str(e)
+
+def benchmark_parallel_parse():
+    """
+    Times parse() and parallel_parse() with 2, 4, ... processes up to the
+    number of cores, on generated programs of growing size.
+    """
+    import time
+    from generator import runnable_program
+    cores = multiprocessing.cpu_count()
+    counts = [2]
+    while counts[-1] < cores:
+        counts.append(min(counts[-1] * 2, cores))
+    print(f"{cores} core(s)")
+    print("statements    tokens   parse (s)" + "".join(f"  {jobs} processes (s)" for jobs in counts))
+    for statements in [100, 200, 400, 800]:
+        tokens = tokenize(runnable_program(statements, seed=statements))
+        start = time.perf_counter()
+        expected = parse(tokens)
+        line = f"{statements:>10} {len(tokens):>9} {time.perf_counter() - start:>11.3f}"
+        for jobs in counts:
+            start = time.perf_counter()
+            ast = parallel_parse(tokens, jobs=jobs, minimum_statements=0)
+            line += f" {time.perf_counter() - start:>16.3f}"
+            assert ast == expected
+        print(line)
+
 
 # --- Grammar Verification Mechanism ---
 
 # Normalize the grammar by stripping whitespace from each nonempty line.
 grammar = grammar.split("\n")
 grammar = [line.strip() for line in grammar if line.strip() != ""]
-for line in grammar:
-    print(line)
 
 if __name__ == "__main__":
+    for line in grammar:
+        print(line)
+
     # List of all test functions.
     test_functions = [
         test_parse_parameters,
@@ -1004,6 +1370,13 @@ if __name__ == "__main__":
         # Run the test function.
         test_func()
 
+    test_token_slice()
+    test_parse_with_positions()
+    test_parse_error()
+    test_parallel_parse()
+    if "benchmark" in sys.argv:
+        benchmark_parallel_parse()
+
     if len(untested_grammar) > 0:
         print("Untested grammar rules:")
         print(untested_grammar)
@@ -0,0 +1,260 @@
+"""
+recover.py
+
+Error recovery: tokenize and parse a whole program, reporting every error
+found instead of stopping at the first one.
+
+tokenize_recovering() turns characters no pattern accepts into "error"
+tokens (a run of them becomes one token; an unterminated string or bad
+escape takes the rest of its line) and records a diagnostic for each.
+
+parse_recovering() parses statement by statement.  When a statement fails,
+the parser's ParseError gives the index of the token it was looking at, a
+diagnostic is recorded, and tokens are skipped from there to the next ";"
+outside brackets (which is consumed) or to the "}" that closes the enclosing
+block (which is not).  Blocks are parsed the same way: the token slice the
+parser works on carries the Recovery, and parser.parse_block() hands every
+block to it, so an error inside a function or loop body loses only the
+statement it is in.  The statements that fail are left out of the returned
+AST.
+
+A diagnostic is {"position": offset, "message": text}; at most one is kept
+per position, so a bad character is not reported again by the parser.
+
+usage: python recover.py                    run the tests
+       python recover.py program.t
+"""
+
+import bisect
+import sys
+
+import parser
+import tokenizer
+
+def tokenize_recovering(characters):
+    """
+    Returns (tokens, diagnostics).
+    """
+    tokens = []
+    diagnostics = []
+    position = 0
+    while position < len(characters):
+        for pattern, tag in tokenizer.patterns:
+            match = pattern.match(characters, position)
+            if match:
+                break
+        end = match.end()
+        if tag == "error":
+            if characters[position] == '"':
+                end = characters.find("\n", position)
+                end = len(characters) if end < 0 else end
+                message = "Unterminated string or invalid escape"
+            else:
+                while end < len(characters) and error_at(characters, end):
+                    end += 1
+                message = f"Invalid character {characters[position:end]!r}"
+            diagnostics.append({"position": position, "message": message})
+            tokens.append({"tag": "error", "position": position, "value": characters[position:end]})
+        else:
+            if tag == "identifier":
+                tag = tokenizer.keywords.get(match.group(0), tag)
+            if tag != "whitespace":
+                tokens.append({"tag": tag, "position": position, "value": tokenizer.token_value(tag, match.group(0))})
+        position = end
+    tokens.append({"tag": None, "value": None, "position": position})
+    return tokens, diagnostics
+
+def error_at(characters, position):
+    for pattern, tag in tokenizer.patterns:
+        if pattern.match(characters, position):
+            return tag == "error" and characters[position] != '"'
+
+def describe(token):
+    if token["tag"] is None:
+        return "end of input"
+    if token["tag"] == "error":
+        return f"invalid text {token['value']!r}"
+    if token["tag"] in ["identifier", "number", "string"]:
+        return f"{token['tag']} {token['value']!r}"
+    return f"'{token['tag']}'"
+
+def message(exception, token):
+    text = str(exception)
+    if text.startswith("Expected"):
+        for ending in [" but got", ", got", " at position"]:
+            text = text.split(ending)[0]
+        return f"{text}, found {describe(token)}"
+    return f"Unexpected {describe(token)}"
+
+openers = {"(": ")", "[": "]", "{": "}"}
+
+class Recovery:
+    def __init__(self, tokens, diagnostics=None):
+        self.tokens = tokens
+        self.diagnostics = diagnostics if diagnostics is not None else []
+        self.reported = {diagnostic["position"] for diagnostic in self.diagnostics}
+
+    def report(self, token, text):
+        if token["position"] not in self.reported:
+            self.reported.add(token["position"])
+            self.diagnostics.append({"position": token["position"], "message": text})
+
+    def index(self, tokens):
+        # every token list the parser works on is a suffix of the program's
+        return len(self.tokens) - len(tokens)
+
+    def resynchronize(self, index, start):
+        """
+        Returns the index after the next ";" outside brackets, or of the "}" that closes the block.
+        """
+        closing = []
+        while self.tokens[index]["tag"] is not None:
+            tag = self.tokens[index]["tag"]
+            if tag in openers:
+                closing.append(openers[tag])
+            elif closing and tag == closing[-1]:
+                closing.pop()
+            elif not closing and tag == ";":
+                return index + 1
+            elif not closing and tag == "}":
+                # a stray "}" where the statement starts is skipped, or we would not move
+                return index + 1 if index == start else index
+            index += 1
+        return index
+
+    def statements(self, tokens, closing):
+        """
+        Parses statements up to the closing tag ("}" or None); returns (statements, tokens).
+        """
+        statements = []
+        while tokens[0]["tag"] != closing and tokens[0]["tag"] is not None:
+            start = self.index(tokens)
+            try:
+                statement, tokens = parser.parse_statement(tokens)
+            except parser.ParseError as exception:
+                failed = min(max(exception.index, start), len(self.tokens) - 1)
+                self.report(self.tokens[failed], message(exception, self.tokens[failed]))
+                tokens = parser.TokenSlice(self.tokens, self.resynchronize(failed, start), recovery=self)
+                continue
+            statements.append(statement)
+            if tokens[0]["tag"] == ";":
+                tokens = tokens[1:]
+            elif tokens[0]["tag"] == closing or tokens[0]["tag"] is None:
+                pass
+            elif tokens[0]["tag"] == "}":
+                # a "}" with no block to close
+                self.report(tokens[0], f"Unexpected {describe(tokens[0])}")
+                tokens = tokens[2:] if tokens[1]["tag"] == ";" else tokens[1:]
+            else:
+                self.report(tokens[0], f"Expected ';', found {describe(tokens[0])}")
+        return statements, tokens
+
+    def parse_block(self, tokens):
+        """
+        block = "{" statement { ";" statement } "}"
+        """
+        start = tokens
+        if tokens[0]["tag"] != "{":
+            raise parser.error(tokens, f"Expected '{{' but got {tokens[0]}")
+        statements, tokens = self.statements(tokens[1:], "}")
+        if tokens[0]["tag"] == "}":
+            tokens = tokens[1:]
+        else:
+            self.report(tokens[0], f"Expected '}}', found {describe(tokens[0])}")
+        return parser.build(start, {"tag": "block", "statements": statements}), tokens
+
+def parse_recovering(tokens, diagnostics=None):
+    """
+    Returns (ast, diagnostics), the AST holding the statements that parsed.
+    """
+    recovery = Recovery(tokens, diagnostics)
+    statements, tokens = recovery.statements(parser.TokenSlice(tokens, recovery=recovery), None)
+    recovery.diagnostics.sort(key=lambda diagnostic: diagnostic["position"])
+    return {"tag": "program", "statements": statements}, recovery.diagnostics
+
+def check(source):
+    """
+    Tokenizes and parses a program; returns (ast, diagnostics).
+    """
+    tokens, diagnostics = tokenize_recovering(source)
+    return parse_recovering(tokens, diagnostics)
+
+def format_diagnostics(source, diagnostics, name="<source>"):
+    line_starts = [0] + [i + 1 for i, c in enumerate(source) if c == "\n"]
+    lines = []
+    for diagnostic in diagnostics:
+        line = bisect.bisect_right(line_starts, diagnostic["position"]) - 1
+        column = diagnostic["position"] - line_starts[line]
+        lines.append(f"{name}:{line + 1}:{column + 1}: {diagnostic['message']}")
+    return lines
+
+def main(arguments):
+    status = 0
+    for path in arguments:
+        with open(path, "r") as f:
+            source = f.read()
+        ast, diagnostics = check(source)
+        for line in format_diagnostics(source, diagnostics, path):
+            print(line)
+        if diagnostics:
+            status = 1
+    return status
+
+def test_tokenize_recovering():
+    print("testing tokenize_recovering")
+    tokens, diagnostics = tokenize_recovering('x = 1 $$ 2; s = "abc\ny = @')
+    assert [(token["tag"], token["value"]) for token in tokens] == [
+        ("identifier", "x"), ("=", "="), ("number", 1), ("error", "$$"), ("number", 2), (";", ";"),
+        ("identifier", "s"), ("=", "="), ("error", '"abc'), ("identifier", "y"), ("=", "="), ("error", "@"),
+        (None, None),
+    ]
+    assert diagnostics == [
+        {"position": 6, "message": "Invalid character '$$'"},
+        {"position": 16, "message": "Unterminated string or invalid escape"},
+        {"position": 25, "message": "Invalid character '@'"},
+    ]
+    source = "x = 1; if (x) { y = [1, 2] }"
+    assert tokenize_recovering(source) == (tokenizer.tokenize(source), [])
+
+def test_parse_recovering():
+    print("testing parse_recovering")
+    source = "x = 1; if (x) { y = ; z = 2 }; w = (1 + ; print(x)"
+    ast, diagnostics = check(source)
+    assert diagnostics == [
+        {"position": 20, "message": "Unexpected ';'"},
+        {"position": 40, "message": "Unexpected ';'"},
+    ], diagnostics
+    assert ast == parser.parse(tokenizer.tokenize("x = 1; if (x) { z = 2 }; print(x)"))
+    # recovery belongs to its own parse
+    try:
+        parser.parse(tokenizer.tokenize("if (x) { y = ; z = 2 }"))
+        assert False, "Expected a syntax error"
+    except parser.ParseError as e:
+        assert e.index == 7 and e.position == 13
+
+    ast, diagnostics = check("function f(a, 1) { return a }; x = f(2) }; y = [1, 2; z = 3 q = 4")
+    assert format_diagnostics("function f(a, 1) { return a }; x = f(2) }; y = [1, 2; z = 3 q = 4", diagnostics) == [
+        "<source>:1:15: Expected identifier, found number 1",
+        "<source>:1:41: Unexpected '}'",
+        "<source>:1:53: Expected ']', found ';'",
+        "<source>:1:61: Expected ';', found identifier 'q'",
+    ], diagnostics
+    assert ast == parser.parse(tokenizer.tokenize("x = f(2); z = 3; q = 4"))
+
+    # an unclosed block runs to the end of the input
+    ast, diagnostics = check("while (1) { x = 1; y = $ ")
+    assert diagnostics == [
+        {"position": 23, "message": "Invalid character '$'"},
+        {"position": 25, "message": "Expected '}', found end of input"},
+    ], diagnostics
+    assert ast["statements"][0]["do"]["statements"] == [parser.parse(tokenizer.tokenize("x = 1"))["statements"][0]]
+
+    source = "x = 1; while (x < 3) { x = x + 1 }"
+    assert check(source) == (parser.parse(tokenizer.tokenize(source)), [])
+
+if __name__ == "__main__":
+    if sys.argv[1:]:
+        sys.exit(main(sys.argv[1:]))
+    test_tokenize_recovering()
+    test_parse_recovering()
+    print("done.")
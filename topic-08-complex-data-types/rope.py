@@ -0,0 +1,248 @@
+"""
+rope.py
+
+A string value that concatenates lazily.
+
+Repeated `s = s + x` on Python strings copies s every time, so building a
+string in a loop is quadratic.  A Rope is a binary tree whose leaves are
+strings: concatenation makes a new node holding both sides as children, in
+constant time, and the flat string is only joined when it is needed (print,
+comparison, index, repetition).  Joining walks the tree with an explicit
+stack, so a rope built by a long loop does not hit the recursion limit, and
+the node then keeps the joined string and drops its children.  Every inner
+node joined along the way keeps a reference to the same string and its own
+offset in it, and drops its children too, so indexing any part of a joined
+rope afterwards reads one character without joining anything again.
+
+Ropes are immutable, so a node can be a child of any number of ropes.
+"""
+
+import sys
+import time
+
+class Rope:
+    __slots__ = ("left", "right", "length", "flat", "base", "start")
+
+    def __init__(self, value="", left=None, right=None):
+        if left is None:
+            self.flat = str(value)
+            self.length = len(self.flat)
+        else:
+            self.flat = None
+            self.length = len(left) + len(right)
+        self.left = left
+        self.right = right
+        # set when an enclosing rope was joined: this rope is base[start:start + length]
+        self.base = None
+        self.start = 0
+
+    def __add__(self, other):
+        if type(other) is not Rope and type(other) is not str:
+            return NotImplemented
+        return Rope(left=self, right=other)
+
+    def __radd__(self, other):
+        if type(other) is not str:
+            return NotImplemented
+        return Rope(left=other, right=self)
+
+    def __mul__(self, count):
+        return str(self) * count
+
+    __rmul__ = __mul__
+
+    def __str__(self):
+        if self.flat is None and self.base is not None:
+            self.flat = self.base[self.start:self.start + self.length]
+            self.base = None
+        elif self.flat is None:
+            pieces = []
+            joined = []
+            offset = 0
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                if type(node) is str:
+                    piece = node
+                elif node.flat is not None:
+                    piece = node.flat
+                elif node.base is not None:
+                    piece = node.base[node.start:node.start + node.length]
+                else:
+                    joined.append((node, offset))
+                    stack.append(node.right)
+                    stack.append(node.left)
+                    continue
+                pieces.append(piece)
+                offset += len(piece)
+            self.flat = "".join(pieces)
+            for node, start in joined:
+                if node is not self:
+                    node.base = self.flat
+                    node.start = start
+                node.left = node.right = None
+        return self.flat
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if self.flat is None and self.base is not None and type(index) is int:
+            if index < 0:
+                index += self.length
+            if not 0 <= index < self.length:
+                raise IndexError("string index out of range")
+            return self.base[self.start + index]
+        return str(self)[index]
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __eq__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) == str(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) != str(other)
+        return NotImplemented
+
+    def __lt__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) < str(other)
+        return NotImplemented
+
+    def __le__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) <= str(other)
+        return NotImplemented
+
+    def __gt__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) > str(other)
+        return NotImplemented
+
+    def __ge__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) >= str(other)
+        return NotImplemented
+
+def test_rope_concatenation():
+    print("testing rope concatenation")
+    s = Rope("ab") + "cd" + Rope("ef")
+    assert str(s) == "abcdef"
+    assert len(s) == 6
+    assert "x" + s == "xabcdef"
+    assert s[2] == "c"
+    assert s[-1] == "f"
+    left = Rope("a") + "b" + "c"
+    right = "x" + ("y" + ("z" + Rope("")))
+    both = left + right
+    assert both.left is left and both.right is right
+    assert both == "abcxyz" and len(both) == 6
+
+def test_rope_index_inner():
+    print("testing rope indexing inside a joined rope")
+    a = Rope("ab") + "cd"
+    inner = Rope("gh") + "ij"
+    b = "ef" + inner
+    s = a + b
+    assert s[5] == "f" and s.flat == "abcdefghij"
+    # the inner ropes read from the joined string, without joining again
+    assert a.flat is None and a.base is s.flat and a.left is None
+    assert inner.base is s.flat and inner.start == 6
+    assert a[3] == "d" and b[0] == "e" and inner[-1] == "j" and inner[1] == "h"
+    assert a.flat is None and inner.flat is None
+    try:
+        inner[4]
+        assert False, "expected an IndexError"
+    except IndexError:
+        pass
+    assert inner[1:3] == "hi" and str(b) == "efghij" and b.base is None
+    # a rope made from joined parts joins them like strings
+    t = inner + a
+    assert str(t) == "ghijabcd" and t[5] == "b" and a[0] == "a"
+
+def test_rope_repetition():
+    print("testing rope repetition")
+    s = Rope("a") + "b"
+    assert s * 2 == "abab" and type(s * 2) is str
+    assert 3 * s == "ababab" and s * 0 == ""
+    try:
+        s * s
+        assert False, "expected a TypeError"
+    except TypeError:
+        pass
+
+def test_rope_immutable():
+    print("testing rope immutability")
+    a = Rope("a") + "b"
+    b = a + "c"
+    c = a + "d"
+    assert str(a) == "ab"
+    assert str(b) == "abc"
+    assert str(c) == "abd"
+    d = b + "e"
+    assert str(d) == "abce"
+    assert str(c + "f") == "abdf"
+
+def test_rope_comparison():
+    print("testing rope comparison")
+    s = Rope("ab") + "c"
+    assert s == "abc" and "abc" == s
+    assert s != "abd"
+    assert s < "abd" and s <= "abc" and s > "abb" and s >= "abc"
+    assert s != 3
+    assert {"abc": 1}[s] == 1
+    assert repr([s]) == "['abc']"
+
+def test_rope_linear_time():
+    print("testing rope linear time")
+    times = []
+    for n in [100000, 200000]:
+        start = time.perf_counter()
+        s = Rope("")
+        t = Rope("")
+        for _ in range(n):
+            s = s + "x"
+            t = "x" + t
+        assert len(str(s)) == n and len(str(t)) == n
+        times.append(time.perf_counter() - start)
+    assert times[1] < times[0] * 4, f"String building is not linear: {times}"
+
+def benchmark_string_building():
+    """
+    Times `s = s + piece` loops in the evaluator with and without ropes.
+    """
+    import evaluator
+    piece = "0123456789abcdef"
+    print("iterations   rope (s)   str (s)")
+    for n in [25000, 50000, 100000]:
+        source = f"s=\"\";i=0;while(i<{n}){{s=s+\"{piece}\";i=i+1}};n=len(s)"
+        results = []
+        for use_rope in [True, False]:
+            saved = evaluator.Rope
+            if not use_rope:
+                evaluator.Rope = str
+            environment = {}
+            start = time.perf_counter()
+            evaluator.eval(source, environment)
+            results.append(time.perf_counter() - start)
+            evaluator.Rope = saved
+            assert environment["n"] == n * len(piece)
+        print(f"{n:>10} {results[0]:>10.3f} {results[1]:>9.3f}")
+
+if __name__ == "__main__":
+    test_rope_concatenation()
+    test_rope_index_inner()
+    test_rope_repetition()
+    test_rope_immutable()
+    test_rope_comparison()
+    test_rope_linear_time()
+    if "benchmark" in sys.argv:
+        benchmark_string_building()
+    print("done.")
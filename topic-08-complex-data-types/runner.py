@@ -0,0 +1,44 @@
+import tokenizer
+import parser
+import evaluator
+import image
+import optimize
+import sys
+
+def run(text, optimized=False, verbose=False):
+    run_tokens(tokenizer.tokenize(text), optimized, verbose)
+
+def run_file(path, optimized=False, verbose=False, mapped=False):
+    # the mapped tokenizer reads bytes: only ASCII digits and whitespace, "\r"
+    # kept from CRLF line ends, and positions in bytes, so it is opt-in
+    if mapped:
+        run_tokens(tokenizer.tokenize_file(path), optimized, verbose)
+    else:
+        with open(path, "r") as f:
+            run(f.read(), optimized, verbose)
+
+def run_tokens(tokens, optimized=False, verbose=False):
+    ast = parser.parse(tokens)
+    if optimized:
+        ast = optimize.optimize(ast, verbose)
+    evaluator.evaluate(ast)
+
+def run_image(path):
+    with image.load_image(path) as program:
+        evaluator.evaluate(program.node())
+
+if __name__ == "__main__":
+    # usage: runner.py [-O [-v]] [--mmap] program.t
+    #        runner.py program.timg
+    #        runner.py [-O] --compile program.t program.timg
+    # -O runs the optimizer passes first, -v reports what they did, and
+    # --mmap tokenizes the file from a memory map (see tokenizer.tokenize_file)
+    flags = [argument for argument in sys.argv[1:] if argument in ["-O", "-v", "--mmap"]]
+    arguments = [argument for argument in sys.argv[1:] if argument not in flags]
+    if len(arguments) > 2 and arguments[0] == "--compile":
+        image.compile_file(arguments[1], arguments[2], "-O" in flags)
+    elif len(arguments) > 0:
+        if image.is_image(arguments[0]):
+            run_image(arguments[0])
+        else:
+            run_file(arguments[0], "-O" in flags, "-v" in flags, "--mmap" in flags)
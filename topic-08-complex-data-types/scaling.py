@@ -0,0 +1,143 @@
+"""
+scaling.py
+
+Checks that tokenize and parse take time linear in the size of the program.
+
+Each shape below makes a program from a size n: many statements, many
+functions, one long argument list, or n levels of nesting.  The program is
+tokenized and parsed at n, 2n, 4n and 8n, and the growth exponent k of
+time ~ tokens**k is fitted by least squares on log(time) against
+log(tokens), since the token count of a shape (generated statements,
+especially) is not proportional to n.  The check fails if k is above
+maximum_exponent for either phase, which catches a quadratic step (copying
+the rest of the token list, say) long before it shows on the benchmark
+programs.
+
+Each timing is the best of several runs, taken in turns across the sizes
+with the garbage collector off, and the smallest sizes take a few
+milliseconds, so a slow spell on the machine, a collection or the timer's
+resolution does not count against the parser.
+
+usage: python scaling.py   run the tests and the scaling check
+"""
+
+import gc
+import math
+import sys
+import time
+
+from parser import parse
+from tokenizer import tokenize
+import generator
+
+maximum_exponent = 1.3
+
+def statements(n):
+    return generator.runnable_program(n, seed=1, depth=3)
+
+def functions(n):
+    return "; ".join(f"function f{i}(a, b) {{ c = a + b * {i}; return c }}" for i in range(n))
+
+def arguments(n):
+    return "function f(" + ", ".join(f"a{i}" for i in range(n)) + ") { return a0 }; " + \
+        "print(" + ", ".join(f"x + {i}" for i in range(n)) + ")"
+
+def blocks(n):
+    return "if (x) { " * n + "x = 1" + " }" * n
+
+def parentheses(n):
+    return "x = " + "(" * n + "1" + ")" * n
+
+# shape: (function, smallest size)
+shapes = {
+    "statements": (statements, 200),
+    "functions": (functions, 400),
+    "arguments": (arguments, 2000),
+    "blocks": (blocks, 250),
+    "parentheses": (parentheses, 250),
+}
+
+def best_times(function, arguments, repeat=5):
+    """
+    Returns the best time of function on each argument.  The arguments take
+    turns, so a slow spell on the machine hits one run of several sizes
+    rather than every run of one size.
+    """
+    best = [math.inf] * len(arguments)
+    # a collection of the garbage from an earlier run would land in whichever run it falls in
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for i, argument in enumerate(arguments):
+                start = time.perf_counter()
+                function(argument)
+                best[i] = min(best[i], time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+def exponent(sizes, times):
+    """
+    Returns k fitting times ~ sizes**k, by least squares on the logarithms.
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+
+def measure(shape, smallest, doublings=4):
+    """
+    Returns (token counts, tokenize times, parse times) for the shape at
+    smallest, 2 * smallest, ...
+    """
+    sizes = [smallest * 2 ** i for i in range(doublings)]
+    sources = [shape(size) for size in sizes]
+    tokens = [tokenize(source) for source in sources]
+    limit = sys.getrecursionlimit()
+    # every level of nesting is a dozen or so parse_* calls deep
+    sys.setrecursionlimit(max(limit, 20 * sizes[-1] + 1000))
+    try:
+        return [len(t) for t in tokens], best_times(tokenize, sources), best_times(parse, tokens)
+    finally:
+        sys.setrecursionlimit(limit)
+
+def test_exponent():
+    print("testing exponent")
+    sizes = [10, 20, 40, 80]
+    assert abs(exponent(sizes, [size * 3.0 for size in sizes]) - 1) < 1e-9
+    assert abs(exponent(sizes, [size ** 2 / 7 for size in sizes]) - 2) < 1e-9
+
+def test_shapes():
+    print("testing shapes")
+    for name, (shape, smallest) in shapes.items():
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 20 * smallest + 1000))
+        try:
+            ast = parse(tokenize(shape(smallest)))
+        finally:
+            sys.setrecursionlimit(limit)
+        assert ast["tag"] == "program", name
+    assert len(parse(tokenize(functions(7)))["statements"]) == 7
+    assert len(parse(tokenize(arguments(9)))["statements"][1]["arguments"]["values"]) == 9
+
+def test_scaling():
+    print("testing scaling")
+    print(f"{'shape':<12} {'tokens':>15} {'tokenize s':>11} {'parse s':>9} {'tokenize k':>11} {'parse k':>8}")
+    slow = []
+    for name, (shape, smallest) in shapes.items():
+        counts, tokenize_times, parse_times = measure(shape, smallest)
+        exponents = [exponent(counts, tokenize_times), exponent(counts, parse_times)]
+        print(f"{name:<12} {f'{counts[0]}..{counts[-1]}':>15} {tokenize_times[-1]:>11.4f} {parse_times[-1]:>9.4f}"
+              f" {exponents[0]:>11.2f} {exponents[1]:>8.2f}")
+        for phase, k in zip(["tokenize", "parse"], exponents):
+            if k > maximum_exponent:
+                slow.append(f"{phase} on {name} grows as n**{k:.2f}")
+    assert not slow, "; ".join(slow)
+
+if __name__ == "__main__":
+    test_exponent()
+    test_shapes()
+    test_scaling()
+    print("done.")
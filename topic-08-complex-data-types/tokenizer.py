@@ -1,22 +1,18 @@
+import bisect
+import mmap
+import multiprocessing
+import os
 import re
+from collections.abc import Mapping
+from types import MappingProxyType
+import sys
+from sys import intern
 
 # Define patterns for tokens
 patterns = [
-    [r"print","print"],
-    [r"if","if"],
-    [r"else","else"],
-    [r"while","while"],
-    [r"continue","continue"],
-    [r"break","break"],
-    [r"function","function"],
-    [r"return","return"],
-    [r"assert","assert"],
-    [r"and","and"],
-    [r"or","or"],
-    [r"not","not"],
     [r"\d*\.\d+|\d+\.\d*|\d+", "number"],
     [r"[a-zA-Z_][a-zA-Z0-9_]*", "identifier"],  # identifiers
-    [r'"([^"\\]|\\[tn"\\])*"', "string"], # strings
+    [r'"([^"\\]|\\[tn"\\]|\\u[0-9a-fA-F]{4})*"', "string"], # strings
     [r"\+", "+"],
     [r"\-", "-"],
     [r"\*", "*"],
@@ -45,9 +41,67 @@ patterns = [
     [r".","error"]
 ]
 
+# Keywords are matched by the identifier pattern and then looked up here
+keywords = MappingProxyType({
+    "print": "print",
+    "if": "if",
+    "else": "else",
+    "while": "while",
+    "continue": "continue",
+    "break": "break",
+    "function": "function",
+    "return": "return",
+    "assert": "assert",
+    "and": "and",
+    "or": "or",
+    "not": "not",
+})
+
 for pattern in patterns:
     pattern[0] = re.compile(pattern[0]) 
 
+def decode_escapes(value):
+    # The string pattern only lets \t, \n, \", \\ and \uXXXX through, and the
+    # unicode_escape codec decodes all of them in one pass.  It reads latin-1
+    # bytes, so other characters go through it as \u escapes.
+    return value.encode("latin-1", "backslashreplace").decode("unicode_escape")
+
+def token_value(tag, text):
+    """
+    Returns the value of a token from its tag and the text it matched.
+    """
+    if tag == "number":
+        if "." in text:
+            return float(text)
+        return int(text)
+    if tag == "identifier":
+        return intern(text)
+    if tag == "string":
+        value = text[1:-1]
+        if "\\" in value:
+            value = decode_escapes(value)
+        return value
+    return text
+
+class TokenizeError(Exception):
+    """
+    Text at source offset position that no token pattern accepts.
+    """
+    def __init__(self, message, position=None):
+        super().__init__(message)
+        self.position = position
+
+def syntax_error(characters, position):
+    """
+    Returns the TokenizeError for position in characters (a str, or bytes for
+    tokenize_file(), whose columns count bytes).
+    """
+    before = characters[:position]
+    newline = "\n" if type(before) is str else b"\n"
+    line = before.count(newline) + 1
+    column = position - before.rfind(newline)
+    return TokenizeError(f"Syntax error at line {line}, column {column} (offset {position})", position)
+
 def tokenize(characters):
     tokens = []
     position = 0
@@ -59,25 +113,14 @@ def tokenize(characters):
         assert match
         # (process errors)
         if tag == "error":
-            raise Exception("Syntax error")
+            raise syntax_error(characters, position)
+        if tag == "identifier":
+            tag = keywords.get(match.group(0), tag)
         token = {
             "tag":tag,
             "position":position,
-            "value":match.group(0)
+            "value":token_value(tag, match.group(0))
         }
-        if token["tag"] == "number":
-            if "." in token["value"]:
-                token["value"] = float(token["value"])
-            else:
-                token["value"] = int(token["value"])
-        if token["tag"] == "string":
-            value = token["value"]
-            value = value[1:-1]
-            value = value.replace("\\t","\t")
-            value = value.replace("\\n","\n")
-            value = value.replace('\\"','"')
-            value = value.replace('\\\\','\\')
-            token["value"] = value
         if token["tag"] != "whitespace":
             tokens.append(token)
         position = match.end()
@@ -89,6 +132,229 @@ def tokenize(characters):
     })
     return tokens
 
+# tokenize_lazy() leaves out the value of every token but identifiers.  A
+# token is a slotted object holding its tag, start and end offsets and the
+# source; the first time its value is read it is made from the slice of the
+# source, and kept.  It reads like a token dict (lookups, get(), `in` and ==
+# all see the value) and pickles as one, so parallel_parse() can send it to
+# other processes.
+unmade = object()
+
+class LazyToken(Mapping):
+    __slots__ = ("tag", "position", "end", "source", "made")
+
+    def __init__(self, tag, position, end, source, value=unmade):
+        self.tag = tag
+        self.position = position
+        self.end = end
+        self.source = source
+        self.made = value
+
+    def __getitem__(self, key):
+        if key == "tag":
+            return self.tag
+        if key == "position":
+            return self.position
+        if key != "value":
+            raise KeyError(key)
+        if self.made is unmade:
+            self.made = token_value(self.tag, self.source[self.position:self.end])
+        return self.made
+
+    def __iter__(self):
+        return iter(["tag", "position", "value"])
+
+    def __len__(self):
+        return 3
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+def tokenize_lazy(characters):
+    """
+    Returns the same tokens as tokenize(), but making their values only when they are used.
+    """
+    tokens = []
+    position = 0
+    while position < len(characters):
+        for pattern, tag in patterns:
+            match = pattern.match(characters, position)
+            if match:
+                break
+        assert match
+        # (process errors)
+        if tag == "error":
+            raise syntax_error(characters, position)
+        end = match.end()
+        if tag == "identifier":
+            text = match.group(0)
+            tag = keywords.get(text, tag)
+            if tag == "identifier":
+                tokens.append(LazyToken(tag, position, end, characters, intern(text)))
+            else:
+                tokens.append(LazyToken(tag, position, end, characters))
+        elif tag != "whitespace":
+            tokens.append(LazyToken(tag, position, end, characters))
+        position = end
+    # append end-of-stream marker
+    tokens.append({
+        "tag":None,
+        "value":None,
+        "position":position
+    })
+    return tokens
+
+# tokenize_file() runs the same patterns as bytes regexes over a memory map
+# of the file.  In bytes patterns \d and \s are ASCII only, so the only
+# difference from tokenize() on the decoded text is that non-ASCII digits and
+# spaces outside string literals are syntax errors, and positions are byte
+# offsets (the same as character offsets for ASCII source).
+byte_patterns = [[re.compile(pattern.pattern.encode("ascii")), tag] for pattern, tag in patterns]
+byte_keywords = {keyword.encode("ascii"): tag for keyword, tag in keywords.items()}
+byte_values = {}
+
+def tokenize_file(path):
+    """
+    Returns the tokens of a UTF-8 source file, decoding only identifiers and
+    strings (and converting numbers) from a memory map of the file.  Unlike
+    tokenize() on the text, digits and whitespace are ASCII only, CRLF line
+    ends are not translated, and positions are byte offsets.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return tokenize("")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return tokenize_bytes(data)
+
+def tokenize_bytes(data):
+    tokens = []
+    position = 0
+    while position < len(data):
+        for pattern, tag in byte_patterns:
+            match = pattern.match(data, position)
+            if match:
+                break
+        assert match
+        if tag == "error":
+            raise syntax_error(data, position)
+        text = match.group(0)
+        if tag == "identifier":
+            tag = byte_keywords.get(text, tag)
+        if tag == "identifier":
+            value = intern(text.decode("ascii"))
+        elif tag == "number":
+            value = float(text) if b"." in text else int(text)
+        elif tag == "string":
+            value = token_value(tag, text.decode("utf-8"))
+        else:
+            value = byte_values.get(text)
+            if value is None:
+                value = byte_values[text] = text.decode("ascii")
+        if tag != "whitespace":
+            tokens.append({
+                "tag":tag,
+                "position":position,
+                "value":value
+            })
+        position = match.end()
+    # append end-of-stream marker
+    tokens.append({
+        "tag":None,
+        "value":None,
+        "position":position
+    })
+    return tokens
+
+# Parallel tokenizing splits the source at whitespace outside string
+# literals.  Whitespace anywhere else is part of a whitespace token, which
+# is dropped, so every chunk starts at a token boundary of the whole source
+# and tokenizes exactly as that part of the source does in tokenize().
+string_rest = re.compile(r'(?:[^"\\]|\\[\s\S])*"')
+whitespace = re.compile(r"\s")
+
+def string_spans(characters):
+    """
+    Returns the (start, end) of every string literal, found the way the
+    tokenizer finds them: a quote outside a string starts one, and inside it
+    a backslash escapes the next character.
+    """
+    spans = []
+    position = characters.find('"')
+    while position >= 0:
+        match = string_rest.match(characters, position + 1)
+        end = match.end() if match else len(characters)
+        spans.append((position, end))
+        position = characters.find('"', end)
+    return spans
+
+def split_points(characters, count):
+    """
+    Returns up to count offsets, starting with 0, where the source can be
+    split into chunks of about equal size.
+    """
+    spans = string_spans(characters)
+    starts = [start for start, end in spans]
+    points = [0]
+    for i in range(1, count):
+        position = max(len(characters) * i // count, points[-1] + 1)
+        while True:
+            match = whitespace.search(characters, position)
+            if not match:
+                return points
+            position = match.start()
+            span = bisect.bisect_right(starts, position) - 1
+            if span >= 0 and position < spans[span][1]:
+                position = spans[span][1]
+            else:
+                break
+        points.append(position)
+    return points
+
+def tokenize_chunk(chunk):
+    characters, offset = chunk
+    try:
+        tokens = tokenize(characters)
+    except TokenizeError as e:
+        # the parent has the whole source to find the line and column in
+        raise TokenizeError(str(e), e.position + offset)
+    tokens.pop()
+    for token in tokens:
+        token["position"] += offset
+    return tokens
+
+def parallel_tokenize(characters, jobs=None, chunks=None, minimum_size=1 << 20):
+    """
+    Returns the same tokens as tokenize(), tokenizing chunks of the source in
+    a pool of jobs processes (one per core by default).  Sources shorter
+    than minimum_size are tokenized in this process.
+    """
+    jobs = jobs or multiprocessing.cpu_count()
+    if len(characters) < minimum_size or jobs < 2:
+        return tokenize(characters)
+    points = split_points(characters, chunks or jobs * 4) + [len(characters)]
+    pieces = [(characters[start:end], start) for start, end in zip(points, points[1:])]
+    try:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(tokenize_chunk, pieces)
+    except TokenizeError as e:
+        raise syntax_error(characters, e.position) from None
+    tokens = []
+    for result in results:
+        # identifiers come back from the workers as separate copies
+        for token in result:
+            if token["tag"] == "identifier":
+                token["value"] = intern(token["value"])
+        tokens.extend(result)
+    tokens.append({
+        "tag":None,
+        "value":None,
+        "position":len(characters)
+    })
+    return tokens
+
 def test_simple_token():
     print("test simple token")
     examples = "+-*/()=;<>{}[].,:"
@@ -140,6 +406,17 @@ def test_string_token():
     tokens = tokenize("\"ab\\\\c\"")
     assert tokens[0]["tag"] == "string"
     assert tokens[0]["value"] == "ab\\c"
+    # an escaped backslash followed by n is not a newline
+    tokens = tokenize("\"ab\\\\nc\\\\\\\\\"")
+    assert tokens[0]["value"] == "ab\\nc\\\\"
+    tokens = tokenize("\"caf\\u00e9 \\u00E9\\u0041\"")
+    assert tokens[0]["value"] == "caf\u00e9 \u00e9A"
+    for source in ["\"\\u00e\"", "\"\\x41\""]:
+        try:
+            tokenize(source)
+            assert False, f"Should have raised an error for {source}"
+        except Exception as e:
+            assert "Syntax error" in str(e), f"Unexpected exception: {e}"
 
 def test_multiple_tokens():
     print("test multiple tokens")
@@ -169,6 +446,97 @@ def test_identifier_tokens():
         assert t[0]["tag"] == "identifier"
         assert t[0]["value"] == s
 
+def test_interned_identifiers():
+    print("test interned identifiers")
+    source = "alpha = alpha + beta_"
+    tokens = tokenize(source)
+    assert tokens[0]["value"] is tokens[2]["value"]
+    assert tokens[0]["value"] is intern("alpha")
+    assert tokens[4]["value"] is intern("beta_")
+
+def test_keyword_prefixes():
+    print("test keyword prefixes")
+    for s in ["printer", "iffy", "elsewhere", "whiles", "functional", "returned", "order", "android", "notable", "print_"]:
+        t = tokenize(s)
+        assert len(t) == 2
+        assert t[0]["tag"] == "identifier", f"expected identifier, got {t[0]}"
+        assert t[0]["value"] == s
+    t = tokenize("print printer")
+    assert [token["tag"] for token in t] == ["print", "identifier", None]
+
+def test_lazy_tokens():
+    print("test lazy tokens")
+    source = 'x = 12 + 3.5 * y; if (x != "a\\tb") { print(x) }'
+    tokens = tokenize_lazy(source)
+    assert tokens[0]["value"] is intern("x")
+    assert tokens[2].made is unmade and tokens[2].get("value") == 12 and tokens[2].made == 12
+    assert "value" in tokens[4] and tokens[4]["value"] == 3.5
+    assert tokens[1] == {"tag": "=", "position": 2, "value": "="} and dict(tokens[5]) == tokenize(source)[5]
+    assert repr(tokens[12]) == "{'tag': 'string', 'position': 27, 'value': 'a\\tb'}"
+    assert tokens[12]["value"] == "a\tb"
+    assert tokens == tokenize(source)
+    try:
+        tokens[0]["end"]
+        assert False, "expected KeyError"
+    except KeyError:
+        pass
+    import pickle
+    copies = pickle.loads(pickle.dumps(tokenize_lazy(source)))
+    assert copies == tokenize(source) and all(type(token) is dict for token in copies)
+    try:
+        tokenize_lazy("x = $")
+        assert False, "Should have raised an error for an invalid character."
+    except Exception as e:
+        assert "Syntax error" in str(e), f"Unexpected exception: {e}"
+
+def test_tokenize_file():
+    print("test tokenize file")
+    import tempfile
+    source = 'x1 = 1.5 + .5 * 10; if (printer != "a\\"b\\n") { s = "tab\\t" } else { y = [1, 2.] }'
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.t")
+        with open(path, "w") as f:
+            f.write(source)
+        assert tokenize_file(path) == tokenize(source)
+        assert tokenize_file(path)[0]["value"] is intern("x1")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('s = "caf\u00e9"; t = s')
+        tokens = tokenize_file(path)
+        assert tokens[2]["value"] == "caf\u00e9"
+        assert [token["position"] for token in tokens[3:]] == [11, 13, 15, 17, 18]
+        with open(path, "w") as f:
+            f.write("")
+        assert tokenize_file(path) == [{"tag": None, "value": None, "position": 0}]
+        with open(path, "w") as f:
+            f.write("x = 1;\ny = $")
+        try:
+            tokenize_file(path)
+            assert False, "Should have raised an error for an invalid character."
+        except TokenizeError as e:
+            assert str(e) == "Syntax error at line 2, column 5 (offset 11)", f"Unexpected exception: {e}"
+
+def test_split_points():
+    print("test split points")
+    source = 'a = "x y \\" z";  b = "\\\\" + c'
+    assert string_spans(source) == [(4, 14), (21, 25)]
+    points = split_points(source, 8)
+    assert points == [0, 3, 15, 16, 18, 20, 25, 27], points
+    for point in points[1:]:
+        assert source[point].isspace()
+
+def test_parallel_tokenize():
+    print("test parallel tokenize")
+    source = "; ".join(f'x{i} = "a b\\" {i}" + y{i % 7} * {i}.5' for i in range(300))
+    tokens = parallel_tokenize(source, jobs=2, chunks=7, minimum_size=0)
+    assert tokens == tokenize(source)
+    assert tokens[8]["value"] is intern("x1")
+    assert parallel_tokenize("x = 1", jobs=2) == tokenize("x = 1")
+    try:
+        parallel_tokenize(source + ";\n $", jobs=2, minimum_size=0)
+        assert False, "Should have raised an error for an invalid character."
+    except TokenizeError as e:
+        assert str(e) == f"Syntax error at line 2, column 2 (offset {len(source) + 3})", f"Unexpected exception: {e}"
+
 def test_error():
     print("test error")
     try:
@@ -176,6 +544,167 @@ def test_error():
         assert False, "Should have raised an error for an invalid character."
     except Exception as e:
         assert "Syntax error" in str(e),f"Unexpected exception: {e}"
+    try:
+        tokenize("x = 1;\n\ny = 2 @ 3")
+        assert False, "Should have raised an error for an invalid character."
+    except TokenizeError as e:
+        assert e.position == 14 and str(e) == "Syntax error at line 3, column 7 (offset 14)", str(e)
+
+def benchmark_tokenize_file():
+    """
+    Times and measures peak memory of reading a file and tokenizing it,
+    against tokenize_file().
+    """
+    import tempfile, time, tracemalloc
+    import benchmark
+    source = "\n".join(benchmark.load_programs().values()) * 20
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.t")
+        with open(path, "w") as f:
+            f.write(source)
+        print(f"{len(source)} characters")
+        print("            seconds   peak memory (KB)")
+
+        def read_and_tokenize():
+            with open(path, "r") as f:
+                return tokenize(f.read())
+
+        for label, function in [("read", read_and_tokenize), ("mmap", lambda: tokenize_file(path))]:
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label:>6} {elapsed:>12.3f} {peak / 1024:>18.0f}")
+
+def benchmark_escapes():
+    """
+    Times decoding string-heavy source with four str.replace passes per
+    literal, as tokenize() used to, and with the single-pass decoder.
+    """
+    import time
+
+    def replace_four_times(tag, text):
+        value = text[1:-1]
+        value = value.replace("\\t","\t")
+        value = value.replace("\\n","\n")
+        value = value.replace('\\"','"')
+        value = value.replace('\\\\','\\')
+        return value
+
+    plain = '"' + "lorem ipsum dolor sit amet " * 400 + '"'
+    escaped = '"' + 'lorem ipsum\\tdolor\\n sit \\"amet\\" ' * 400 + '"'
+    short = '"key"'
+    print("literals                   four replaces (s)   single pass (s)")
+    for label, literals in [("10 KB, no escapes", [plain] * 2000), ("14 KB, 1600 escapes", [escaped] * 2000),
+                            ("short, no escapes", [short] * 200000)]:
+        times = []
+        for decode in [replace_four_times, token_value]:
+            start = time.perf_counter()
+            for literal in literals:
+                decode("string", literal)
+            times.append(time.perf_counter() - start)
+        print(f"{label:<24} {times[0]:>19.3f} {times[1]:>17.3f}")
+
+def benchmark_lazy():
+    """
+    Times tokenize() and tokenize_lazy(), and measures the memory their tokens take.
+    """
+    import time, tracemalloc
+    import benchmark
+    source = "\n".join(benchmark.load_programs().values()) * 20
+    print(f"{len(source)} characters")
+    print("        tokenize (s)   token memory (KB)")
+    for label, function in [("eager", tokenize), ("lazy", tokenize_lazy)]:
+        start = time.perf_counter()
+        function(source)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        tokens = function(source)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tokens
+        print(f"{label:>5} {elapsed:>14.3f} {memory / 1024:>19.0f}")
+
+def benchmark_parallel():
+    """
+    Times tokenize() and parallel_tokenize() with 2, 4, ... processes up to the number of cores.
+    """
+    import time
+    import benchmark
+    source = "\n".join(benchmark.load_programs().values()) * 20
+    cores = multiprocessing.cpu_count()
+    print(f"{len(source)} characters, {cores} core(s)")
+    start = time.perf_counter()
+    expected = tokenize(source)
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    split_points(source, 64)
+    print(f"pre-scan {time.perf_counter() - start:.3f} s")
+    print("processes   seconds   speedup")
+    print(f"{1:>9} {serial:>9.3f} {1:>9.2f}")
+    jobs = 2
+    while True:
+        start = time.perf_counter()
+        # the source is below the default minimum_size, which would tokenize it serially
+        tokens = parallel_tokenize(source, jobs, minimum_size=0)
+        elapsed = time.perf_counter() - start
+        assert tokens == expected
+        print(f"{jobs:>9} {elapsed:>9.3f} {serial / elapsed:>9.2f}")
+        if jobs >= cores:
+            break
+        jobs = min(jobs * 2, cores)
+
+def benchmark_keywords():
+    """
+    Times identifier-heavy source with keywords looked up after the identifier
+    pattern matches, and with each keyword tried as its own pattern first.
+    """
+    global patterns, keywords
+    import time
+    names = ["printer", "iffy", "total", "index", "returned", "order", "x", "value_2"]
+    source = " ".join(f"{names[i % 8]} = {names[(i * 3) % 8]} + {names[(i * 5) % 8]};" for i in range(20000))
+    saved = patterns, keywords
+    print("keyword lookup   seconds")
+    for lookup in [True, False]:
+        if not lookup:
+            # the old table: keyword patterns ahead of the identifier pattern
+            patterns = [[re.compile(keyword), tag] for keyword, tag in saved[1].items()] + saved[0]
+            keywords = {}
+        start = time.perf_counter()
+        tokenize(source)
+        print(f"{str(lookup):>14} {time.perf_counter() - start:>9.3f}")
+    patterns, keywords = saved
+
+def benchmark_interning():
+    """
+    Measures token memory and environment lookups with and without interning.
+    """
+    global intern
+    import time, tracemalloc
+    import parser, evaluator
+    names = [f"variable_{i}" for i in range(100)]
+    statements = [f"{names[i % 100]} = {names[(i * 7) % 100]} + {names[(i * 13) % 100]}" for i in range(20000)]
+    source = "; ".join(names[i] + " = " + str(i) for i in range(100)) + "; " + "; ".join(statements)
+    loop = "i = 0; while (i < 2000) { " + "; ".join(statements[:50]) + "; i = i + 1 }"
+    loop = "; ".join(names[i] + " = " + str(i) for i in range(100)) + "; " + loop
+    saved = intern
+    print("interned   token memory (KB)   lookup loop (s)")
+    for interned in [True, False]:
+        intern = saved if interned else (lambda s: s)
+        tracemalloc.start()
+        tokens = tokenize(source)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tokens
+        ast = parser.parse(tokenize(loop))
+        start = time.perf_counter()
+        evaluator.evaluate(ast, {})
+        elapsed = time.perf_counter() - start
+        print(f"{str(interned):>8} {memory / 1024:>20.0f} {elapsed:>17.3f}")
+    intern = saved
 
 if __name__ == "__main__":
     test_simple_token()
@@ -185,4 +714,17 @@ if __name__ == "__main__":
     test_whitespace()
     test_keywords()
     test_identifier_tokens()
-    test_error()
\ No newline at end of file
+    test_interned_identifiers()
+    test_keyword_prefixes()
+    test_error()
+    test_lazy_tokens()
+    test_tokenize_file()
+    test_split_points()
+    test_parallel_tokenize()
+    if "benchmark" in sys.argv:
+        benchmark_interning()
+        benchmark_keywords()
+        benchmark_escapes()
+        benchmark_lazy()
+        benchmark_parallel()
+        benchmark_tokenize_file()
\ No newline at end of file
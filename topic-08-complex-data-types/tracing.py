@@ -0,0 +1,364 @@
+"""
+tracing.py
+
+Execution events from the evaluator, delivered to listener objects.
+
+A listener subclasses Listener and overrides the events it wants:
+
+    enter(node, environment)            before a node is evaluated
+    exit(node, environment, value)      after it, with its value
+    read(name, value)                   a variable was read
+    write(name, value)                  a variable was assigned
+    call(function, arguments)           a function or built-in is called
+    returned(function, value)           ... and returned
+    iteration(node, environment)        a while loop starts another pass
+
+The evaluator runs every node and every call through evaluator.evaluate_step
+and evaluator.call_step.  Installing the first listener binds them to
+traced versions, so a run is traced however evaluate() was imported, and
+removing the last listener binds them back to the untraced versions, which
+check for nothing.  Listeners belong to the thread that installed them, and
+evaluations in other threads are not traced.  Dict, nodes.py and flat.py
+ASTs all run through the same steps, so all of them are traced.
+"""
+
+import sys
+import threading
+import time
+
+import evaluator
+
+events = ["enter", "exit", "read", "write", "call", "returned", "iteration"]
+
+listeners = []
+
+# for each event, the bound methods of the listeners that override it
+handlers = {event: [] for event in events}
+
+# the nodes being evaluated, innermost last
+stack = []
+
+# the thread the listeners were installed in
+owner = None
+
+class Listener:
+    def enter(self, node, environment):
+        pass
+
+    def exit(self, node, environment, value):
+        pass
+
+    def read(self, name, value):
+        pass
+
+    def write(self, name, value):
+        pass
+
+    def call(self, function, arguments):
+        pass
+
+    def returned(self, function, value):
+        pass
+
+    def iteration(self, node, environment):
+        pass
+
+def update_handlers():
+    for event in events:
+        handlers[event] = [
+            getattr(listener, event) for listener in listeners
+            if getattr(type(listener), event) is not getattr(Listener, event)
+        ]
+    if listeners:
+        evaluator.evaluate_step = traced_evaluate
+        evaluator.call_step = traced_call_function
+    else:
+        evaluator.evaluate_step = evaluator.evaluate_untraced
+        evaluator.call_step = evaluator.call_untraced
+
+def add_listener(listener):
+    global owner
+    thread = threading.get_ident()
+    assert not listeners or owner == thread, "Listeners are already installed by another thread."
+    owner = thread
+    listeners.append(listener)
+    update_handlers()
+
+def remove_listener(listener):
+    listeners.remove(listener)
+    update_handlers()
+
+class listening:
+    """
+    Context manager that installs listeners for the duration of a block.
+    """
+    def __init__(self, *listeners):
+        self.listeners = listeners
+
+    def __enter__(self):
+        for listener in self.listeners:
+            add_listener(listener)
+        return self.listeners[0] if len(self.listeners) == 1 else self.listeners
+
+    def __exit__(self, *exception):
+        for listener in self.listeners:
+            remove_listener(listener)
+        return False
+
+def traced_evaluate(ast, environment):
+    if threading.get_ident() != owner:
+        return evaluator.evaluate_untraced(ast, environment)
+    if stack:
+        parent = stack[-1]
+        if parent["tag"] == "while" and ast is parent["do"]:
+            for handler in handlers["iteration"]:
+                handler(parent, environment)
+    for handler in handlers["enter"]:
+        handler(ast, environment)
+    stack.append(ast)
+    try:
+        result = evaluator.evaluate_untraced(ast, environment)
+    finally:
+        stack.pop()
+    tag = ast["tag"]
+    if tag == "identifier":
+        for handler in handlers["read"]:
+            handler(ast["value"], result[0])
+    elif tag == "assign" and ast["target"]["tag"] == "identifier":
+        name = ast["target"]["value"]
+        for handler in handlers["write"]:
+            handler(name, environment[name])
+    for handler in handlers["exit"]:
+        handler(ast, environment, result[0])
+    return result
+
+def traced_call_function(function, arguments):
+    if threading.get_ident() != owner:
+        return evaluator.call_untraced(function, arguments)
+    for handler in handlers["call"]:
+        handler(function, arguments)
+    value = evaluator.call_untraced(function, arguments)
+    for handler in handlers["returned"]:
+        handler(function, value)
+    return value
+
+class Tracer(Listener):
+    """
+    Writes one line per event, indented by nesting depth.
+    """
+    def __init__(self, output=None):
+        self.output = output or sys.stdout
+        self.depth = 0
+
+    def line(self, text):
+        self.output.write("  " * self.depth + text + "\n")
+
+    def enter(self, node, environment):
+        self.line(f"enter {node['tag']}")
+        self.depth += 1
+
+    def exit(self, node, environment, value):
+        self.depth -= 1
+        self.line(f"exit {node['tag']} -> {value!r}")
+
+    def read(self, name, value):
+        self.line(f"read {name} = {value!r}")
+
+    def write(self, name, value):
+        self.line(f"write {name} = {value!r}")
+
+    def call(self, function, arguments):
+        self.line(f"call {describe_function(function)} {arguments!r}")
+
+    def returned(self, function, value):
+        self.line(f"return {describe_function(function)} -> {value!r}")
+
+    def iteration(self, node, environment):
+        self.line("iteration")
+
+def describe_function(function):
+    if callable(function):
+        for name, builtin in evaluator.builtin_functions.items():
+            if builtin is function:
+                return name
+        return repr(function)
+    return "function(" + ", ".join(evaluator.parameter_names(function)) + ")"
+
+class Counter(Listener):
+    """
+    Counts events, and node entries by tag.
+    """
+    def __init__(self):
+        self.counts = {event: 0 for event in events}
+        self.tags = {}
+
+    def enter(self, node, environment):
+        self.counts["enter"] += 1
+        self.tags[node["tag"]] = self.tags.get(node["tag"], 0) + 1
+
+    def exit(self, node, environment, value):
+        self.counts["exit"] += 1
+
+    def read(self, name, value):
+        self.counts["read"] += 1
+
+    def write(self, name, value):
+        self.counts["write"] += 1
+
+    def call(self, function, arguments):
+        self.counts["call"] += 1
+
+    def returned(self, function, value):
+        self.counts["returned"] += 1
+
+    def iteration(self, node, environment):
+        self.counts["iteration"] += 1
+
+def run(source, environment=None):
+    from tokenizer import tokenize
+    from parser import parse
+    return evaluator.evaluate(parse(tokenize(source)), environment)
+
+def test_fast_path():
+    print("testing fast path")
+    untraced = (evaluator.evaluate_untraced, evaluator.call_untraced)
+    assert (evaluator.evaluate_step, evaluator.call_step) == untraced
+    listener = Listener()
+    with listening(listener):
+        assert (evaluator.evaluate_step, evaluator.call_step) == (traced_evaluate, traced_call_function)
+        assert all(handlers[event] == [] for event in events)
+    assert (evaluator.evaluate_step, evaluator.call_step) == untraced
+
+def test_imported_and_threads():
+    print("testing imported evaluate and threads")
+    from evaluator import evaluate
+    from tokenizer import tokenize
+    from parser import parse
+    ast = parse(tokenize("function f(x) { return x }; y = f(1)"))
+    counter = Counter()
+    other = Counter()
+    with listening(counter):
+        # imported before the listener was installed, and still traced
+        evaluate(ast, {})
+        entered = counter.counts["enter"]
+        assert entered > 0 and counter.counts["call"] == 1
+        # another thread runs untraced
+        thread = threading.Thread(target=evaluate, args=(ast, {}))
+        thread.start()
+        thread.join()
+        assert counter.counts["enter"] == entered and counter.counts["call"] == 1
+        errors = []
+        def install():
+            try:
+                add_listener(other)
+            except AssertionError as e:
+                errors.append(e)
+        thread = threading.Thread(target=install)
+        thread.start()
+        thread.join()
+        assert errors and other not in listeners
+
+def test_events():
+    print("testing events")
+    log = []
+
+    class Recorder(Listener):
+        def read(self, name, value):
+            log.append(("read", name, value))
+
+        def write(self, name, value):
+            log.append(("write", name, value))
+
+        def call(self, function, arguments):
+            log.append(("call", describe_function(function), arguments))
+
+        def returned(self, function, value):
+            log.append(("return", describe_function(function), value))
+
+        def iteration(self, node, environment):
+            log.append(("iteration", environment["i"]))
+
+    with listening(Recorder()):
+        run("function f(x) { return x + 1 }; i = 0; while (i < 2) { i = f(i) }; n = len([i])")
+    assert log == [
+        ("write", "f", log[0][2]), ("write", "i", 0),
+        ("read", "i", 0), ("iteration", 0), ("read", "f", log[0][2]), ("read", "i", 0),
+        ("call", "function(x)", [0]), ("read", "x", 0), ("return", "function(x)", 1), ("write", "i", 1),
+        ("read", "i", 1), ("iteration", 1), ("read", "f", log[0][2]), ("read", "i", 1),
+        ("call", "function(x)", [1]), ("read", "x", 1), ("return", "function(x)", 2), ("write", "i", 2),
+        ("read", "i", 2),
+        ("read", "len", len), ("read", "i", 2), ("call", "len", [[2]]), ("return", "len", 1), ("write", "n", 1),
+    ], log
+
+def test_enter_exit():
+    print("testing enter and exit")
+    import contextlib, io
+    counter = Counter()
+    with listening(counter), contextlib.redirect_stdout(io.StringIO()):
+        run("x = 1 + 2; if (x > 2) { print(x) }")
+    # the top-level program node is entered through the traced evaluate too
+    assert counter.counts["enter"] == counter.counts["exit"] == 12
+    assert counter.tags == {"program": 1, "assign": 1, "+": 1, "number": 3, "if": 1, ">": 1,
+                            "identifier": 2, "block": 1, "print": 1}
+    # exceptions unwind the node stack
+    try:
+        with listening(Counter()):
+            run("x = 1; y = z")
+    except Exception:
+        pass
+    assert stack == [] and evaluator.evaluate_step is evaluator.evaluate_untraced
+
+def test_nodes():
+    print("testing nodes")
+    from tokenizer import tokenize
+    from parser import parse
+    source = "function f(x) { return x * 2 }; i = 0; while (i < 2) { i = i + 1 }; y = f(i)"
+    counters = []
+    for nodes in [False, True]:
+        counter = Counter()
+        with listening(counter):
+            environment = {}
+            evaluator.evaluate(parse(tokenize(source), nodes=nodes), environment)
+        assert environment["y"] == 4
+        counters.append(counter)
+    # a nodes.py AST gives the same events as the dict AST
+    assert counters[1].counts == counters[0].counts and counters[1].tags == counters[0].tags
+    assert counters[1].counts["call"] == 1 and counters[1].counts["iteration"] == 2
+
+def test_tracer():
+    print("testing tracer")
+    import io
+    output = io.StringIO()
+    with listening(Tracer(output)):
+        run("x = 2")
+    assert output.getvalue().splitlines() == [
+        "enter program", "  enter assign", "    enter number", "    exit number -> 2",
+        "    write x = 2", "  exit assign -> None", "exit program -> None",
+    ], output.getvalue()
+
+def benchmark_overhead():
+    """
+    Times a loop with no listener, and with a listener that handles no events and every event.
+    """
+    from tokenizer import tokenize
+    from parser import parse
+    ast = parse(tokenize("i = 0; total = 0; while (i < 20000) { total = total + i * 2; i = i + 1 }"))
+    for label, listener in [("no listener", None), ("empty listener", Listener()), ("counter", Counter())]:
+        start = time.perf_counter()
+        if listener is None:
+            evaluator.evaluate(ast, {})
+        else:
+            with listening(listener):
+                evaluator.evaluate(ast, {})
+        print(f"{label:>15}: {time.perf_counter() - start:.4f} s")
+
+if __name__ == "__main__":
+    test_fast_path()
+    test_imported_and_threads()
+    test_events()
+    test_enter_exit()
+    test_nodes()
+    test_tracer()
+    if "benchmark" in sys.argv:
+        benchmark_overhead()
+    print("done.")